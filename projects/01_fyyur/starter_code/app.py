@@ -3,29 +3,107 @@
 #----------------------------------------------------------------------------#
 
 import json
+import os
+import hashlib
+import click
 import dateutil.parser
 import babel
-import sys
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort
+import babel.dates
+from bisect import bisect_left, insort
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta, timezone
+from functools import lru_cache, wraps
+from flask import Flask, Blueprint, render_template, request, Response, flash, redirect, url_for, jsonify, abort, g, has_app_context
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
-from sqlalchemy.dialects.postgresql import ARRAY
-import logging
-from logging import Formatter, FileHandler
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import object_session, sessionmaker
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 from flask_wtf import Form
 from flask_migrate import Migrate
 from forms import *
+from search import NameSearch
+from cache import TaggedCache
+from importer import Importer, text_value, bool_value
+from seed import SyntheticData, insert_rows
+from metrics import RequestMetrics
+from logs import RequestLogging
+from fragments import FragmentCache
 
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
+class RoutingSession(SignallingSession):
+    # Inside @replica_read views queries go to the 'replica' bind when one is
+    # configured; flushes, and everything outside those views, use the primary.
+
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if (not self._flushing and has_app_context() and g.get('read_replica')
+                and 'replica' in self.app.config['SQLALCHEMY_BINDS']):
+            return self.db.get_engine(self.app, bind='replica')
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        # Pool and timeout settings from config.py; SQLite keeps its own pooling
+        sa_url, options = SQLAlchemy.apply_driver_hacks(self, app, sa_url, options)
+        if sa_url.drivername.startswith('sqlite'):
+            return sa_url, options
+        options.update({
+            'pool_size': app.config['DB_POOL_SIZE'],
+            'max_overflow': app.config['DB_MAX_OVERFLOW'],
+            'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+            'pool_recycle': app.config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': app.config['DB_POOL_PRE_PING']
+        })
+        if sa_url.drivername.startswith('postgres') and app.config['DB_STATEMENT_TIMEOUT']:
+            options.setdefault('connect_args', {})['options'] = \
+                '-c statement_timeout={}'.format(app.config['DB_STATEMENT_TIMEOUT'])
+        return sa_url, options
+
+
+def replica_read(view):
+    # Marks a view as read-only so its queries can be served by the replica
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def primary_read(enabled=True):
+    # Reads that fill a shared cache go to the primary even inside a
+    # @replica_read view, so a lagging replica is never cached after a write
+    previous = g.get('read_replica') if has_app_context() else None
+    if enabled and has_app_context():
+        g.read_replica = False
+    try:
+        yield
+    finally:
+        if enabled and has_app_context():
+            g.read_replica = previous
+
+
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app, db)
+metrics = RequestMetrics(app)
+# JSON lines in LOG_FILE through a background thread, when not in debug mode
+request_logging = RequestLogging(app)
 
 # DONE: connect to a local postgresql database
 
@@ -35,11 +113,19 @@ migrate = Migrate(app, db)
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_Venue_state_city_id', 'state', 'city', 'id'),
+        db.Index('ix_Venue_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_Venue_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
+    # The area events need the old city, state and deleted_at, also when the
+    # attribute was expired by a commit before it was set
+    city = db.column_property(db.Column(db.String(120)), active_history=True)
+    state = db.column_property(db.Column(db.String(120)), active_history=True)
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
@@ -47,6 +133,14 @@ class Venue(db.Model):
     website = db.Column(db.String(500))
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(1024))
+    # Denormalized, kept current by the Show counters below
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Bumped by every UPDATE, including the show counters; feeds API ETags
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1',
+                        onupdate=db.literal_column('version + 1'))
+    # Set when the venue is deleted; purge_deleted removes the row later
+    deleted_at = db.column_property(db.Column(db.DateTime), active_history=True)
     # Relations
     # DONE: Genres is a n:m with venue, show is a 1:n with venue
     genres= db.Column(ARRAY(db.String()), nullable=False)
@@ -72,6 +166,12 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_Artist_name_id', 'name', 'id'),
+        db.Index('ix_Artist_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_Artist_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     city = db.Column(db.String(120))
@@ -83,6 +183,13 @@ class Artist(db.Model):
     website = db.Column(db.String(500))
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(1024))
+    # Denormalized, kept current by the Show counters below
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1',
+                        onupdate=db.literal_column('version + 1'))
+    # Set when the artist is deleted; purge_deleted removes the row later
+    deleted_at = db.Column(db.DateTime)
     shows = db.relationship('Show', backref='artists',
                             lazy=True, cascade="delete")
     def __repr__(self):
@@ -98,10 +205,22 @@ class Artist(db.Model):
 
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'))
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'))
-    start_time = db.Column(db.DateTime, nullable=False)
+    # The counters and cache tags need the old values of these three, also
+    # when the attribute was expired by a commit before it was set
+    venue_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('Venue.id')), active_history=True)
+    artist_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('Artist.id')), active_history=True)
+    start_time = db.column_property(
+        db.Column(db.DateTime, nullable=False), active_history=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1',
+                        onupdate=db.literal_column('version + 1'))
     def __repr__(self):
         return f'<Show \
         {self.id}, \
@@ -109,21 +228,582 @@ class Show(db.Model):
         {self.artist_id},\
         {self.start_time}>'
 
+
+class Area(db.Model):
+    # One row per (state, city) with live venues, kept current by the area
+    # events below; `flask rebuild-areas` recomputes it from Venue
+    __tablename__ = 'Area'
+    state = db.Column(db.String(120), primary_key=True)
+    city = db.Column(db.String(120), primary_key=True)
+    venue_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+
+class ShowCountWatermark(db.Model):
+    # Single row. In the denormalized counts a show is upcoming while its
+    # start_time is after rolled_over_at; roll_over_show_counts advances it.
+    __tablename__ = 'ShowCountWatermark'
+    id = db.Column(db.Integer, primary_key=True)
+    rolled_over_at = db.Column(db.DateTime, nullable=False)
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+def show_count_watermark(connection):
+    # FOR SHARE makes a concurrent rollover wait for this transaction
+    table = ShowCountWatermark.__table__
+    rolled_over_at = connection.execute(
+        db.select([table.c.rolled_over_at]).with_for_update(read=True)).scalar()
+    if rolled_over_at is None:
+        rolled_over_at = datetime.now()
+        connection.execute(table.insert().values(id=1, rolled_over_at=rolled_over_at))
+    return rolled_over_at
+
+
+def adjust_show_counts(connection, venue_id, artist_id, start_time, delta):
+    column = 'upcoming_show_count' \
+        if start_time > show_count_watermark(connection) else 'past_show_count'
+    for model, row_id in ((Venue, venue_id), (Artist, artist_id)):
+        if row_id is None:
+            continue
+        table = model.__table__
+        connection.execute(table.update().where(table.c.id == row_id).values(
+            {column: table.c[column] + delta}))
+    if venue_id is not None and column == 'upcoming_show_count':
+        adjust_area_upcoming(connection, [{'venue_id': venue_id, 'delta': delta}])
+
+
+@event.listens_for(Show, 'after_insert')
+def count_inserted_show(mapper, connection, show):
+    adjust_show_counts(connection, show.venue_id, show.artist_id, show.start_time, 1)
+
+
+@event.listens_for(Show, 'after_delete')
+def count_deleted_show(mapper, connection, show):
+    adjust_show_counts(connection, show.venue_id, show.artist_id, show.start_time, -1)
+
+
+@event.listens_for(Show, 'after_update')
+def count_updated_show(mapper, connection, show):
+    state = inspect(show)
+    old = {}
+    for attr in ('venue_id', 'artist_id', 'start_time'):
+        history = state.attrs[attr].history
+        old[attr] = history.deleted[0] if history.deleted else getattr(show, attr)
+    if old == {'venue_id': show.venue_id, 'artist_id': show.artist_id,
+               'start_time': show.start_time}:
+        return
+    adjust_show_counts(connection, old['venue_id'], old['artist_id'], old['start_time'], -1)
+    adjust_show_counts(connection, show.venue_id, show.artist_id, show.start_time, 1)
+
+
+def roll_over_show_counts(now=None):
+    # Moves shows that started since the last run from upcoming to past,
+    # with one set-based UPDATE per table. Meant to run every minute or so.
+    now = now or datetime.now()
+    watermark = ShowCountWatermark.query.with_for_update().first()
+    if watermark is None:
+        watermark = ShowCountWatermark(id=1, rolled_over_at=now)
+        db.session.add(watermark)
+    previous = watermark.rolled_over_at
+    if now <= previous:
+        db.session.commit()
+        return 0
+
+    moved_total = 0
+    for model, foreign_key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+        moved = db.session.query(
+            foreign_key.label('id'), func.count(Show.id).label('moved')).filter(
+            Show.start_time > previous, Show.start_time <= now,
+            foreign_key.isnot(None)).group_by(foreign_key).subquery()
+        table = model.__table__
+        result = db.session.execute(table.update().where(table.c.id == moved.c.id).values(
+            upcoming_show_count=table.c.upcoming_show_count - moved.c.moved,
+            past_show_count=table.c.past_show_count + moved.c.moved))
+        moved_total += result.rowcount
+    venue = Venue.__table__
+    area = Area.__table__
+    moved = db.select([venue.c.state, venue.c.city, func.count(Show.id).label('moved')]).where(
+        db.and_(Show.venue_id == venue.c.id, venue.c.deleted_at.is_(None),
+                Show.start_time > previous, Show.start_time <= now)).group_by(
+        venue.c.state, venue.c.city).alias('moved')
+    db.session.execute(area.update().where(db.and_(
+        area.c.state == moved.c.state, area.c.city == moved.c.city)).values(
+        upcoming_show_count=area.c.upcoming_show_count - moved.c.moved))
+    watermark.rolled_over_at = now
+    db.session.commit()
+    return moved_total
+
+
+def actual_show_counts(foreign_key, watermark):
+    return db.session.query(
+        foreign_key.label('id'),
+        func.count(Show.id).filter(Show.start_time > watermark).label('upcoming'),
+        func.count(Show.id).filter(Show.start_time <= watermark).label('past')).filter(
+        foreign_key.isnot(None)).group_by(foreign_key).subquery()
+
+
+def show_count_drift():
+    # Recomputes every count from Show and returns the rows that disagree
+    watermark = show_count_watermark(db.session.connection())
+    drift = []
+    for model, foreign_key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+        actual = actual_show_counts(foreign_key, watermark)
+        upcoming = func.coalesce(actual.c.upcoming, 0)
+        past = func.coalesce(actual.c.past, 0)
+        rows = db.session.query(
+            model.id, model.upcoming_show_count, model.past_show_count,
+            upcoming.label('actual_upcoming'), past.label('actual_past')).outerjoin(
+            actual, actual.c.id == model.id).filter(db.or_(
+                model.upcoming_show_count != upcoming,
+                model.past_show_count != past)).order_by(model.id)
+        drift.extend((model.__tablename__, row) for row in rows)
+    return drift
+
+
+def recount_show_counts():
+    # Rewrites every count from Show with one UPDATE per table
+    watermark = show_count_watermark(db.session.connection())
+    for model, foreign_key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+        table = model.__table__
+        counts = {}
+        for name, condition in (('upcoming_show_count', Show.start_time > watermark),
+                                ('past_show_count', Show.start_time <= watermark)):
+            counts[name] = db.select([func.count(Show.id)]).where(db.and_(
+                foreign_key == table.c.id, condition)).as_scalar()
+        db.session.execute(table.update().values(counts))
+    rebuild_areas()
+
+#----------------------------------------------------------------------------#
+# Area catalog.
+#----------------------------------------------------------------------------#
+
+def adjust_area(connection, state, city, venues, upcoming):
+    # Upserts the (state, city) row and drops it once no venue is left
+    if state is None or city is None or not (venues or upcoming):
+        return
+    table = Area.__table__
+    insert = pg_insert(table).values(
+        state=state, city=city, venue_count=venues, upcoming_show_count=upcoming)
+    connection.execute(insert.on_conflict_do_update(
+        index_elements=[table.c.state, table.c.city], set_={
+            'venue_count': table.c.venue_count + insert.excluded.venue_count,
+            'upcoming_show_count': table.c.upcoming_show_count + insert.excluded.upcoming_show_count}))
+    if venues < 0:
+        connection.execute(table.delete().where(db.and_(
+            table.c.state == state, table.c.city == city, table.c.venue_count <= 0)))
+
+
+def adjust_area_upcoming(connection, deltas):
+    # deltas: [{'venue_id': ..., 'delta': ...}], applied to each live venue's area
+    if not deltas:
+        return
+    area = Area.__table__
+    venue = Venue.__table__
+    connection.execute(area.update().where(db.and_(
+        venue.c.id == db.bindparam('venue_id'), venue.c.deleted_at.is_(None),
+        area.c.state == venue.c.state, area.c.city == venue.c.city)).values(
+        upcoming_show_count=area.c.upcoming_show_count + db.bindparam('delta')), deltas)
+
+
+def venue_upcoming_show_count(connection, venue_id):
+    # Read from the row, the ORM attribute misses the counters' Core updates
+    table = Venue.__table__
+    return connection.execute(db.select([table.c.upcoming_show_count]).where(
+        table.c.id == venue_id)).scalar() or 0
+
+
+@event.listens_for(Venue, 'after_insert')
+def add_venue_area(mapper, connection, venue):
+    if venue.deleted_at is None:
+        adjust_area(connection, venue.state, venue.city, 1, venue.upcoming_show_count or 0)
+
+
+@event.listens_for(Venue, 'after_update')
+def move_venue_area(mapper, connection, venue):
+    # Covers moves to another city or state and soft deletes
+    state = inspect(venue)
+    old = {}
+    for attr in ('state', 'city', 'deleted_at'):
+        history = state.attrs[attr].history
+        old[attr] = history.deleted[0] if history.deleted else getattr(venue, attr)
+    if (old['state'], old['city'], old['deleted_at'] is None) == \
+            (venue.state, venue.city, venue.deleted_at is None):
+        return
+    upcoming = venue_upcoming_show_count(connection, venue.id)
+    if old['deleted_at'] is None:
+        adjust_area(connection, old['state'], old['city'], -1, -upcoming)
+    if venue.deleted_at is None:
+        adjust_area(connection, venue.state, venue.city, 1, upcoming)
+
+
+@event.listens_for(Venue, 'before_delete')
+def remove_venue_area(mapper, connection, venue):
+    # before_delete runs after the cascaded shows are gone, while the row is still there
+    if venue.deleted_at is None:
+        adjust_area(connection, venue.state, venue.city, -1,
+                    -venue_upcoming_show_count(connection, venue.id))
+
+
+def actual_areas():
+    return db.session.query(
+        Venue.state, Venue.city, func.count(Venue.id).label('venue_count'),
+        func.sum(Venue.upcoming_show_count).label('upcoming_show_count')).filter(
+        Venue.deleted_at.is_(None), Venue.state.isnot(None), Venue.city.isnot(None)).group_by(
+        Venue.state, Venue.city)
+
+
+def rebuild_areas():
+    # Recomputes the whole catalog with one INSERT ... SELECT
+    table = Area.__table__
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(
+        ['state', 'city', 'venue_count', 'upcoming_show_count'], actual_areas().subquery()))
+    db.session.commit()
+
+
+def area_catalog(state=None):
+    # Without a state: one entry per state. With one: that state's cities.
+    if state:
+        rows = db.session.query(
+            Area.city.label('name'), Area.venue_count, Area.upcoming_show_count).filter(
+            Area.state == state).order_by(Area.city)
+        return [dict(row._asdict(), url=url_for('shows', state=state, city=row.name))
+                for row in rows]
+    rows = db.session.query(
+        Area.state.label('name'), func.sum(Area.venue_count).label('venue_count'),
+        func.sum(Area.upcoming_show_count).label('upcoming_show_count')).group_by(
+        Area.state).order_by(Area.state)
+    return [dict(row._asdict(), url=page_url(state=row.name)) for row in rows]
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+SEARCH_LIMIT = 50
+
+venue_search = NameSearch(db, Venue)
+artist_search = NameSearch(db, Artist)
+
+#----------------------------------------------------------------------------#
+# Caching.
+#----------------------------------------------------------------------------#
+
+DETAIL_CACHE_TTL = 60
+
+detail_cache = TaggedCache(ttl=DETAIL_CACHE_TTL)
+
+FACET_CACHE_MAX_ENTRIES = 256
+
+# Genre facet counts. Kept apart from detail_cache: every query string can
+# ask for another genre combination, and those must not evict detail pages.
+facet_cache = TaggedCache(ttl=DETAIL_CACHE_TTL, max_entries=FACET_CACHE_MAX_ENTRIES)
+
+# Rendered template fragments, keyed on row id and version ({% cache %})
+fragment_cache = FragmentCache(app)
+metrics.add_collector(fragment_cache.render_metrics)
+
+
+def queue_invalidation(target, *tags):
+    # Tags are collected while flushing and only dropped once the commit lands
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('invalidated_tags', set()).update(tags)
+
+
+@event.listens_for(Show, 'after_insert')
+@event.listens_for(Show, 'after_update')
+@event.listens_for(Show, 'after_delete')
+def invalidate_show(mapper, connection, show):
+    # A moved show invalidates both its old and its new venue/artist
+    tags = set()
+    for attr, kind in (('venue_id', 'venue'), ('artist_id', 'artist')):
+        history = inspect(show).attrs[attr].history
+        for value in [getattr(show, attr)] + list(history.deleted or ()):
+            if value is not None:
+                tags.add((kind, value))
+    queue_invalidation(show, *tags)
+
+
+@event.listens_for(Venue, 'after_update')
+@event.listens_for(Venue, 'after_delete')
+def invalidate_venue(mapper, connection, venue):
+    queue_invalidation(venue, ('venue', venue.id))
+
+
+@event.listens_for(Artist, 'after_update')
+@event.listens_for(Artist, 'after_delete')
+def invalidate_artist(mapper, connection, artist):
+    queue_invalidation(artist, ('artist', artist.id))
+
+
+@event.listens_for(Venue, 'after_insert')
+@event.listens_for(Venue, 'after_delete')
+@event.listens_for(Artist, 'after_insert')
+@event.listens_for(Artist, 'after_delete')
+def invalidate_genre_facets(mapper, connection, target):
+    queue_invalidation(target, ('genre-facets', target.__tablename__))
+
+
+@event.listens_for(Venue, 'after_update')
+@event.listens_for(Artist, 'after_update')
+def invalidate_genre_facets_on_update(mapper, connection, target):
+    # Show counter updates touch venues and artists all the time; only the
+    # columns the facet counts depend on drop them
+    state = inspect(target)
+    if any(state.attrs[attr].history.has_changes() for attr in ('genres', 'state', 'deleted_at')):
+        queue_invalidation(target, ('genre-facets', target.__tablename__))
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_invalidations(session):
+    tags = session.info.pop('invalidated_tags', None)
+    if tags:
+        detail_cache.invalidate(*tags)
+        facet_cache.invalidate(*tags)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_invalidations(session):
+    session.info.pop('invalidated_tags', None)
+
+#----------------------------------------------------------------------------#
+# Purging deleted rows.
+#----------------------------------------------------------------------------#
+
+PURGE_BATCH_SIZE = 1000
+
+
+def purge_shows_batch(foreign_key, row_id, batch_size):
+    # Deletes up to batch_size shows of one venue or artist with a single
+    # DELETE ... RETURNING and takes them off the counts of the venues and
+    # artists on the other side. Returns how many shows were deleted.
+    table = Show.__table__
+    watermark = show_count_watermark(db.session.connection())
+    batch = db.select([table.c.id]).where(
+        table.c[foreign_key] == row_id).limit(batch_size)
+    deleted = db.session.execute(table.delete().where(table.c.id.in_(batch)).returning(
+        table.c.venue_id, table.c.artist_id, table.c.start_time)).fetchall()
+
+    tags = set()
+    for model, column in ((Venue, 'venue_id'), (Artist, 'artist_id')):
+        if column == foreign_key:
+            continue
+        counts = defaultdict(lambda: {'upcoming': 0, 'past': 0})
+        for show in deleted:
+            if show[column] is not None:
+                counts[show[column]]['upcoming' if show.start_time > watermark else 'past'] += 1
+        if not counts:
+            continue
+        other = model.__table__
+        db.session.execute(other.update().where(other.c.id == db.bindparam('row_id')).values(
+            upcoming_show_count=other.c.upcoming_show_count - db.bindparam('upcoming'),
+            past_show_count=other.c.past_show_count - db.bindparam('past')),
+            [dict(count, row_id=other_id) for other_id, count in counts.items()])
+        if model is Venue:
+            adjust_area_upcoming(db.session.connection(), [
+                {'venue_id': other_id, 'delta': -count['upcoming']}
+                for other_id, count in counts.items() if count['upcoming']])
+        tags.update((model.__tablename__.lower(), other_id) for other_id in counts)
+    db.session.commit()
+    if tags:
+        detail_cache.invalidate(*tags)
+    return len(deleted)
+
+
+def purge_deleted(batch_size=PURGE_BATCH_SIZE, echo=None):
+    # Removes soft-deleted venues and artists for good, shows first. Every
+    # batch is its own short transaction, so a venue with a long history
+    # never holds locks for the whole purge. Returns (shows, rows) purged.
+    shows_purged = rows_purged = 0
+    for model, foreign_key in ((Venue, 'venue_id'), (Artist, 'artist_id')):
+        row_ids = [row_id for (row_id,) in db.session.query(model.id).filter(
+            model.deleted_at.isnot(None)).order_by(model.id)]
+        for row_id in row_ids:
+            while True:
+                purged = purge_shows_batch(foreign_key, row_id, batch_size)
+                shows_purged += purged
+                if echo is not None and purged:
+                    echo('{} {}: purged {} shows'.format(model.__tablename__, row_id, purged))
+                if purged < batch_size:
+                    break
+            table = model.__table__
+            db.session.execute(table.delete().where(db.and_(
+                table.c.id == row_id, table.c.deleted_at.isnot(None))))
+            db.session.commit()
+            rows_purged += 1
+    return shows_purged, rows_purged
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
 
-def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format)
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma"
+}
+
+
+@lru_cache(maxsize=64)
+def datetime_pattern(format, locale=None):
+    # Compiled babel pattern and parsed locale, built once per (format, locale)
+    pattern = DATETIME_FORMATS.get(format, format)
+    if pattern in ('long', 'short'):
+        # babel's named formats are locale data, not patterns
+        return None, babel.Locale.parse(locale or babel.dates.LC_TIME)
+    return babel.dates.parse_pattern(pattern), babel.Locale.parse(locale or babel.dates.LC_TIME)
+
+
+@lru_cache(maxsize=4096)
+def format_datetime_value(date, format, locale=None):
+    pattern, babel_locale = datetime_pattern(format, locale)
+    if pattern is None:
+        return babel.dates.format_datetime(date, format, locale=babel_locale)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=babel.dates.UTC)
+    return pattern.apply(date, babel_locale)
+
+
+def format_datetime(value, format='medium', locale=None):
+    # Only strings need parsing; datetimes from the database go straight through
+    if not isinstance(value, datetime):
+        value = dateutil.parser.parse(value)
+    return format_datetime_value(value, format, locale)
+
+
+def format_datetimes(values, format='medium', locale=None):
+    # Batch form for a whole list of show times. It goes through the same
+    # memo as the single filter, since show times repeat across a listing.
+    return [format_datetime(value, format, locale) for value in values]
 
 
 app.jinja_env.filters['datetime'] = format_datetime
+app.jinja_env.filters['datetimes'] = format_datetimes
+
+#----------------------------------------------------------------------------#
+# Pagination.
+#----------------------------------------------------------------------------#
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+SHOWS_PER_SECTION = 20
+SHOW_BOOKING_WINDOW = timedelta(hours=3)
+
+
+def page_url(**cursor):
+    # Keep the current query string (filters etc.) and swap only the cursor
+    args = request.args.to_dict(flat=False)
+    args.pop('after', None)
+    args.pop('before', None)
+    args.update({key: value for key, value in cursor.items() if value is not None})
+    args.update(request.view_args or {})
+    return url_for(request.endpoint, **args)
+
+
+def keyset_paginate(query, sort_columns, id_column):
+    # Keyset (cursor) pagination: ?after=<id> / ?before=<id> select the row
+    # whose sort key is the cursor, so each page is an index range scan
+    # instead of an OFFSET over every previous row.
+    # sort_columns must end with id_column so the key is unique.
+    limit = max(1, min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    key = db.tuple_(*sort_columns)
+
+    cursor_id = before if before is not None else after
+    if cursor_id is not None:
+        cursor_key = db.session.query(*sort_columns).filter(
+            id_column == cursor_id).first()
+        if cursor_key is None:
+            abort(404)
+
+    if before is not None:
+        rows = query.filter(key < db.tuple_(*cursor_key)).order_by(
+            *[column.desc() for column in sort_columns]).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+        prev_id = rows[0].id if has_more and rows else None
+        next_id = rows[-1].id if rows else None
+    else:
+        if after is not None:
+            query = query.filter(key > db.tuple_(*cursor_key))
+        rows = query.order_by(*sort_columns).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_id = rows[-1].id if has_more else None
+        prev_id = rows[0].id if after is not None and rows else None
+
+    pagination = {
+        'limit': limit,
+        'next': next_id,
+        'prev': prev_id,
+        'next_url': page_url(after=next_id, limit=limit) if next_id is not None else None,
+        'prev_url': page_url(before=prev_id, limit=limit) if prev_id is not None else None
+    }
+    return rows, pagination
+
+#----------------------------------------------------------------------------#
+# Genres.
+#----------------------------------------------------------------------------#
+
+def filter_by_genres(query, model, genres):
+    # ?genre=Jazz&genre=Blues keeps rows having every selected genre (genres @> ARRAY[...]),
+    # which the GIN index on the array column answers
+    if genres:
+        query = query.filter(model.genres.contains(genres))
+    return query
+
+
+STATES = frozenset(value for value, label in VenueForm.state.kwargs['choices'])
+
+
+def genre_counts(model, genres, state=None):
+    # Count per genre over the whole filtered result set, in one grouped query.
+    # Counts are cached until a commit changes a row's genres, state or
+    # deletion (see invalidate_genre_facets), so page views skip the scan.
+    # A selection naming a state or genre that no row has matches nothing;
+    # it is answered without a query or a cache entry, so made-up query
+    # strings cannot fill facet_cache.
+    genres = sorted(set(genres))
+    if state and state not in STATES:
+        return []
+    if genres:
+        known = {name for name, count in genre_counts(model, [], state)}
+        if not known.issuperset(genres):
+            return []
+    key = ('genre-facets', model.__tablename__, tuple(genres), state)
+    counts = facet_cache.get(key)
+    if counts is not None:
+        return counts
+    generation = facet_cache.generation
+    genre = func.unnest(model.genres).label('genre')
+    count = func.count().label('count')
+    criteria = [model.state == state] if state else []
+    query = filter_by_genres(db.session.query(genre, count).filter(
+        model.deleted_at.is_(None), *criteria), model, genres)
+    with primary_read():
+        counts = [(row.genre, row.count)
+                  for row in query.group_by('genre').order_by(count.desc(), 'genre')]
+    facet_cache.set(key, counts, tags=[('genre-facets', model.__tablename__)],
+                    generation=generation)
+    return counts
+
+
+def genre_facets(model, genres, state=None):
+    facets = []
+    for name, count in genre_counts(model, genres, state):
+        selected = name in genres
+        toggled = [other for other in genres if other != name] if selected \
+            else genres + [name]
+        facets.append({
+            'genre': name,
+            'count': count,
+            'selected': selected,
+            'url': page_url(genre=toggled)
+        })
+    return facets
 
 #----------------------------------------------------------------------------#
 # Controllers.
@@ -139,85 +819,108 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@replica_read
 def venues():
     # DONE: replace with real venues data.
     #       num_shows should be aggregated based on number of upcoming shows per venue.
-    # Query for cities/states
-    # foreach, query venues and display their upcoming shows
-    city_areas = Venue.query.distinct('city', 'state').all()
+    # Upcoming show counts are stored on the venue, so no join is needed
+    venues_query = db.session.query(
+        Venue.id, Venue.version, Venue.name, Venue.city, Venue.state,
+        Venue.upcoming_show_count.label('num_upcoming_shows')).filter(
+        Venue.deleted_at.is_(None))
+    genres = request.args.getlist('genre')
+    venues_query = filter_by_genres(venues_query, Venue, genres)
+    # ?state=TX drills down to one state: a range of the (state, city, id) index
+    state = request.args.get('state', '').strip()
+    state_filter = [Venue.state == state] if state else []
+    venues_with_counts, pagination = keyset_paginate(
+        venues_query.filter(*state_filter), [Venue.state, Venue.city, Venue.id], Venue.id)
+    areas = {}
+    page_areas = {(venue.state, venue.city) for venue in venues_with_counts}
+    if page_areas:
+        areas = {(area.state, area.city): area for area in Area.query.filter(
+            db.tuple_(Area.state, Area.city).in_(page_areas))}
+    # Rows come sorted by area, so a single pass builds the city/state buckets
     data = []
-    for city_area in city_areas:
-        venues_in_city = Venue.query.filter(
-            Venue.city == city_area.city, Venue.state == city_area.state).all()
-        entry = {
-            'city': city_area.city,
-            'state': city_area.state
-        }
-        venues = []
-        for venue in venues_in_city:
-
-            venueToAppend = {
-                'id': venue.id,
-                'name': venue.name,
-                'num_upcoming_shows': Show.query.filter(Show.venue_id == venue.id,
-              Show.start_time > datetime.utcnow()).count()
-            }
-            venues.append(venueToAppend)
-            
-
-        entry['venues'] = venues
-
-        data.append(entry)
-    
-
+    for venue in venues_with_counts:
+        if not data or (data[-1]['city'], data[-1]['state']) != (venue.city, venue.state):
+            area = areas.get((venue.state, venue.city))
+            data.append({
+                'city': venue.city,
+                'state': venue.state,
+                'venue_count': area.venue_count if area else None,
+                'upcoming_show_count': area.upcoming_show_count if area else None,
+                'venues': []
+            })
+        data[-1]['venues'].append({
+            'id': venue.id,
+            'version': venue.version,
+            'name': venue.name,
+            'num_upcoming_shows': venue.num_upcoming_shows
+        })
 
-    return render_template('pages/venues.html', areas=data)
+    return render_template('pages/venues.html', areas=data, pagination=pagination,
+                           facets=genre_facets(Venue, genres, state),
+                           catalog=area_catalog(state), state=state)
 
 
 @app.route('/venues/search', methods=['POST'])
+@replica_read
 def search_venues():
     # DONE: implement search on venues with partial string search. Ensure it is case-insensitive.
     # seach for Hop should return "The Musical Hop".
     # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
     
-    #search venues 
-    #venues = Venue.query.filter(Venue.name.contains(request.form.get('search_term'))).all()
-    venues = Venue.query.filter(Venue.name.ilike('%'+request.form.get('search_term')+'%')).all()    
+    venues, total = venue_search.search(request.form.get('search_term'), SEARCH_LIMIT)
     response = {
-        'count': len(venues),
+        'count': total,
         'data': venues
     }
-  
-    return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
+    return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
-@app.route('/venues/<int:venue_id>')
-def show_venue(venue_id):
-    # shows the venue page with the given venue_id
-    # DONE: replace with real venue data from the venues table, using venue_id
 
-    venue = Venue.query.get(venue_id);
-    upcoming_shows_query = db.session.query(Show).join(Artist).filter(
-        Show.venue_id == venue_id).filter(Show.start_time > datetime.now()).all()
-    past_shows_query=db.session.query(Show).join(Artist).filter(
-        Show.venue_id == venue_id).filter(Show.start_time < datetime.now()).all()
-
-    upcoming_shows=[]
-    for show in upcoming_shows_query:
-      upcoming_shows.append({
-        "artist_id": show.artist_id,
-          "artist_name": show.artists.name,
-          "artist_image_link": show.artists.image_link,
-          "start_time": show.start_time
-      })
-    past_shows=[]
-    for show in past_shows_query:
-        past_shows.append({
-          "artist_id": show.artist_id,
-          "artist_name": show.artists.name,
-          "artist_image_link": show.artists.image_link,
-          "start_time": show.start_time
-        })
+def venue_detail(venue_id, cached=True):
+    # Venue and all of its shows in one query, split into past/upcoming by a
+    # CASE on start_time. Cached under the venue's related_shows_fingerprint:
+    # a write in any process, or a show starting, changes the key, so an
+    # entry is never served after the rows behind it changed.
+    if cached:
+        fingerprint = related_shows_fingerprint(
+            Venue, Show.venue_id, Artist, Show.artist_id, venue_id)
+        if fingerprint is None:
+            abort(404)
+        key = ('venue', venue_id, tuple(fingerprint))
+        data = detail_cache.get(key)
+        if data is not None:
+            return data
+    now = datetime.now()
+    rows = db.session.query(
+        Venue, Show.artist_id, Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'), Show.start_time,
+        db.case([(Show.start_time > now, True)], else_=False).label('upcoming')).outerjoin(
+        Show, Show.venue_id == Venue.id).outerjoin(
+        Artist, db.and_(Show.artist_id == Artist.id, Artist.deleted_at.is_(None))).filter(
+        Venue.id == venue_id, Venue.deleted_at.is_(None)).order_by(Show.start_time).all()
+    if not rows:
+        abort(404)
+
+    venue = rows[0].Venue
+    upcoming_shows = []
+    past_shows = []
+    for row in rows:
+        if row.start_time is None or row.artist_name is None:
+            continue
+        show = {
+            "artist_id": row.artist_id,
+            "artist_name": row.artist_name,
+            "artist_image_link": row.artist_image_link,
+            "start_time": row.start_time
+        }
+        if row.upcoming:
+            upcoming_shows.append(show)
+        else:
+            past_shows.append(show)
     data={
       "id": venue.id,
       "name": venue.name,
@@ -232,11 +935,29 @@ def show_venue(venue_id):
       "seeking_talent": venue.seeking_talent,
       "website": venue.website,
       "upcoming_shows": upcoming_shows,
+      # Counted from the lists, so shows of deleted artists are left out of
+      # both alike
       "upcoming_shows_count": len(upcoming_shows),
       "past_shows": past_shows,
       "past_shows_count": len(past_shows)
     }
 
+    if cached:
+        # Tags only free this process' superseded entries early
+        tags = {('venue', venue_id)} | {('artist', row.artist_id) for row in rows
+                                        if row.artist_id is not None}
+        detail_cache.set(key, data, tags=tags)
+    return data
+
+
+@app.route('/venues/<int:venue_id>')
+@replica_read
+def show_venue(venue_id):
+    # shows the venue page with the given venue_id
+    # DONE: replace with real venue data from the venues table, using venue_id
+
+    data = venue_detail(venue_id)
+
     return render_template('pages/show_venue.html', venue=data)
 
 #  Create Venue
@@ -269,7 +990,7 @@ def create_venue_submission():
     except ValueError:
         error=True
         db.session.rollback()
-        print("Unexpected error", sys.exc_info())
+        app.logger.exception('Could not create venue')
 
     finally:
         db.session.close()
@@ -290,15 +1011,16 @@ def create_venue_submission():
 def delete_venue(venue_id):
     # DONE: Complete this endpoint for taking a venue_id, and using
     # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
+    # Only marks the venue; its shows are removed by `flask purge-deleted`
     error = False
     try:
       venueToDelete=Venue.query.get(venue_id)
-      db.session.delete(venueToDelete)
+      venueToDelete.deleted_at = datetime.now()
       db.session.commit()
     except:
       error=True
       db.session.rollback()
-      print("Unexpected error", sys.exc_info())
+      app.logger.exception('Could not delete venue %s', venue_id)
     finally:
       db.session.close()
     if error:
@@ -310,64 +1032,110 @@ def delete_venue(venue_id):
     # clicking that button delete it from the db then redirect the user to the homepage
     
 
+@app.route('/artists/<artist_id>', methods = ['DELETE'])
+def delete_artist(artist_id):
+    # Only marks the artist; its shows are removed by `flask purge-deleted`
+    error = False
+    try:
+      artist = Artist.query.get(artist_id)
+      artist.deleted_at = datetime.now()
+      db.session.commit()
+    except:
+      error=True
+      db.session.rollback()
+      app.logger.exception('Could not delete artist %s', artist_id)
+    finally:
+      db.session.close()
+    if error:
+      abort (400)
+    else:
+      return redirect(url_for('index'))
+
+
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@replica_read
 def artists():
     # DONE: replace with real data returned from querying the database
-    return render_template('pages/artists.html', artists = Artist.query.all())
+    genres = request.args.getlist('genre')
+    artists_page, pagination = keyset_paginate(
+        filter_by_genres(Artist.query.filter(Artist.deleted_at.is_(None)), Artist, genres),
+        [Artist.name, Artist.id], Artist.id)
+    return render_template('pages/artists.html', artists=artists_page, pagination=pagination,
+                           facets=genre_facets(Artist, genres))
 
 
 @app.route('/artists/search', methods = ['POST'])
+@replica_read
 def search_artists():
     # DONE: implement search on artists with partial string search. Ensure it is case-insensitive.
     # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
     # search for "band" should return "The Wild Sax Band".
 
-    search_string = request.form.get('search_term')
-    search = Artist.query.filter(Artist.name.ilike('%'+search_string+'%')).all()    
+    search, total = artist_search.search(request.form.get('search_term'), SEARCH_LIMIT)
     response ={
-        "count": len(search),
+        "count": total,
         "data": search
     }
 
     return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term'))
 
 
-@app.route('/artists/<int:artist_id>')
-def show_artist(artist_id):
-    # shows the venue page with the given venue_id
-    # DONE: replace with real venue data from the venues table, using venue_id
- 
-    # We take artist, past shows and upcoming ones from database
+def section_pagination(arg, page, count):
+    # Previous/next links for one numbered section of a detail page
+    pages = max(1, -(-count // SHOWS_PER_SECTION))
+    return {
+        'page': page,
+        'pages': pages,
+        'prev_url': page_url(**{arg: page - 1}) if page > 1 else None,
+        'next_url': page_url(**{arg: page + 1}) if page < pages else None
+    }
+
+
+def artist_shows(artist_id, upcoming, page, now):
+    # One page of an artist's past or upcoming shows with the venue columns
+    # joined, and how many shows the section has in all. The total comes
+    # from the same query (count() OVER ()), so shows at deleted venues are
+    # left out of both alike.
+    query = db.session.query(
+        Show.venue_id, Venue.name.label('venue_name'),
+        Venue.image_link.label('venue_image_link'), Show.start_time,
+        func.count().over().label('total')).join(
+        Venue, Show.venue_id == Venue.id).filter(
+        Show.artist_id == artist_id, Venue.deleted_at.is_(None))
+    if upcoming:
+        query = query.filter(Show.start_time > now).order_by(Show.start_time, Show.id)
+    else:
+        query = query.filter(Show.start_time <= now).order_by(
+            Show.start_time.desc(), Show.id.desc())
+    rows = query.limit(SHOWS_PER_SECTION).offset(
+        (page - 1) * SHOWS_PER_SECTION).all()
+    if rows:
+        total = rows[0].total
+    elif page > 1:
+        # Past the last page: no row carries the total
+        total = query.order_by(None).with_entities(func.count()).scalar()
+    else:
+        total = 0
+    return [{
+        "venue_id": row.venue_id,
+        "venue_name": row.venue_name,
+        "venue_image_link": row.venue_image_link,
+        "start_time": row.start_time
+    } for row in rows], total
+
+
+def artist_detail(artist_id, past_page=1, upcoming_page=1):
+    # Only the requested page of each section is read, with its total, so
+    # the cost does not depend on how many shows exist.
+    now = datetime.now()
     artist = Artist.query.get(artist_id)
-    print(artist.shows)
-    past_shows_lambda = list(filter(lambda show: show.start_time < datetime.now(), artist.shows))
-    upcoming_shows_lambda = list(filter(lambda show: show.start_time > datetime.now(), artist.shows))
-   
-    upcoming_shows=[]
-    for show in upcoming_shows_lambda:
-      upcoming_shows.append({
-        "venue_id": show.venue_id,
-          "venue_name": show.venues.name,
-          "venue_image_link": show.venues.image_link,
-          "start_time": show.start_time
-      })
-
-   
-    past_shows=[]
-    for past_show in past_shows_lambda:
-   
-      past_shows.append({
-        "venue_id": past_show.venue_id,
-          "venue_name": past_show.venues.name,
-          "venue_image_link": past_show.venues.image_link,
-          "start_time": past_show.start_time
-      })
-   
-    
-    past_shows_count = len(past_shows_lambda)
-    upcoming_shows_count =len(upcoming_shows)
+    if artist is None or artist.deleted_at is not None:
+        abort(404)
+    past_shows, past_shows_count = artist_shows(artist_id, False, past_page, now)
+    upcoming_shows, upcoming_shows_count = artist_shows(artist_id, True, upcoming_page, now)
+
     data={
         "id": artist.id,
         "name": artist.name,
@@ -382,7 +1150,22 @@ def show_artist(artist_id):
         "past_shows_count": past_shows_count,
         "upcoming_shows_count": upcoming_shows_count
     }
-    
+    return data
+
+
+@app.route('/artists/<int:artist_id>')
+@replica_read
+def show_artist(artist_id):
+    # shows the venue page with the given venue_id
+    # DONE: replace with real venue data from the venues table, using venue_id
+    past_page = max(1, request.args.get('past_page', 1, type=int))
+    upcoming_page = max(1, request.args.get('upcoming_page', 1, type=int))
+    data = artist_detail(artist_id, past_page, upcoming_page)
+    data['past_pagination'] = section_pagination(
+        'past_page', past_page, data['past_shows_count'])
+    data['upcoming_pagination'] = section_pagination(
+        'upcoming_page', upcoming_page, data['upcoming_shows_count'])
+
     return render_template('pages/show_artist.html', artist=data)
 
 #  Update
@@ -409,7 +1192,7 @@ def edit_artist_submission(artist_id):
         db.session.commit()    
     except:
         error = True
-        print("Unexpected error", sys.exc_info())
+        app.logger.exception('Could not edit artist %s', artist_id)
         db.session.rollback()
     finally:
         db.session.close()
@@ -441,7 +1224,7 @@ def edit_venue_submission(venue_id):
        form.populate_obj(venue)
        db.session.commit()
     except:
-      
+      app.logger.exception('Could not edit venue %s', venue_id)
       db.session.rollback()
     finally:
       db.session.close()
@@ -479,7 +1262,7 @@ def create_artist_submission():
     except ValueError:
         error = True
         db.session.rollback()
-        print("Unexpected error", sys.exc_info())
+        app.logger.exception('Could not create artist')
     finally:
         db.session.close()
     if error:
@@ -495,24 +1278,51 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
+def filter_shows(query):
+    # ?from=&to= bound start_time (from inclusive, to exclusive) and
+    # ?city=&state= match the venue exactly. A time window alone is a range
+    # scan on Show(start_time, id); with a place, Venue(state, city, id)
+    # finds the venues and Show(venue_id, start_time) their shows.
+    bounds = {}
+    for arg in ('from', 'to'):
+        value = request.args.get(arg, '').strip()
+        if value:
+            try:
+                bounds[arg] = dateutil.parser.parse(value)
+            except (ValueError, OverflowError):
+                abort(400)
+    if 'from' in bounds:
+        query = query.filter(Show.start_time >= bounds['from'])
+    if 'to' in bounds:
+        query = query.filter(Show.start_time < bounds['to'])
+    for arg, column in (('city', Venue.city), ('state', Venue.state)):
+        value = request.args.get(arg, '').strip()
+        if value:
+            query = query.filter(column == value)
+    return query
+
+
 @app.route('/shows')
+@replica_read
 def shows():
     # displays list of shows at /shows
     # DONE: replace with real venues data.
     #       num_shows should be aggregated based on number of upcoming shows per venue.
-    allShows = Show.query.all()
-    data=[]
-    for show in allShows:
-        data.append({
-            "venue_id": show.venue_id,
-            "venue_name": show.venues.name,
-            "artist_id": show.artist_id,
-            "artist_name": show.artists.name,
-            "artist_image_link": show.artists.image_link,
-            "start_time": show.start_time}
-        )
-
-    return render_template('pages/shows.html', shows=data)
+    # Only the columns the template needs, venue and artist joined in one query
+    shows_query = db.session.query(
+        Show.id, Show.version, Show.venue_id, Venue.name.label('venue_name'),
+        Venue.version.label('venue_version'), Show.artist_id, Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'), Artist.version.label('artist_version'),
+        Show.start_time).join(
+        Venue, Show.venue_id == Venue.id).join(
+        Artist, Show.artist_id == Artist.id).filter(
+        Venue.deleted_at.is_(None), Artist.deleted_at.is_(None))
+    shows_page, pagination = keyset_paginate(
+        filter_shows(shows_query), [Show.start_time, Show.id], Show.id)
+
+    # The page is at most MAX_PAGE_SIZE rows, already loaded: rendered in one go
+    return render_template('pages/shows.html', shows=shows_page, pagination=pagination,
+                           filters=request.args)
 
 
 @app.route('/shows/create')
@@ -527,26 +1337,25 @@ def create_show_submission():
     # called to create new shows in the db, upon submitting new show listing form
     # DONE: insert form data as a new Show record in the db, instead
     form  = ShowForm(request.form)
-    error = False  
+    errors = []
     try:
-        show = Show(
-            artist_id=form.artist_id.data,
-            venue_id=form.venue_id.data,
-            start_time= form.start_time.data
-        )
-        # artist = Artist.query.get(show.artist_id)
-        # venue = Venue.query.get(show.venue_id)
-        
-        db.session.add(show)
-        db.session.commit()
-    except ValueError:
-        error = True
+        if not form.validate():
+            errors = ['{}: {}'.format(field, ', '.join(messages))
+                      for field, messages in form.errors.items()]
+        else:
+            errors = create_shows_batch(weekly_shows({
+                'artist_id': form.artist_id.data,
+                'venue_id': form.venue_id.data,
+                'start_time': form.start_time.data
+            }, form.repeat_weeks.data))
+    except Exception:
+        errors = ['unexpected error']
         db.session.rollback()
-        print("Unexpected error", sys.exc_info())
+        app.logger.exception('Could not create shows')
     finally:
         db.session.close()
-    if error:
-        flash('An error. Show could not be listed.')
+    if errors:
+        flash('An error. Show could not be listed: ' + '; '.join(errors))
     else:
         flash('Show was successfully listed!')
     # DONE: on unsuccessful db insert, flash an error instead.
@@ -555,6 +1364,408 @@ def create_show_submission():
     return render_template('pages/home.html')
 
 
+def weekly_shows(show, weeks):
+    # A residency is the same slot weekly for `weeks` weeks
+    return [dict(show, start_time=show['start_time'] + timedelta(weeks=week))
+            for week in range(weeks or 1)]
+
+
+def validate_show_batch(shows):
+    # Checks a whole batch with two queries: every referenced artist and venue
+    # in one UNION of IN lookups, and double bookings with one range scan
+    # over (venue_id, start_time). Returns a list of error messages.
+    errors = []
+    for index, show in enumerate(shows):
+        try:
+            show['artist_id'] = int(show['artist_id'])
+            show['venue_id'] = int(show['venue_id'])
+        except (KeyError, TypeError, ValueError):
+            errors.append('show {}: artist_id and venue_id must be integers'.format(index + 1))
+        if not isinstance(show.get('start_time'), datetime):
+            errors.append('show {}: start_time must be a date and time'.format(index + 1))
+        elif show['start_time'].tzinfo is not None:
+            # Start times are stored naive, in UTC; "...Z" or "+02:00" is converted
+            show['start_time'] = show['start_time'].astimezone(timezone.utc).replace(tzinfo=None)
+    if errors or not shows:
+        return errors
+
+    artist_ids = {show['artist_id'] for show in shows}
+    venue_ids = {show['venue_id'] for show in shows}
+    found = db.session.query(db.literal('artist').label('kind'), Artist.id).filter(
+        Artist.id.in_(artist_ids), Artist.deleted_at.is_(None)).union_all(db.session.query(
+            db.literal('venue').label('kind'), Venue.id).filter(
+            Venue.id.in_(venue_ids), Venue.deleted_at.is_(None))).all()
+    for kind, missing in (('artist', artist_ids), ('venue', venue_ids)):
+        for row_id in sorted(missing - {row_id for row_kind, row_id in found if row_kind == kind}):
+            errors.append('{} {} does not exist'.format(kind, row_id))
+    if errors:
+        return errors
+
+    start_times = [show['start_time'] for show in shows]
+    booked = defaultdict(list)
+    for venue_id, start_time in db.session.query(Show.venue_id, Show.start_time).filter(
+            Show.venue_id.in_(venue_ids),
+            Show.start_time > min(start_times) - SHOW_BOOKING_WINDOW,
+            Show.start_time < max(start_times) + SHOW_BOOKING_WINDOW).order_by(Show.start_time):
+        booked[venue_id].append(start_time)
+    for show in shows:
+        times = booked[show['venue_id']]
+        position = bisect_left(times, show['start_time'])
+        neighbours = times[max(0, position - 1):position + 1]
+        if any(abs(other - show['start_time']) < SHOW_BOOKING_WINDOW for other in neighbours):
+            errors.append('venue {} is already booked around {}'.format(
+                show['venue_id'], show['start_time']))
+        else:
+            # later shows in the same batch must not clash with this one either
+            insort(times, show['start_time'])
+    return errors
+
+
+def create_shows_batch(shows):
+    # Validates, then inserts every show in a single transaction
+    errors = validate_show_batch(shows)
+    if errors:
+        return errors
+    db.session.add_all([Show(**show) for show in shows])
+    db.session.commit()
+    return []
+
+
+#  API
+#  ----------------------------------------------------------------
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def conditional_json(fingerprint, build):
+    # Strong ETag from row versions: a matching If-None-Match gets a 304
+    # before the body is built or serialized
+    etag = hashlib.sha1(repr(fingerprint).encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    return response
+
+
+def json_shows(shows):
+    return [dict(show, start_time=show['start_time'].isoformat()) for show in shows]
+
+
+def related_shows_fingerprint(model, foreign_key, other, other_key, row_id):
+    # Aggregates only: changes whenever the row, any of its shows or any
+    # joined artist/venue is written, or a show moves from upcoming to past
+    now = datetime.now()
+    return db.session.query(
+        model.version, func.count(Show.id),
+        func.count(Show.id).filter(Show.start_time > now),
+        func.coalesce(func.sum(Show.id), 0), func.coalesce(func.sum(Show.version), 0),
+        func.coalesce(func.sum(other.version), 0)).outerjoin(
+        Show, foreign_key == model.id).outerjoin(
+        other, other_key == other.id).filter(
+        model.id == row_id, model.deleted_at.is_(None)).group_by(model.id).first()
+
+
+@api.route('/venues')
+@replica_read
+def api_venues():
+    genres = request.args.getlist('genre')
+    rows, pagination = keyset_paginate(
+        filter_by_genres(db.session.query(
+            Venue.id, Venue.version, Venue.name, Venue.city, Venue.state,
+            Venue.upcoming_show_count).filter(Venue.deleted_at.is_(None)), Venue, genres),
+        [Venue.state, Venue.city, Venue.id], Venue.id)
+    fingerprint = [(row.id, row.version) for row in rows], pagination['next'], pagination['prev']
+    return conditional_json(fingerprint, lambda: {
+        'success': True,
+        'venues': [{
+            'id': row.id,
+            'name': row.name,
+            'city': row.city,
+            'state': row.state,
+            'num_upcoming_shows': row.upcoming_show_count
+        } for row in rows],
+        'next': pagination['next'],
+        'prev': pagination['prev']
+    })
+
+
+@api.route('/venues/<int:venue_id>')
+@replica_read
+def api_venue(venue_id):
+    fingerprint = related_shows_fingerprint(
+        Venue, Show.venue_id, Artist, Show.artist_id, venue_id)
+    if fingerprint is None:
+        abort(404)
+
+    def build():
+        data = venue_detail(venue_id, cached=False)
+        return dict(data, success=True,
+                    upcoming_shows=json_shows(data['upcoming_shows']),
+                    past_shows=json_shows(data['past_shows']))
+    return conditional_json(tuple(fingerprint), build)
+
+
+@api.route('/artists')
+@replica_read
+def api_artists():
+    genres = request.args.getlist('genre')
+    rows, pagination = keyset_paginate(
+        filter_by_genres(db.session.query(Artist.id, Artist.version, Artist.name).filter(
+            Artist.deleted_at.is_(None)), Artist, genres),
+        [Artist.name, Artist.id], Artist.id)
+    fingerprint = [(row.id, row.version) for row in rows], pagination['next'], pagination['prev']
+    return conditional_json(fingerprint, lambda: {
+        'success': True,
+        'artists': [{'id': row.id, 'name': row.name} for row in rows],
+        'next': pagination['next'],
+        'prev': pagination['prev']
+    })
+
+
+@api.route('/artists/<int:artist_id>')
+@replica_read
+def api_artist(artist_id):
+    past_page = max(1, request.args.get('past_page', 1, type=int))
+    upcoming_page = max(1, request.args.get('upcoming_page', 1, type=int))
+    fingerprint = related_shows_fingerprint(
+        Artist, Show.artist_id, Venue, Show.venue_id, artist_id)
+    if fingerprint is None:
+        abort(404)
+
+    def build():
+        data = artist_detail(artist_id, past_page, upcoming_page)
+        return dict(data, success=True,
+                    upcoming_shows=json_shows(data['upcoming_shows']),
+                    past_shows=json_shows(data['past_shows']))
+    return conditional_json(tuple(fingerprint), build)
+
+
+@api.route('/shows')
+@replica_read
+def api_shows():
+    rows, pagination = keyset_paginate(filter_shows(db.session.query(
+        Show.id, Show.version, Show.venue_id, Venue.name.label('venue_name'),
+        Venue.version.label('venue_version'), Show.artist_id,
+        Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link'),
+        Artist.version.label('artist_version'), Show.start_time).join(
+        Venue, Show.venue_id == Venue.id).join(
+        Artist, Show.artist_id == Artist.id).filter(
+        Venue.deleted_at.is_(None), Artist.deleted_at.is_(None))),
+        [Show.start_time, Show.id], Show.id)
+    fingerprint = ([(row.id, row.version, row.venue_version, row.artist_version) for row in rows],
+                   pagination['next'], pagination['prev'])
+    return conditional_json(fingerprint, lambda: {
+        'success': True,
+        'shows': [{
+            'id': row.id,
+            'venue_id': row.venue_id,
+            'venue_name': row.venue_name,
+            'artist_id': row.artist_id,
+            'artist_name': row.artist_name,
+            'artist_image_link': row.artist_image_link,
+            'start_time': row.start_time.isoformat()
+        } for row in rows],
+        'next': pagination['next'],
+        'prev': pagination['prev']
+    })
+
+
+@api.route('/shows', methods=['POST'])
+def api_create_shows():
+    # Batch creation: {"shows": [{"artist_id", "venue_id", "start_time"}, ...]},
+    # all inserted or none
+    body = request.get_json(silent=True) or {}
+    shows = body.get('shows')
+    if not isinstance(shows, list) or not shows:
+        abort(400)
+    for show in shows:
+        try:
+            show['start_time'] = dateutil.parser.parse(show['start_time'])
+        except (KeyError, TypeError, ValueError, OverflowError):
+            pass
+    try:
+        errors = create_shows_batch(shows)
+    except Exception:
+        db.session.rollback()
+        app.logger.exception('Could not create shows')
+        abort(422)
+    if errors:
+        return jsonify({
+            "success": False,
+            "error": 422,
+            "message": "Unprocessable",
+            "errors": errors
+        }), 422
+    return jsonify({
+        'success': True,
+        'created': len(shows)
+    }), 201
+
+
+@api.errorhandler(400)
+def api_bad_request(error):
+    return jsonify({
+        "success": False,
+        "error": 400,
+        "message": "Bad Request"
+    }), 400
+
+
+@api.errorhandler(422)
+def api_unprocessable(error):
+    return jsonify({
+        "success": False,
+        "error": 422,
+        "message": "Unprocessable"
+    }), 422
+
+
+@api.errorhandler(404)
+def api_not_found(error):
+    return jsonify({
+        "success": False,
+        "error": 404,
+        "message": "Resource not found"
+    }), 404
+
+
+app.register_blueprint(api)
+
+#  Commands
+#  ----------------------------------------------------------------
+
+def check_show_references(values):
+    # Every referenced artist and venue is looked up with one IN query per chunk
+    errors = {}
+    for index, data in enumerate(values):
+        try:
+            data['artist_id'] = int(data['artist_id'])
+            data['venue_id'] = int(data['venue_id'])
+        except (TypeError, ValueError):
+            errors[index] = 'artist_id and venue_id must be integers'
+    valid = [data for index, data in enumerate(values) if index not in errors]
+    artist_ids = {artist_id for (artist_id,) in db.session.query(Artist.id).filter(
+        Artist.id.in_({data['artist_id'] for data in valid}), Artist.deleted_at.is_(None))}
+    venue_ids = {venue_id for (venue_id,) in db.session.query(Venue.id).filter(
+        Venue.id.in_({data['venue_id'] for data in valid}), Venue.deleted_at.is_(None))}
+    for index, data in enumerate(values):
+        if index in errors:
+            continue
+        if data['artist_id'] not in artist_ids:
+            errors[index] = 'artist {} does not exist'.format(data['artist_id'])
+        elif data['venue_id'] not in venue_ids:
+            errors[index] = 'venue {} does not exist'.format(data['venue_id'])
+    return errors
+
+
+def expand_show_row(show, form):
+    # repeat_weeks in an import row books the weekly residency, as the form does
+    return weekly_shows(show, form.repeat_weeks.data)
+
+
+# kind: (model, form, check_chunk, converters for columns the form lacks, expand_row)
+IMPORT_KINDS = {
+    'venues': (Venue, VenueForm, None, {
+        'website': text_value, 'seeking_talent': bool_value,
+        'seeking_description': text_value}, None),
+    'artists': (Artist, ArtistForm, None, {
+        'website': text_value, 'seeking_venue': bool_value,
+        'seeking_description': text_value}, None),
+    'shows': (Show, ShowForm, check_show_references, None, expand_show_row),
+}
+
+
+@app.cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--kind', type=click.Choice(sorted(IMPORT_KINDS)),
+              help='What the file holds. Defaults to its name, e.g. venues.csv.')
+@click.option('--chunk-size', default=1000, show_default=True,
+              help='Rows written per transaction.')
+@click.option('--restart', is_flag=True,
+              help='Ignore the checkpoint and import from the first row.')
+def import_command(path, kind, chunk_size, restart):
+    """Bulk import venues, artists or shows from a .csv or .jsonl file."""
+    kind = kind or os.path.basename(path).split('.')[0]
+    if kind not in IMPORT_KINDS:
+        raise click.BadParameter('cannot tell what {} holds, use --kind'.format(path))
+    model, form_class, check_chunk, extra_columns, expand_row = IMPORT_KINDS[kind]
+    importer = Importer(db, model, form_class, chunk_size=chunk_size,
+                        check_chunk=check_chunk, extra_columns=extra_columns,
+                        expand_row=expand_row, echo=click.echo)
+    imported, skipped = importer.run(path, restart=restart)
+    if kind == 'shows' and imported:
+        # executemany bypasses the Show counter events
+        recount_show_counts()
+    elif kind == 'venues' and imported:
+        # ... and the area events
+        rebuild_areas()
+    click.echo('Imported {} {}, skipped {} invalid rows'.format(imported, kind, skipped))
+
+
+@app.cli.command('seed')
+@click.option('--venues', default=1000, show_default=True)
+@click.option('--artists', default=5000, show_default=True)
+@click.option('--shows', default=100000, show_default=True)
+@click.option('--seed', default=0, show_default=True,
+              help='Random seed; the same seed and counts give the same data.')
+@click.option('--chunk-size', default=5000, show_default=True,
+              help='Rows written per transaction.')
+def seed_command(venues, artists, shows, seed, chunk_size):
+    """Load synthetic venues, artists and shows for local load testing."""
+    data = SyntheticData(seed)
+    venue_ids = insert_rows(db, Venue, data.venues(venues), chunk_size, click.echo)
+    artist_ids = insert_rows(db, Artist, data.artists(artists), chunk_size, click.echo)
+    if shows and venue_ids and artist_ids:
+        insert_rows(db, Show, data.shows(shows, venue_ids, artist_ids), chunk_size, click.echo)
+    # executemany bypasses the Show counter and area events
+    recount_show_counts()
+    venue_search.reset()
+    artist_search.reset()
+    detail_cache.clear()
+    facet_cache.clear()
+    click.echo('Seeded {} venues, {} artists and {} shows'.format(
+        len(venue_ids), len(artist_ids), shows if venue_ids and artist_ids else 0))
+
+
+@app.cli.command('rebuild-areas')
+def rebuild_areas_command():
+    """Recompute the city/state area catalog from the venues."""
+    rebuild_areas()
+    click.echo('Rebuilt {} areas'.format(Area.query.count()))
+
+
+@app.cli.command('roll-over-show-counts')
+def roll_over_show_counts_command():
+    """Move shows that have started from upcoming to past counts."""
+    click.echo('Rolled over show counts for {} rows'.format(roll_over_show_counts()))
+
+
+@app.cli.command('check-show-counts')
+@click.option('--fix', is_flag=True, help='Recount every venue and artist.')
+def check_show_counts_command(fix):
+    """Report venues and artists whose stored show counts have drifted."""
+    drift = show_count_drift()
+    for table, row in drift:
+        click.echo('{} {}: upcoming {} (actual {}), past {} (actual {})'.format(
+            table, row.id, row.upcoming_show_count, row.actual_upcoming,
+            row.past_show_count, row.actual_past))
+    click.echo('{} rows drifted'.format(len(drift)))
+    if drift and fix:
+        recount_show_counts()
+        click.echo('Recounted show counts')
+
+
+@app.cli.command('purge-deleted')
+@click.option('--batch-size', default=PURGE_BATCH_SIZE, show_default=True,
+              help='Shows deleted per transaction.')
+def purge_deleted_command(batch_size):
+    """Remove deleted venues and artists along with their shows."""
+    shows_purged, rows_purged = purge_deleted(batch_size, echo=click.echo)
+    click.echo('Purged {} venues and artists, {} shows'.format(rows_purged, shows_purged))
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -565,17 +1776,6 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
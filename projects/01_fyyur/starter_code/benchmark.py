@@ -0,0 +1,348 @@
+#----------------------------------------------------------------------------#
+# Benchmarks.
+#
+# Times the hot paths of the performance work in process against
+# DATABASE_URL and prints JSON tagged with the current git commit. Each
+# scenario also times the code path it replaced, kept here as a baseline,
+# so one run reports before and after. Seed a scratch database at the scale
+# under test first, e.g.
+#
+#   $ flask seed --venues 20000 --artists 1000000 --shows 2000000
+#   $ python benchmark.py pagination --repeat 50
+#----------------------------------------------------------------------------#
+
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+from sqlalchemy import func
+
+from loadtest import SEARCH_TERMS, git_commit, percentile
+
+# Loadtest's terms match large parts of a seeded table; these match a few rows
+SELECTIVE_SEARCH_TERMS = ['orchestra 2554', '98765']
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+def measure(call, repeat):
+    # Wall and CPU time of call(), p50/p95 over repeat runs after a warm-up
+    call()
+    wall = []
+    cpu = []
+    for _ in range(repeat):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        call()
+        wall.append(time.perf_counter() - start)
+        cpu.append(time.process_time() - start_cpu)
+    wall.sort()
+    cpu.sort()
+    return {
+        'p50_ms': milliseconds(percentile(wall, 0.50)),
+        'p95_ms': milliseconds(percentile(wall, 0.95)),
+        'cpu_p50_ms': milliseconds(percentile(cpu, 0.50)),
+    }
+
+
+def timed_once(call):
+    start = time.perf_counter()
+    result = call()
+    return milliseconds(time.perf_counter() - start), result
+
+
+def get(client, path, headers=None):
+    # A GET that must succeed; returns the response
+    response = client.get(path, headers=headers)
+    if response.status_code not in (200, 304):
+        raise SystemExit('{} answered {}'.format(path, response.status_code))
+    return response
+
+
+def pagination(app, repeat, depth=10000, full_load_max_rows=1000000):
+    # Page 1 and page `depth` (or the last page, on smaller tables) of
+    # /artists, /venues and /shows, as whole requests. The deep page starts
+    # from a keyset cursor, as the next links do; its query alone is timed
+    # next to the same page read with OFFSET. The whole-table load the
+    # listings did before paging is the other baseline (skipped above
+    # full_load_max_rows rather than loaded into memory).
+    from app import db, Artist, Venue, Show, PAGE_SIZE
+    listings = (
+        ('/artists', Artist, [Artist.name, Artist.id]),
+        ('/venues', Venue, [Venue.state, Venue.city, Venue.id]),
+        ('/shows', Show, [Show.start_time, Show.id]),
+    )
+    client = app.test_client()
+    results = {}
+    with app.app_context():
+        for path, model, sort_columns in listings:
+            rows = db.session.query(model.id).count()
+            page = max(1, min(depth, (rows - 1) // PAGE_SIZE + 1))
+            offset = (page - 1) * PAGE_SIZE
+            result = {'rows': rows, 'deep_page_number': page,
+                      'page_1': measure(lambda: get(client, path), repeat)}
+            if offset:
+                cursor = db.session.query(*sort_columns).order_by(*sort_columns).offset(
+                    offset - 1).first()
+                deep = '{}?after={}'.format(path, cursor[-1])
+                result['deep_page'] = measure(lambda: get(client, deep), repeat)
+                result['deep_page_keyset_query'] = measure(
+                    lambda: db.session.query(model).filter(
+                        db.tuple_(*sort_columns) > db.tuple_(*cursor)).order_by(
+                        *sort_columns).limit(PAGE_SIZE).all(), repeat)
+                result['deep_page_offset_query_baseline'] = measure(
+                    lambda: db.session.query(model).order_by(*sort_columns).offset(
+                        offset).limit(PAGE_SIZE).all(), repeat)
+            if rows <= full_load_max_rows:
+                result['full_load_baseline_ms'] = timed_once(lambda: len(model.query.all()))[0]
+                db.session.remove()
+            else:
+                result['full_load_baseline_ms'] = None
+            results[path] = result
+    return results
+
+
+def search(app, repeat, baseline_repeat=5):
+    # Name search over venues and artists per term, through NameSearch as the
+    # views call it, against the old unranked ILIKE '%term%' that loaded
+    # every match. The in-process index is built once before timing; its
+    # build time is reported on its own.
+    from app import db, Artist, Venue, SEARCH_LIMIT, venue_search, artist_search
+    results = {}
+    with app.test_request_context():
+        for model, name_search in ((Venue, venue_search), (Artist, artist_search)):
+            result = {'rows': db.session.query(model.id).count(),
+                      'backend': name_search.backend, 'terms': {}}
+            if result['backend'] == 'memory':
+                name_search.reset()
+                result['index_build_ms'] = timed_once(name_search.load_index)[0]
+            for term in SEARCH_TERMS + SELECTIVE_SEARCH_TERMS:
+                result['terms'][term] = {
+                    'matches': name_search.search(term, SEARCH_LIMIT)[1],
+                    'search': measure(lambda: name_search.search(term, SEARCH_LIMIT), repeat),
+                    'ilike_baseline': measure(
+                        lambda: model.query.filter(model.name.ilike('%' + term + '%')).all(),
+                        baseline_repeat)
+                }
+                db.session.remove()
+            results[model.__tablename__] = result
+    return results
+
+
+def etag(app, repeat):
+    # The JSON API with and without a matching If-None-Match: body bytes and
+    # time of the full 200 against the 304 that skips building the body.
+    # Seeded shows are skewed, so the venue detail is read for the venue
+    # with the most shows and for one with the median number.
+    from app import db, Show, Venue
+    with app.app_context():
+        venues = db.session.query(Show.venue_id, func.count()).join(
+            Venue, Show.venue_id == Venue.id).filter(Venue.deleted_at.is_(None)).group_by(
+            Show.venue_id).order_by(func.count().desc(), Show.venue_id).all()
+    if not venues:
+        raise SystemExit('etag needs seeded shows')
+    venue_shows = {'/api/v1/venues/{}'.format(venue_id): shows
+                   for venue_id, shows in (venues[0], venues[len(venues) // 2])}
+    paths = ['/api/v1/venues', '/api/v1/shows'] + list(venue_shows)
+    client = app.test_client()
+    results = {}
+    for path in paths:
+        full = get(client, path)
+        headers = {'If-None-Match': '"{}"'.format(full.get_etag()[0])}
+        not_modified = get(client, path, headers)
+        if not_modified.status_code != 304:
+            raise SystemExit('{} did not answer 304 to its own ETag'.format(path))
+        results[path] = {
+            'bytes_200': len(full.get_data()),
+            'bytes_304': len(not_modified.get_data()),
+            'request_200': measure(lambda: get(client, path), repeat),
+            'request_304': measure(lambda: get(client, path, headers), repeat),
+        }
+        if path in venue_shows:
+            results[path]['shows'] = venue_shows[path]
+    return results
+
+
+def old_artist_detail(artist_id):
+    # The view before sections were paged in SQL: every show loaded through
+    # the relationship, with a lazy load of its venue
+    from app import Artist
+    now = datetime.now()
+    artist = Artist.query.get(artist_id)
+    sections = {'past': [], 'upcoming': []}
+    for show in artist.shows:
+        sections['past' if show.start_time < now else 'upcoming'].append({
+            "venue_id": show.venue_id,
+            "venue_name": show.venues.name,
+            "venue_image_link": show.venues.image_link,
+            "start_time": show.start_time
+        })
+    return sections
+
+
+def artist_detail(app, repeat, shows=50000, baseline_repeat=3):
+    # An artist with `shows` shows across the existing venues, half of them
+    # past, is inserted for the run and removed afterwards. Times the paged
+    # artist_detail and the whole /artists/<id> request against the old
+    # load-everything view (its data only, without rendering every row).
+    from app import db, Artist, Show, Venue, SHOWS_PER_SECTION, artist_detail
+    client = app.test_client()
+    with app.app_context():
+        venue_ids = [row.id for row in db.session.query(Venue.id).filter(
+            Venue.deleted_at.is_(None)).order_by(Venue.id)]
+        if not venue_ids:
+            raise SystemExit('artist_detail needs seeded venues')
+        artist_id = db.session.execute(Artist.__table__.insert().values(
+            name='Benchmark Artist', genres=['Jazz']).returning(Artist.id)).scalar()
+        now = datetime.now()
+        db.session.execute(Show.__table__.insert(), [{
+            'artist_id': artist_id,
+            'venue_id': venue_ids[i % len(venue_ids)],
+            'start_time': now + timedelta(hours=(i + 1) if i % 2 else -(i + 1)),
+        } for i in range(shows)])
+        db.session.commit()
+        # As autovacuum would after a load this size
+        db.session.execute('ANALYZE "Show"')
+        db.session.commit()
+        try:
+            path = '/artists/{}'.format(artist_id)
+            result = {
+                'shows': shows,
+                'artist_detail': measure(lambda: artist_detail(artist_id), repeat),
+                'request': measure(lambda: get(client, path), repeat),
+                'last_past_page_request': measure(lambda: get(client, '{}?past_page={}'.format(
+                    path, ((shows + 1) // 2 - 1) // SHOWS_PER_SECTION + 1)), repeat),
+            }
+            db.session.remove()
+            result['old_view_baseline'] = measure(
+                lambda: (old_artist_detail(artist_id), db.session.remove()), baseline_repeat)
+        finally:
+            db.session.remove()
+            db.session.execute(Show.__table__.delete().where(Show.artist_id == artist_id))
+            db.session.execute(Artist.__table__.delete().where(Artist.id == artist_id))
+            db.session.commit()
+    return result
+
+
+def old_format_datetime(value, format='medium'):
+    # The filter before it was memoized: parse the string, then let babel
+    # parse the pattern and the locale on every call
+    import babel.dates
+    import dateutil.parser
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format)
+
+
+def datetime_filter(app, repeat, rows=100000, passes=3):
+    # One pass formats the first `rows` show times with the 'full' format the
+    # templates use. The memo is cleared before each pass, so repeated
+    # times in the seed data do not turn the pass into cache hits; the warm
+    # memo is timed on its own. The old filter got the time as a string.
+    from app import db, Show, format_datetime, format_datetime_value, format_datetimes
+    with app.app_context():
+        values = [row.start_time for row in db.session.query(Show.start_time).order_by(
+            Show.id).limit(rows)]
+    strings = [str(value) for value in values]
+
+    def per_call():
+        format_datetime_value.cache_clear()
+        return [format_datetime(value, 'full') for value in values]
+
+    def batch():
+        format_datetime_value.cache_clear()
+        return format_datetimes(values, 'full')
+
+    per_call()
+    return {
+        'rows': len(values),
+        'distinct_times': len(set(values)),
+        'per_call': measure(per_call, passes),
+        'per_call_warm_memo': measure(
+            lambda: [format_datetime(value, 'full') for value in values], passes),
+        'batch': measure(batch, passes),
+        'old_filter_baseline': measure(
+            lambda: [old_format_datetime(value, 'full') for value in strings], passes),
+    }
+
+
+def show_search(app, repeat):
+    # /api/v1/shows for a Friday-evening-to-Monday window halfway through
+    # the seeded show times, alone and with the busiest and the quietest
+    # (state, city), and the second page of each from its next cursor. The
+    # count of shows that match is reported to show the query's selectivity.
+    from app import db, Show, Venue
+    with app.app_context():
+        first, last = db.session.query(func.min(Show.start_time), func.max(Show.start_time)).one()
+        if first is None:
+            raise SystemExit('show_search needs seeded shows')
+        places = db.session.query(Venue.state, Venue.city).filter(
+            Venue.deleted_at.is_(None)).group_by(Venue.state, Venue.city).order_by(
+            func.count().desc(), Venue.state, Venue.city).all()
+        middle = (first + (last - first) / 2).replace(hour=18, minute=0, second=0, microsecond=0)
+        start = middle + timedelta(days=(4 - middle.weekday()) % 7)
+        end = start + timedelta(days=2, hours=6)
+        searches = [('window', {}, [])]
+        for name, (state, city) in (('busiest_place', places[0]), ('quietest_place', places[-1])):
+            searches.append((name, {'state': state, 'city': city},
+                             [Venue.state == state, Venue.city == city]))
+        matches = {name: db.session.query(Show.id).join(Venue, Show.venue_id == Venue.id).filter(
+            Show.start_time >= start, Show.start_time < end, *place).count()
+            for name, args, place in searches}
+        results = {'shows': db.session.query(Show.id).count(),
+                   'from': start.isoformat(), 'to': end.isoformat()}
+    client = app.test_client()
+    for name, args, place in searches:
+        path = '/api/v1/shows?' + urlencode(dict(args, **{'from': start.isoformat(),
+                                                          'to': end.isoformat()}))
+        result = {'query': path, 'matches': matches[name],
+                  'page_1': measure(lambda: get(client, path), repeat)}
+        next_id = get(client, path).get_json()['next']
+        if next_id is not None:
+            second = '{}&after={}'.format(path, next_id)
+            result['page_2'] = measure(lambda: get(client, second), repeat)
+        results[name] = result
+    return results
+
+
+SCENARIOS = {
+    'artist_detail': artist_detail,
+    'datetime': datetime_filter,
+    'etag': etag,
+    'pagination': pagination,
+    'search': search,
+    'show_search': show_search,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Fyyur hot paths against DATABASE_URL.')
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='Timed runs per measurement, after one warm-up.')
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    args = parser.parse_args()
+
+    # Imported here, so --help works without a database
+    from app import app
+    report = {
+        'commit': git_commit(),
+        'scenario': args.scenario,
+        'repeat': args.repeat,
+        'results': SCENARIOS[args.scenario](app, args.repeat),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
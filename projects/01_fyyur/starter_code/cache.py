@@ -0,0 +1,77 @@
+#----------------------------------------------------------------------------#
+# Tagged data cache.
+#
+# Entries carry tags such as ('venue', 3) or ('artist', 7); writing any row
+# behind a tag drops every entry built from it. Each invalidation bumps the
+# generation, so a value computed from a read that raced with a write is
+# refused instead of being cached stale.
+#----------------------------------------------------------------------------#
+
+import threading
+import time
+from collections import defaultdict
+
+
+class TaggedCache(object):
+
+    def __init__(self, ttl=60, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.keys_by_tag = defaultdict(set)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, tags=(), ttl=None, generation=None):
+        # generation: the value of self.generation read before computing value
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._drop(key)
+            while self.entries and len(self.entries) >= self.max_entries:
+                # dicts keep insertion order, so this evicts the oldest entry
+                self._drop(next(iter(self.entries)))
+            tags = frozenset(tags) | {key}
+            expires_at = time.time() + (self.ttl if ttl is None else ttl)
+            self.entries[key] = (value, expires_at, tags)
+            for tag in tags:
+                self.keys_by_tag[tag].add(key)
+            return True
+
+    def invalidate(self, *tags):
+        with self.lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self.keys_by_tag.get(tag, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.keys_by_tag.clear()
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self.keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_tag[tag]
@@ -1,7 +1,7 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, NumberRange
 
 class ShowForm(Form):
     artist_id = StringField(
@@ -15,6 +15,12 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    repeat_weeks = IntegerField(
+        # weekly residency: the same slot for this many weeks
+        'repeat_weeks',
+        validators=[Optional(), NumberRange(min=1, max=52)],
+        default=1
+    )
 
 class VenueForm(Form):
     name = StringField(
@@ -0,0 +1,149 @@
+#----------------------------------------------------------------------------#
+# Rendered-fragment cache.
+#
+# Adds a {% cache key, ttl %}...{% endcache %} tag to Jinja. The key is any
+# expression, usually a tuple ending in the row's id and version, e.g.
+#   {% cache ('artist-row', artist.id, artist.version) %}
+# Every UPDATE bumps the version, so an edited row simply renders under a
+# new key and the old fragment ages out. ttl defaults to FRAGMENT_CACHE_TTL.
+#
+# Fragments live in an in-process LRU unless FRAGMENT_CACHE_REDIS_URL is
+# set; RedisStore works with any client that has Redis' get/set/delete/
+# scan_iter, so tests and local setups can pass a stand-in.
+#----------------------------------------------------------------------------#
+
+import threading
+import time
+from collections import OrderedDict
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class LRUStore(object):
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            expires_at = time.time() + ttl if ttl else None
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisStore(object):
+
+    def __init__(self, client, prefix='fyyur:fragment:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def clear(self):
+        for key in list(self.client.scan_iter(self.prefix + '*')):
+            self.client.delete(key)
+
+
+def fragment_key(key):
+    if isinstance(key, (tuple, list)):
+        return ':'.join(str(part) for part in key)
+    return str(key)
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, ttl, caller):
+        return self.environment.fragment_cache.fetch(key, ttl, caller)
+
+
+class FragmentCache(object):
+
+    def __init__(self, app=None, store=None):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_TTL', 300)
+        app.config.setdefault('FRAGMENT_CACHE_MAX_ENTRIES', 4096)
+        app.config.setdefault('FRAGMENT_CACHE_REDIS_URL', None)
+        self.app = app
+        if self.store is None:
+            if app.config['FRAGMENT_CACHE_REDIS_URL']:
+                # Optional dependency, only needed for a shared cache
+                import redis
+                self.store = RedisStore(redis.Redis.from_url(app.config['FRAGMENT_CACHE_REDIS_URL']))
+            else:
+                self.store = LRUStore(app.config['FRAGMENT_CACHE_MAX_ENTRIES'])
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self
+
+    def fetch(self, key, ttl, render):
+        key = fragment_key(key)
+        value = self.store.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            value = render()
+            self.store.set(key, str(value), ttl or self.app.config['FRAGMENT_CACHE_TTL'])
+        return Markup(value)
+
+    def clear(self):
+        self.store.clear()
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    def render_metrics(self):
+        lines = []
+        for name, value in (('hits', self.hits), ('misses', self.misses)):
+            lines.extend([
+                '# HELP fyyur_fragment_cache_{}_total Template fragment cache {}.'.format(name, name),
+                '# TYPE fyyur_fragment_cache_{}_total counter'.format(name),
+                'fyyur_fragment_cache_{}_total {}'.format(name, value)])
+        return lines
@@ -0,0 +1,184 @@
+#----------------------------------------------------------------------------#
+# Bulk import.
+#
+# Streams a .csv or .jsonl file, validates every row with the same WTForms
+# form the web UI uses, and writes valid rows with one executemany INSERT
+# per chunk. Each chunk is its own transaction; after it commits the number
+# of input rows consumed is written to <file>.checkpoint so an interrupted
+# import resumes where it stopped.
+#
+# Model columns the form does not have (website, seeking_*) are mapped with
+# the converters passed as extra_columns. A key that is neither a form field
+# nor an extra column, or a line that is not a JSON object, makes the row
+# invalid: it is reported and skipped like a row that fails validation.
+# An expand_row hook can turn one input row into several, e.g. a show row
+# with repeat_weeks into one show per week.
+#----------------------------------------------------------------------------#
+
+import csv
+import json
+import os
+from itertools import islice
+from werkzeug.datastructures import MultiDict
+
+
+def read_rows(path):
+    # Yields (line number, row dict, errors); list values in CSV are comma
+    # separated, and errors is set instead of the row for unreadable lines
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        with open(path) as input_file:
+            for line_number, line in enumerate(input_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as error:
+                    yield line_number, None, {'line': ['invalid JSON: {}'.format(error)]}
+                    continue
+                if not isinstance(row, dict):
+                    yield line_number, None, {'line': ['expected a JSON object']}
+                else:
+                    yield line_number, row, None
+    else:
+        with open(path, newline='') as input_file:
+            reader = csv.DictReader(input_file)
+            for row in reader:
+                yield reader.line_num, row, None
+
+
+def text_value(value):
+    if value is None or str(value).strip() == '':
+        return None
+    return str(value).strip()
+
+
+def bool_value(value):
+    # JSON booleans, or the usual spellings in CSV; missing means False
+    if value is None or value == '':
+        return False
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('true', 'yes', 'y', '1'):
+        return True
+    if text in ('false', 'no', 'n', '0'):
+        return False
+    raise ValueError('not a boolean: {!r}'.format(value))
+
+
+class Importer(object):
+
+    def __init__(self, db, model, form_class, chunk_size=1000, check_chunk=None,
+                 extra_columns=None, expand_row=None, echo=print):
+        # check_chunk(values) runs once per chunk for checks that need the
+        # database, e.g. foreign keys. It returns {index: error} for rows to
+        # drop and may normalise the remaining values in place.
+        # extra_columns maps model columns the form lacks to a converter,
+        # which gets the raw value (None when missing) or raises ValueError.
+        # expand_row(data, form) returns the rows to insert for one valid row.
+        self.db = db
+        self.table = model.__table__
+        self.form_class = form_class
+        self.chunk_size = chunk_size
+        self.check_chunk = check_chunk
+        self.expand_row = expand_row
+        self.echo = echo
+        form = form_class(meta={'csrf': False})
+        self.list_fields = {name for name, field in form._fields.items()
+                            if field.type == 'SelectMultipleField'}
+        self.columns = set(form._fields) & set(self.table.columns.keys())
+        self.extra_columns = extra_columns or {}
+        self.known_keys = set(form._fields) | set(self.extra_columns)
+
+    def to_formdata(self, row):
+        formdata = MultiDict()
+        for key, value in row.items():
+            if value is None:
+                continue
+            if isinstance(value, list):
+                formdata.setlist(key, [str(item) for item in value])
+            elif key in self.list_fields:
+                formdata.setlist(key, [item.strip() for item in str(value).split(',')
+                                       if item.strip()])
+            else:
+                formdata.add(key, str(value))
+        return formdata
+
+    def validate(self, row):
+        # Returns (rows to insert, None) or (None, errors)
+        errors = {key: ['unknown column'] for key in row
+                  if key is not None and key not in self.known_keys}
+        if None in row:
+            # csv.DictReader puts values past the header under None
+            errors['line'] = ['more values than columns']
+        extra = {}
+        for column, convert in self.extra_columns.items():
+            try:
+                extra[column] = convert(row.get(column))
+            except ValueError as error:
+                errors[column] = [str(error)]
+        form = self.form_class(formdata=self.to_formdata(row), meta={'csrf': False})
+        if not form.validate():
+            errors.update(form.errors)
+        if errors:
+            return None, errors
+        data = {column: form.data[column] for column in self.columns}
+        data.update(extra)
+        if self.expand_row is not None:
+            return self.expand_row(data, form), None
+        return [data], None
+
+    def run(self, path, restart=False):
+        checkpoint_path = path + '.checkpoint'
+        done = 0
+        if not restart and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint:
+                done = json.load(checkpoint)['rows']
+            self.echo('Resuming {} after row {}'.format(path, done))
+
+        imported = skipped = 0
+        rows = islice(read_rows(path), done, None)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+
+            values = []
+            for line_number, row, errors in chunk:
+                if not errors:
+                    expanded, errors = self.validate(row)
+                if errors:
+                    skipped += 1
+                    self.echo('Line {}: {}'.format(line_number, errors))
+                else:
+                    values.extend((line_number, data) for data in expanded)
+            if values and self.check_chunk is not None:
+                errors = self.check_chunk([data for line_number, data in values])
+                # An expanded line is kept or skipped as a whole
+                bad_lines = {}
+                for index in sorted(errors):
+                    bad_lines.setdefault(values[index][0], errors[index])
+                for line_number, error in sorted(bad_lines.items()):
+                    skipped += 1
+                    self.echo('Line {}: {}'.format(line_number, error))
+                values = [(line_number, data) for line_number, data in values
+                          if line_number not in bad_lines]
+
+            try:
+                if values:
+                    self.db.session.execute(self.table.insert(),
+                                            [data for line_number, data in values])
+                self.db.session.commit()
+            except Exception:
+                self.db.session.rollback()
+                raise
+
+            imported += len(values)
+            done += len(chunk)
+            with open(checkpoint_path, 'w') as checkpoint:
+                json.dump({'rows': done}, checkpoint)
+            self.echo('{} rows read, {} imported, {} skipped'.format(done, imported, skipped))
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return imported, skipped
@@ -0,0 +1,304 @@
+#----------------------------------------------------------------------------#
+# Load test.
+#
+# Drives every Fyyur page and API route against a running server from a
+# pool of keep-alive HTTP connections and prints throughput and p50/p95/p99
+# latency per route as JSON, tagged with the current git commit so runs can
+# be compared. Seed the database first, e.g. `flask seed`, then:
+#
+#   $ python loadtest.py --url http://localhost:5000 --concurrency 8 --duration 30
+#
+# By default only reads are sent. --write-ratio 0.1 makes one request in ten
+# a write (new venues, artists and shows), so counters, invalidation and
+# index upkeep are under load too. Writes add rows: point the server at a
+# scratch database.
+#
+# --metrics-overhead PATH instead runs the app in process and times PATH with
+# request metrics installed and removed on alternate requests, to report what
+# the instrumentation costs:
+#
+#   $ python loadtest.py --metrics-overhead /api/v1/venues --requests 2000
+#----------------------------------------------------------------------------#
+
+import argparse
+import http.client
+import json
+import random
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+SEARCH_TERMS = ['blue', 'hall', 'electric band', 'mid', 'trio']
+WRITE_PLACES = [('Austin', 'TX'), ('San Francisco', 'CA'), ('New York', 'NY')]
+WRITE_GENRES = ['Jazz', 'Blues', 'Folk', 'Rock n Roll']
+SHOW_FILTERS = [
+    {'city': 'Austin', 'state': 'TX'},
+    {'from': '2026-01-01', 'to': '2026-02-01'},
+]
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(samples, elapsed):
+    # samples: {route: [(seconds, status), ...]}
+    report = {}
+    for route, results in sorted(samples.items()):
+        latencies = sorted(seconds for seconds, status in results)
+        report[route] = {
+            'requests': len(results),
+            'errors': sum(1 for seconds, status in results if status >= 500),
+            'throughput': round(len(results) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    return report
+
+
+class Client(object):
+    # One keep-alive connection, reopened after errors
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            self.connection.request(method, path, body=body, headers=headers or {})
+            response = self.connection.getresponse()
+            data = response.read()
+            return response.status, data
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            self.connection = None
+            return 599, b''
+
+
+def discover_ids(client, path, key, limit=200):
+    status, data = client.request('GET', '{}?{}'.format(path, urlencode({'limit': limit})))
+    if status != 200:
+        raise SystemExit('{} answered {}; is the server running and seeded?'.format(path, status))
+    return [row['id'] for row in json.loads(data.decode('utf-8'))[key]]
+
+
+def build_routes(venue_ids, artist_ids):
+    # (route label, callable(rng) -> (method, path, body, headers))
+    form = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+    def get(path):
+        return lambda rng: ('GET', path, None, None)
+
+    def listing(path):
+        return lambda rng: ('GET', '{}?{}'.format(path, urlencode(rng.choice(SHOW_FILTERS))),
+                            None, None)
+
+    def detail(pattern, ids):
+        return lambda rng: ('GET', pattern.format(rng.choice(ids)), None, None)
+
+    def search(path):
+        return lambda rng: ('POST', path, urlencode({'search_term': rng.choice(SEARCH_TERMS)}), form)
+
+    return [
+        ('GET /', get('/')),
+        ('GET /venues', get('/venues')),
+        ('GET /venues?genre', lambda rng: ('GET', '/venues?genre=Jazz', None, None)),
+        ('POST /venues/search', search('/venues/search')),
+        ('GET /venues/<id>', detail('/venues/{}', venue_ids)),
+        ('GET /venues/create', get('/venues/create')),
+        ('GET /venues/<id>/edit', detail('/venues/{}/edit', venue_ids)),
+        ('GET /artists', get('/artists')),
+        ('POST /artists/search', search('/artists/search')),
+        ('GET /artists/<id>', detail('/artists/{}', artist_ids)),
+        ('GET /artists/create', get('/artists/create')),
+        ('GET /artists/<id>/edit', detail('/artists/{}/edit', artist_ids)),
+        ('GET /shows', get('/shows')),
+        ('GET /shows?filters', listing('/shows')),
+        ('GET /shows/create', get('/shows/create')),
+        ('GET /api/v1/venues', get('/api/v1/venues')),
+        ('GET /api/v1/venues/<id>', detail('/api/v1/venues/{}', venue_ids)),
+        ('GET /api/v1/artists', get('/api/v1/artists')),
+        ('GET /api/v1/artists/<id>', detail('/api/v1/artists/{}', artist_ids)),
+        ('GET /api/v1/shows', listing('/api/v1/shows')),
+        ('GET /metrics', get('/metrics')),
+    ]
+
+
+def build_write_routes(venue_ids, artist_ids):
+    # Writes for --write-ratio, same shape as build_routes. Names carry a
+    # random suffix; shows land at a random minute of the next two years, and
+    # a double booking is answered with a 422, not counted as an error.
+    form = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+    def profile(rng, kind):
+        city, state = rng.choice(WRITE_PLACES)
+        return urlencode({
+            'name': 'Load Test {} {:08x}'.format(kind, rng.getrandbits(32)),
+            'city': city,
+            'state': state,
+            'address': '1 Load Test Way',
+            'phone': '512-555-0100',
+            'genres': rng.sample(WRITE_GENRES, rng.randint(1, 2)),
+            'facebook_link': 'https://www.facebook.com/loadtest'
+        }, doseq=True)
+
+    def show(rng):
+        start_time = time.strftime('%Y-%m-%dT%H:%M:00', time.gmtime(
+            time.time() + 60 * rng.randrange(2 * 365 * 24 * 60)))
+        return ('POST', '/api/v1/shows', json.dumps({'shows': [{
+            'venue_id': rng.choice(venue_ids),
+            'artist_id': rng.choice(artist_ids),
+            'start_time': start_time
+        }]}), {'Content-Type': 'application/json'})
+
+    return [
+        ('POST /venues/create', lambda rng: ('POST', '/venues/create', profile(rng, 'Venue'), form)),
+        ('POST /artists/create', lambda rng: ('POST', '/artists/create', profile(rng, 'Artist'), form)),
+        ('POST /api/v1/shows', show),
+    ]
+
+
+def run(url, concurrency, duration, seed, write_ratio=0.0):
+    client = Client(url)
+    venue_ids = discover_ids(client, '/api/v1/venues', 'venues')
+    artist_ids = discover_ids(client, '/api/v1/artists', 'artists')
+    if not venue_ids or not artist_ids:
+        raise SystemExit('No venues or artists found; run `flask seed` first.')
+    routes = build_routes(venue_ids, artist_ids)
+    write_routes = build_write_routes(venue_ids, artist_ids)
+
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(number):
+        # Each worker walks the routes round robin so every route gets load;
+        # with a write ratio, that share of steps sends a random write instead
+        rng = random.Random('{}:{}'.format(seed, number))
+        worker_client = Client(url)
+        position = number
+        local = defaultdict(list)
+        while time.perf_counter() < deadline:
+            if write_ratio and rng.random() < write_ratio:
+                label, make = rng.choice(write_routes)
+            else:
+                label, make = routes[position % len(routes)]
+                position += 1
+            method, path, body, headers = make(rng)
+            start = time.perf_counter()
+            status, data = worker_client.request(method, path, body, headers)
+            local[label].append((time.perf_counter() - start, status))
+        with lock:
+            for label, results in local.items():
+                samples[label].extend(results)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    routes_report = summarize(samples, elapsed)
+    total = sum(route['requests'] for route in routes_report.values())
+    return {
+        'commit': git_commit(),
+        'url': url,
+        'concurrency': concurrency,
+        'write_ratio': write_ratio,
+        'duration': round(elapsed, 2),
+        'requests': total,
+        'throughput': round(total / elapsed, 2),
+        'routes': routes_report,
+    }
+
+
+def metrics_overhead(app, metrics, path, requests=2000):
+    # Installs and removes the metrics hooks and listeners between timed
+    # requests, so drift (caches warming, other load) hits both settings
+    # alike, and compares the median request time of each. The first request
+    # after a switch rebuilds SQLAlchemy's event dispatch; it is not timed,
+    # so the numbers are steady state.
+    client = app.test_client()
+    for _ in range(min(requests, 100)):
+        client.get(path)
+    timings = {False: [], True: []}
+    previous = metrics.enabled
+    try:
+        for number in range(2 * requests):
+            enabled = number % 2 == 1
+            metrics.enabled = enabled
+            client.get(path)
+            start = time.perf_counter()
+            status = client.get(path).status_code
+            timings[enabled].append(time.perf_counter() - start)
+            if status >= 500:
+                raise SystemExit('{} answered {}'.format(path, status))
+    finally:
+        metrics.enabled = previous
+    off = percentile(sorted(timings[False]), 0.50)
+    on = percentile(sorted(timings[True]), 0.50)
+    return {
+        'commit': git_commit(),
+        'path': path,
+        'requests': requests,
+        'off_p50_ms': round(off * 1000, 4),
+        'on_p50_ms': round(on * 1000, 4),
+        'overhead_percent': round((on - off) / off * 100, 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test a running Fyyur server.')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Number of connections making requests at once.')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='Seconds to keep sending requests.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--write-ratio', type=float, default=0.0,
+                        help='Share of requests that write (0 to 1). Use a scratch database.')
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    parser.add_argument('--metrics-overhead', metavar='PATH',
+                        help='Time PATH in process with request metrics on and off instead.')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='Requests per setting for --metrics-overhead.')
+    args = parser.parse_args()
+
+    if args.metrics_overhead:
+        # Imported here: the HTTP load test does not need the app or its database
+        from app import app, metrics
+        report = metrics_overhead(app, metrics, args.metrics_overhead, args.requests)
+    else:
+        if not 0 <= args.write_ratio <= 1:
+            parser.error('--write-ratio must be between 0 and 1')
+        report = run(args.url, args.concurrency, args.duration, args.seed, args.write_ratio)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#----------------------------------------------------------------------------#
+# Logging.
+#
+# Request threads only put records on a queue (QueueHandler); a single
+# QueueListener thread writes them, so a slow disk never stalls a request.
+# Records are JSON lines carrying the request id and route. The request id
+# comes from an incoming X-Request-ID header or is generated, and is echoed
+# back on the response. The log file rotates when it reaches LOG_MAX_BYTES
+# and on the LOG_ROTATE_WHEN schedule, whichever comes first.
+#----------------------------------------------------------------------------#
+
+import atexit
+import json
+import logging
+import os
+import queue
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from flask import g, has_request_context, request
+
+
+class SizedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    # TimedRotatingFileHandler that also rolls over once the file is max_bytes
+
+    def __init__(self, filename, max_bytes=0, when='midnight', backup_count=0):
+        TimedRotatingFileHandler.__init__(self, filename, when=when,
+                                          backupCount=backup_count, delay=True)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record):
+        if TimedRotatingFileHandler.shouldRollover(self, record):
+            return 1
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.seek(0, 2)
+            if self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes:
+                return 1
+        return 0
+
+    def doRollover(self):
+        # Size rollovers can happen several times per interval, so the rotated
+        # name gets a counter instead of replacing an earlier file
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        rotated = base = '{}.{}'.format(self.baseFilename, time.strftime(self.suffix))
+        counter = 1
+        while os.path.exists(rotated):
+            rotated = '{}.{}'.format(base, counter)
+            counter += 1
+        if os.path.exists(self.baseFilename):
+            self.rotate(self.baseFilename, rotated)
+        if self.backupCount > 0:
+            for old in self.getFilesToDelete():
+                os.remove(old)
+        self.stream = self._open()
+        self.rolloverAt = self.computeRollover(int(time.time()))
+
+
+class RequestContextFilter(logging.Filter):
+    # Runs in the thread that logs, while its request is still available
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.route = request.endpoint
+            record.method = request.method
+            record.path = request.path
+        else:
+            record.request_id = record.route = record.method = record.path = None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'route': getattr(record, 'route', None),
+            'method': getattr(record, 'method', None),
+            'path': getattr(record, 'path', None),
+            'location': '{}:{}'.format(record.pathname, record.lineno),
+        }
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class RequestLogging(object):
+
+    def __init__(self, app=None):
+        self.listener = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOG_FILE', 'error.log')
+        app.config.setdefault('LOG_LEVEL', 'INFO')
+        app.config.setdefault('LOG_MAX_BYTES', 10 * 1024 * 1024)
+        app.config.setdefault('LOG_ROTATE_WHEN', 'midnight')
+        app.config.setdefault('LOG_BACKUP_COUNT', 14)
+        self.app = app
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        if app.debug:
+            # Flask's own stderr handler is enough while developing
+            return
+
+        file_handler = SizedTimedRotatingFileHandler(
+            app.config['LOG_FILE'], max_bytes=app.config['LOG_MAX_BYTES'],
+            when=app.config['LOG_ROTATE_WHEN'], backup_count=app.config['LOG_BACKUP_COUNT'])
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+        # Records are rendered to JSON before they are queued, while the
+        # request context they describe still exists
+        queue_handler = QueueHandler(queue.Queue(-1))
+        queue_handler.addFilter(RequestContextFilter())
+        queue_handler.setFormatter(JsonFormatter())
+        self.listener = QueueListener(queue_handler.queue, file_handler)
+        self.listener.start()
+        atexit.register(self.stop)
+
+        app.logger.setLevel(app.config['LOG_LEVEL'])
+        app.logger.addHandler(queue_handler)
+        self.handler = queue_handler
+
+    def stop(self):
+        # Flushes whatever is still queued
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def start_request(self):
+        g.request_id = request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex
+
+    def finish_request(self, response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers['X-Request-ID'] = request_id
+        return response
@@ -0,0 +1,187 @@
+#----------------------------------------------------------------------------#
+# Request metrics.
+#
+# Records wall time, SQL statement count and SQL time for every request,
+# labelled by endpoint, and serves them as Prometheus histograms at
+# /metrics. SQL is timed with engine-wide before/after_cursor_execute
+# events, so replica queries are counted too. Requests slower than
+# METRICS_SLOW_REQUEST_SECONDS are logged with the statements they ran.
+# METRICS_ENABLED=false (or setting .enabled) removes the request hooks and
+# the engine listeners altogether; the overhead can be measured with
+# `python loadtest.py --metrics-overhead`.
+#----------------------------------------------------------------------------#
+
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+MAX_CAPTURED_STATEMENTS = 50
+
+
+class Histogram(object):
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        with self.lock:
+            series = self.series.get(endpoint)
+            if series is None:
+                series = self.series[endpoint] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            series = sorted((endpoint, [list(counts), total, value_sum])
+                            for endpoint, (counts, total, value_sum) in self.series.items())
+        for endpoint, (counts, total, value_sum) in series:
+            cumulative = 0
+            for bucket, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append('{}_bucket{{endpoint="{}",le="{}"}} {}'.format(
+                    self.name, endpoint, bucket, cumulative))
+            lines.append('{}_bucket{{endpoint="{}",le="+Inf"}} {}'.format(
+                self.name, endpoint, total))
+            lines.append('{}_count{{endpoint="{}"}} {}'.format(self.name, endpoint, total))
+            lines.append('{}_sum{{endpoint="{}"}} {}'.format(self.name, endpoint, value_sum))
+        return lines
+
+
+class RequestMetrics(object):
+
+    def __init__(self, app=None):
+        self.request_duration = Histogram(
+            'fyyur_request_duration_seconds', 'Wall time per request.', DURATION_BUCKETS)
+        self.sql_statements = Histogram(
+            'fyyur_request_sql_statements', 'SQL statements run per request.', COUNT_BUCKETS)
+        self.sql_duration = Histogram(
+            'fyyur_request_sql_duration_seconds', 'SQL time per request.', DURATION_BUCKETS)
+        # Callables returning extra exposition lines, e.g. cache counters
+        self.collectors = []
+        self.app = None
+        # The running request's stats, per thread: statement events read
+        # them without going through Flask's context proxies
+        self.local = threading.local()
+        self._enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_SLOW_REQUEST_SECONDS', None)
+        app.config.setdefault('METRICS_ENABLED', True)
+        self.app = app
+        app.add_url_rule('/metrics', 'metrics', self.render)
+        self.enabled = app.config['METRICS_ENABLED']
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, enabled):
+        # Installs or removes the hooks and listeners, so disabled metrics
+        # cost nothing per request or per statement
+        enabled = bool(enabled)
+        if enabled == self._enabled:
+            return
+        self._enabled = enabled
+        hooks = ((self.app.before_request_funcs, self.start_request),
+                 (self.app.after_request_funcs, self.finish_request))
+        listeners = (('before_cursor_execute', self.before_cursor_execute),
+                     ('after_cursor_execute', self.after_cursor_execute),
+                     ('handle_error', self.handle_error))
+        for funcs, hook in hooks:
+            if enabled:
+                # First in line, as when registered at app creation: the
+                # request is timed around the other hooks
+                funcs.setdefault(None, []).insert(0, hook)
+            else:
+                funcs[None].remove(hook)
+        for name, listener in listeners:
+            if enabled:
+                event.listen(Engine, name, listener)
+            else:
+                event.remove(Engine, name, listener)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def start_request(self):
+        self.local.stats = {
+            'start': time.perf_counter(),
+            'statements': 0,
+            'sql_time': 0.0,
+            'captured': [] if self.app.config['METRICS_SLOW_REQUEST_SECONDS'] else None
+        }
+
+    def finish_request(self, response):
+        stats = self.local.__dict__.pop('stats', None)
+        if stats is None:
+            return response
+        duration = time.perf_counter() - stats['start']
+        endpoint = request.endpoint or 'unmatched'
+        self.request_duration.observe(endpoint, duration)
+        self.sql_statements.observe(endpoint, stats['statements'])
+        self.sql_duration.observe(endpoint, stats['sql_time'])
+
+        threshold = self.app.config['METRICS_SLOW_REQUEST_SECONDS']
+        if threshold and duration >= threshold:
+            self.app.logger.warning(
+                'Slow request %s %s (%s): %.3fs, %d SQL statements in %.3fs\n%s',
+                request.method, request.path, endpoint, duration,
+                stats['statements'], stats['sql_time'],
+                '\n'.join('  {:.4f}s {}'.format(elapsed, statement)
+                          for statement, elapsed in stats['captured'] or ()))
+        return response
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        stats = getattr(self.local, 'stats', None)
+        if stats is None:
+            return
+        stats['statements'] += 1
+        stats['sql_time'] += elapsed
+        captured = stats['captured']
+        if captured is not None and len(captured) < MAX_CAPTURED_STATEMENTS:
+            captured.append((statement, elapsed))
+
+    def handle_error(self, exception_context):
+        # A failing statement never reaches after_cursor_execute: drop its
+        # start time, or it would stay on the pooled connection and be paired
+        # with a later statement. Without an execution context the error came
+        # before before_cursor_execute ran, so nothing was pushed.
+        conn = exception_context.connection
+        if conn is None or exception_context.execution_context is None:
+            return
+        starts = conn.info.get('query_start')
+        if starts:
+            starts.pop()
+
+    def render(self):
+        lines = (self.request_duration.render() + self.sql_statements.render()
+                 + self.sql_duration.render())
+        for collector in self.collectors:
+            lines = lines + collector()
+        return Response('\n'.join(lines) + '\n',
+                        mimetype='text/plain; version=0.0.4; charset=utf-8')
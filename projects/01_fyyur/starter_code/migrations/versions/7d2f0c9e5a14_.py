@@ -0,0 +1,43 @@
+"""trigram search indexes
+
+Revision ID: 7d2f0c9e5a14
+Revises: 4c1e7a2d9b31
+Create Date: 2026-10-18 11:03:47.102945
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import logging
+
+logger = logging.getLogger('alembic.env')
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2f0c9e5a14'
+down_revision = '4c1e7a2d9b31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pg_trgm GIN indexes serve name ILIKE '%term%' and similarity() ranking.
+    # They are not declared on the models so db.create_all() keeps working
+    # on databases without the extension. Servers that do not ship pg_trgm
+    # get no indexes; search.NameSearch then uses its in-process index.
+    available = op.get_bind().execute(sa.text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first()
+    if available is None:
+        logger.warning('pg_trgm is not available on this server: skipping the '
+                       'name trigram indexes, search uses the in-process index')
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_Venue_name_trgm', 'Venue', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_Artist_name_trgm', 'Artist', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    # The indexes are missing when upgrade() found no pg_trgm
+    op.execute('DROP INDEX IF EXISTS "ix_Artist_name_trgm"')
+    op.execute('DROP INDEX IF EXISTS "ix_Venue_name_trgm"')
@@ -0,0 +1,194 @@
+#----------------------------------------------------------------------------#
+# Name search.
+#
+# On Postgres with pg_trgm installed, searches run as ILIKE '%term%' backed
+# by a pg_trgm GIN index (see migration 7d2f0c9e5a14) and are ranked with
+# similarity(). Elsewhere (SQLite, servers without pg_trgm, test runs) an
+# in-process inverted index of name trigrams answers the same question. Mapper events queue index changes on
+# the session; they are applied when the transaction commits and dropped
+# when it rolls back, so the index only ever reflects committed names.
+# Rows with deleted_at set are soft-deleted and never match.
+#----------------------------------------------------------------------------#
+
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm import object_session
+
+NGRAM_SIZE = 3
+
+
+def ngrams(text, n=NGRAM_SIZE, padded=True):
+    text = text.lower()
+    if padded:
+        text = '  ' + text + ' '
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NgramIndex(object):
+    # Inverted index from name trigram to the ids whose name contains it
+
+    def __init__(self, n=NGRAM_SIZE):
+        self.n = n
+        self.names = {}
+        self.postings = defaultdict(set)
+
+    def add(self, doc_id, name):
+        self.remove(doc_id)
+        if not name:
+            return
+        self.names[doc_id] = name
+        for gram in ngrams(name, self.n):
+            self.postings[gram].add(doc_id)
+
+    def remove(self, doc_id):
+        name = self.names.pop(doc_id, None)
+        if name is None:
+            return
+        for gram in ngrams(name, self.n):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self.postings[gram]
+
+    def search(self, term, limit=None):
+        # Returns (ids ranked by trigram similarity, total number of matches)
+        needle = term.lower()
+        grams = ngrams(term, self.n, padded=False)
+        if grams:
+            candidates = None
+            for gram in sorted(grams, key=lambda g: len(self.postings.get(g, ()))):
+                ids = self.postings.get(gram, set())
+                candidates = ids.copy() if candidates is None else candidates & ids
+                if not candidates:
+                    return [], 0
+        else:
+            # Terms shorter than a trigram cannot use the postings
+            candidates = self.names.keys()
+
+        matches = [doc_id for doc_id in candidates
+                   if needle in self.names[doc_id].lower()]
+        term_grams = ngrams(term, self.n)
+
+        def rank(doc_id):
+            name_grams = ngrams(self.names[doc_id], self.n)
+            similarity = len(term_grams & name_grams) / float(len(term_grams | name_grams))
+            return (-similarity, self.names[doc_id].lower(), doc_id)
+
+        matches.sort(key=rank)
+        total = len(matches)
+        if limit is not None:
+            matches = matches[:limit]
+        return matches, total
+
+
+class NameSearch(object):
+    # Case-insensitive partial search on a model's name column
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+        self.index = None
+        # Whether pg_trgm is installed, per database URL
+        self.trigram_installed = {}
+        self.info_key = 'name_search_changes:' + model.__tablename__
+        event.listen(model, 'after_insert', self.on_write)
+        event.listen(model, 'after_update', self.on_write)
+        event.listen(model, 'after_delete', self.on_delete)
+        event.listen(db.session, 'after_commit', self.apply_changes)
+        event.listen(db.session, 'after_rollback', self.discard_changes)
+
+    @property
+    def backend(self):
+        backend = current_app.config.get('SEARCH_BACKEND')
+        if backend == 'trigram' and not self.has_trigram():
+            raise RuntimeError('SEARCH_BACKEND is trigram but the pg_trgm extension is not '
+                               'installed; install it and run `flask db upgrade`, or set '
+                               'SEARCH_BACKEND=memory')
+        if backend:
+            return backend
+        if self.has_trigram():
+            return 'trigram'
+        return 'memory'
+
+    def has_trigram(self):
+        # Checked once per database; reset() checks again
+        engine = self.db.engine
+        url = str(engine.url)
+        if url not in self.trigram_installed:
+            installed = False
+            if engine.dialect.name == 'postgresql':
+                installed = engine.execute(
+                    "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first() is not None
+            self.trigram_installed[url] = installed
+        return self.trigram_installed[url]
+
+    def live(self, query):
+        deleted_at = getattr(self.model, 'deleted_at', None)
+        if deleted_at is not None:
+            query = query.filter(deleted_at.is_(None))
+        return query
+
+    def queue_change(self, target, name):
+        # name None removes the row from the index
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault(self.info_key, []).append((target.id, name))
+
+    def on_write(self, mapper, connection, target):
+        if getattr(target, 'deleted_at', None) is not None:
+            self.queue_change(target, None)
+        else:
+            self.queue_change(target, target.name)
+
+    def on_delete(self, mapper, connection, target):
+        self.queue_change(target, None)
+
+    def apply_changes(self, session):
+        changes = session.info.pop(self.info_key, None)
+        if not changes or self.index is None:
+            return
+        for doc_id, name in changes:
+            if name is None:
+                self.index.remove(doc_id)
+            else:
+                self.index.add(doc_id, name)
+
+    def discard_changes(self, session):
+        session.info.pop(self.info_key, None)
+
+    def reset(self):
+        self.index = None
+        self.trigram_installed.clear()
+
+    def load_index(self):
+        if self.index is None:
+            index = NgramIndex()
+            rows = self.live(self.db.session.query(self.model.id, self.model.name))
+            for doc_id, name in rows.yield_per(1000):
+                index.add(doc_id, name)
+            self.index = index
+        return self.index
+
+    def search(self, term, limit):
+        # Returns (matching rows ranked by relevance, total number of matches)
+        term = (term or '').strip()
+        if not term:
+            return [], 0
+
+        if self.backend == 'trigram':
+            rows = self.live(self.db.session.query(
+                self.model, func.count().over().label('total'))).filter(
+                self.model.name.ilike('%' + term + '%')).order_by(
+                func.similarity(self.model.name, term).desc(),
+                self.model.name).limit(limit).all()
+            total = rows[0].total if rows else 0
+            return [row[0] for row in rows], total
+
+        ids, total = self.load_index().search(term, limit)
+        if not ids:
+            return [], total
+        by_id = {row.id: row for row in
+                 self.model.query.filter(self.model.id.in_(ids)).all()}
+        return [by_id[doc_id] for doc_id in ids if doc_id in by_id], total
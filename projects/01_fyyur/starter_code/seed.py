@@ -0,0 +1,130 @@
+#----------------------------------------------------------------------------#
+# Synthetic data.
+#
+# Generates venues, artists and shows from a fixed random seed, so the same
+# arguments always produce the same rows. Cities and genres follow skewed
+# weights, and a few venues and artists get most of the shows, roughly like
+# real listings. Rows are written with one executemany INSERT per chunk.
+#----------------------------------------------------------------------------#
+
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+
+# (city, state, weight): big markets get most of the venues and artists
+CITIES = [
+    ('New York', 'NY', 30), ('Los Angeles', 'CA', 25), ('Chicago', 'IL', 16),
+    ('Austin', 'TX', 14), ('Nashville', 'TN', 12), ('San Francisco', 'CA', 11),
+    ('Seattle', 'WA', 9), ('New Orleans', 'LA', 8), ('Atlanta', 'GA', 7),
+    ('Denver', 'CO', 6), ('Portland', 'OR', 5), ('Minneapolis', 'MN', 4),
+    ('Detroit', 'MI', 4), ('Philadelphia', 'PA', 4), ('Boston', 'MA', 3),
+    ('Miami', 'FL', 3), ('Memphis', 'TN', 2), ('Kansas City', 'MO', 2),
+]
+GENRES = [
+    ('Rock n Roll', 20), ('Pop', 16), ('Hip-Hop', 14), ('Alternative', 12),
+    ('Electronic', 10), ('Jazz', 9), ('R&B', 8), ('Country', 8), ('Folk', 6),
+    ('Blues', 6), ('Punk', 5), ('Soul', 5), ('Heavy Metal', 5), ('Funk', 4),
+    ('Reggae', 3), ('Classical', 3), ('Instrumental', 2), ('Musical Theatre', 2),
+    ('Other', 1),
+]
+VENUE_WORDS = ['Hall', 'Lounge', 'Club', 'Room', 'Theater', 'Bar', 'Ballroom', 'Cellar']
+ARTIST_WORDS = ['Band', 'Collective', 'Trio', 'Quartet', 'Orchestra', 'Project', 'Sound']
+NAME_WORDS = ['Blue', 'Velvet', 'Electric', 'Golden', 'Midnight', 'Silver', 'Wild',
+              'Neon', 'Copper', 'Crimson', 'Hollow', 'Lucky', 'Northern', 'Static']
+
+
+def weighted(choices):
+    values = [value for value, weight in choices]
+    weights = [weight for value, weight in choices]
+    return values, weights
+
+
+class SyntheticData(object):
+
+    def __init__(self, seed=0, now=None):
+        self.seed = seed
+        # Show times are spread around a fixed "now" so runs are repeatable
+        self.now = (now or datetime(2026, 1, 1)).replace(minute=0, second=0, microsecond=0)
+        self.cities = [((city, state), weight) for city, state, weight in CITIES]
+
+    def random(self, kind):
+        # One generator per kind, so changing one count does not reshuffle the rest
+        return random.Random('{}:{}'.format(self.seed, kind))
+
+    def name(self, rng, words, number):
+        return '{} {} {} {}'.format(rng.choice(NAME_WORDS), rng.choice(NAME_WORDS),
+                                    rng.choice(words), number)
+
+    def genres(self, rng):
+        values, weights = weighted(GENRES)
+        return sorted(set(rng.choices(values, weights, k=rng.randint(1, 3))))
+
+    def venues(self, count):
+        rng = self.random('venues')
+        places, weights = weighted(self.cities)
+        for number in range(1, count + 1):
+            city, state = rng.choices(places, weights)[0]
+            yield {
+                'name': self.name(rng, VENUE_WORDS, number),
+                'city': city,
+                'state': state,
+                'address': '{} {} St'.format(rng.randint(1, 9999), rng.choice(NAME_WORDS)),
+                'phone': '{}-555-{:04d}'.format(rng.randint(200, 999), rng.randint(0, 9999)),
+                'genres': self.genres(rng),
+                'image_link': 'https://picsum.photos/seed/venue{}/300/300'.format(number),
+                'facebook_link': 'https://www.facebook.com/venue{}'.format(number),
+                'website': 'https://venue{}.example.com'.format(number),
+                'seeking_talent': rng.random() < 0.3,
+                'seeking_description': None,
+            }
+
+    def artists(self, count):
+        rng = self.random('artists')
+        places, weights = weighted(self.cities)
+        for number in range(1, count + 1):
+            city, state = rng.choices(places, weights)[0]
+            yield {
+                'name': self.name(rng, ARTIST_WORDS, number),
+                'city': city,
+                'state': state,
+                'phone': '{}-555-{:04d}'.format(rng.randint(200, 999), rng.randint(0, 9999)),
+                'genres': self.genres(rng),
+                'image_link': 'https://picsum.photos/seed/artist{}/300/300'.format(number),
+                'facebook_link': 'https://www.facebook.com/artist{}'.format(number),
+                'website': None,
+                'seeking_venue': rng.random() < 0.3,
+                'seeking_description': None,
+            }
+
+    def shows(self, count, venue_ids, artist_ids):
+        # Zipf-like popularity: the k-th venue/artist is picked with weight 1/k
+        rng = self.random('shows')
+        venue_weights = list(accumulate(1.0 / rank for rank in range(1, len(venue_ids) + 1)))
+        artist_weights = list(accumulate(1.0 / rank for rank in range(1, len(artist_ids) + 1)))
+        for _ in range(count):
+            # Two years of history, one year of bookings, evenings only
+            day = rng.randint(-730, 365)
+            start_time = self.now + timedelta(days=day)
+            yield {
+                'venue_id': rng.choices(venue_ids, cum_weights=venue_weights)[0],
+                'artist_id': rng.choices(artist_ids, cum_weights=artist_weights)[0],
+                'start_time': start_time.replace(hour=rng.choice([18, 19, 20, 21, 22])),
+            }
+
+
+def insert_rows(db, model, rows, chunk_size, echo=None):
+    # Inserts rows chunk by chunk and returns the new ids in insertion order
+    table = model.__table__
+    first_id = db.session.query(db.func.coalesce(db.func.max(table.c.id), 0)).scalar()
+    inserted = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        db.session.execute(table.insert(), chunk)
+        db.session.commit()
+        inserted += len(chunk)
+        if echo is not None:
+            echo('{}: {} rows'.format(model.__tablename__, inserted))
+    return [row_id for (row_id,) in db.session.query(table.c.id).filter(
+        table.c.id > first_id).order_by(table.c.id)]
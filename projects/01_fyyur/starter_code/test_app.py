@@ -0,0 +1,1143 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app, db, Venue, Artist, Show, venue_search, artist_search, detail_cache
+from app import fragment_cache, facet_cache, metrics
+from app import roll_over_show_counts, show_count_drift, purge_deleted
+from app import Area, actual_areas
+from app import format_datetime, format_datetimes, datetime_pattern
+import babel.dates
+from search import NgramIndex
+from fragments import FragmentCache, RedisStore
+from seed import SyntheticData
+from loadtest import summarize, metrics_overhead, build_write_routes
+import benchmark
+from logs import RequestLogging
+import json
+import random
+import re
+from flask import Flask, render_template_string
+
+
+class StandInRedis(object):
+    """The few Redis commands the shared stores use, kept in a dict"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode('utf-8') if isinstance(value, str) else value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def scan_iter(self, pattern):
+        return [key for key in self.data if key.startswith(pattern.rstrip('*'))]
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the fyyur test case"""
+
+    def setUp(self):
+        """Define test variables and point the app at the test database."""
+        self.database_user = os.environ.get("PSQL_USER")
+        self.database_password = os.environ.get("PSQL_PWD")
+        self.database_name = "fyyur_test"
+        self.database_path = "postgresql://{}:{}@{}/{}".format(self.database_user, self.database_password,'localhost:5432', self.database_name)
+        app.config['SQLALCHEMY_DATABASE_URI'] = self.database_path
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SEARCH_BACKEND'] = 'memory'
+        self.client = app.test_client
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        venue_search.reset()
+        artist_search.reset()
+        detail_cache.clear()
+        facet_cache.clear()
+        fragment_cache.clear()
+
+    def seed_venues(self, how_many, shows_per_venue=1):
+        artist = Artist(name='Test Artist', city='San Francisco', state='CA',
+                        genres=['Jazz'])
+        db.session.add(artist)
+        for i in range(how_many):
+            venue = Venue(name='Venue {}'.format(i),
+                          city='City {}'.format(i % 3), state='CA',
+                          genres=['Jazz'])
+            db.session.add(venue)
+            for j in range(shows_per_venue):
+                db.session.add(Show(venues=venue, artists=artist,
+                                    start_time=datetime.utcnow() + timedelta(days=j + 1)))
+        db.session.commit()
+        db.session.remove()
+
+    def capture_statements(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        return res, statements
+
+    def count_queries(self, url):
+        res, statements = self.capture_statements(url)
+        return res, len(statements)
+
+    def use_replica(self):
+        """Adds an empty 'replica' bind for this test and returns its engine."""
+        app.config['SQLALCHEMY_BINDS'] = {'replica': self.database_path + '_replica'}
+        self.addCleanup(app.config.__setitem__, 'SQLALCHEMY_BINDS', {})
+        replica = db.get_engine(app, bind='replica')
+        db.Model.metadata.drop_all(bind=replica)
+        db.Model.metadata.create_all(bind=replica)
+        self.addCleanup(db.Model.metadata.drop_all, bind=replica)
+        return replica
+
+    #@app.route('/venues')
+    def test_venues_query_count_is_constant(self):
+        self.seed_venues(3)
+        res, few_venues_queries = self.count_queries('/venues')
+        self.assertEqual(res.status_code, 200)
+
+        self.seed_venues(30, shows_per_venue=3)
+        res, many_venues_queries = self.count_queries('/venues')
+        self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(few_venues_queries, many_venues_queries)
+
+    def test_venues_grouped_by_area_with_upcoming_shows(self):
+        self.seed_venues(6, shows_per_venue=2)
+        res = self.client().get('/venues')
+        body = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(body.count('City 0, CA'), 1)
+        self.assertEqual(body.count('City 1, CA'), 1)
+        self.assertIn('Venue 5', body)
+
+    #@app.route('/shows')
+    def test_shows_query_count_is_constant(self):
+        self.seed_venues(2)
+        res, few_shows_queries = self.count_queries('/shows')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Test Artist', res.get_data(as_text=True))
+
+        self.seed_venues(20, shows_per_venue=4)
+        res, many_shows_queries = self.count_queries('/shows')
+        self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(few_shows_queries, many_shows_queries)
+
+    #@app.route('/venues/<int:venue_id>')
+    def test_show_venue_single_query_then_cached(self):
+        self.seed_venues(1, shows_per_venue=3)
+        venue_id = Venue.query.first().id
+        db.session.remove()
+
+        # The fingerprint, then the venue with its shows
+        res, queries = self.count_queries('/venues/{}'.format(venue_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('3 Upcoming', res.get_data(as_text=True))
+        self.assertEqual(queries, 2)
+
+        # Only the fingerprint
+        res, queries = self.count_queries('/venues/{}'.format(venue_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(queries, 1)
+
+    def test_show_venue_cache_invalidated_by_related_writes(self):
+        self.seed_venues(1, shows_per_venue=1)
+        venue = Venue.query.first()
+        venue_id, artist_id = venue.id, venue.shows[0].artist_id
+        db.session.remove()
+        self.client().get('/venues/{}'.format(venue_id))
+
+        db.session.add(Show(venue_id=venue_id, artist_id=artist_id,
+                            start_time=datetime.now() - timedelta(days=1)))
+        db.session.commit()
+        res = self.client().get('/venues/{}'.format(venue_id))
+        self.assertIn('1 Past', res.get_data(as_text=True))
+
+        Artist.query.get(artist_id).name = 'Renamed Artist'
+        db.session.commit()
+        res = self.client().get('/venues/{}'.format(venue_id))
+        self.assertIn('Renamed Artist', res.get_data(as_text=True))
+
+    def test_404_show_venue_not_found(self):
+        res = self.client().get('/venues/90000000')
+        self.assertEqual(res.status_code, 404)
+
+    #@app.route('/artists/<int:artist_id>')
+    def test_show_artist_sections_paged_in_sql(self):
+        artist = Artist(name='Touring Artist', city='Austin', state='TX',
+                        genres=['Jazz'])
+        venue = Venue(name='Big Venue', city='Austin', state='TX',
+                      genres=['Jazz'])
+        db.session.add_all([artist, venue])
+        for i in range(45):
+            db.session.add(Show(venues=venue, artists=artist,
+                                start_time=datetime.now() - timedelta(days=i + 1)))
+        db.session.add(Show(venues=venue, artists=artist,
+                            start_time=datetime.now() + timedelta(days=1)))
+        db.session.commit()
+        artist_id = artist.id
+        db.session.remove()
+
+        res, queries = self.count_queries('/artists/{}'.format(artist_id))
+        body = res.get_data(as_text=True)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('45 Past', body)
+        self.assertIn('1 Upcoming', body)
+        self.assertIn('past_page=2', body)
+        self.assertEqual(queries, 3)
+
+        res = self.client().get('/artists/{}?past_page=3'.format(artist_id))
+        body = res.get_data(as_text=True)
+        self.assertEqual(body.count('Show Venue Image'), 5 + 1)
+        self.assertIn('past_page=2', body)
+        self.assertNotIn('past_page=4', body)
+
+        # A page past the end still shows the section's total
+        body = self.client().get('/artists/{}?past_page=9'.format(artist_id)).get_data(as_text=True)
+        self.assertIn('45 Past', body)
+
+    def test_show_artist_counts_leave_out_deleted_venues(self):
+        self.seed_venues(2)
+        artist = Artist.query.first()
+        artist_id = artist.id
+        Venue.query.filter_by(name='Venue 0').one().deleted_at = datetime.now()
+        db.session.commit()
+        db.session.remove()
+
+        body = self.client().get('/artists/{}'.format(artist_id)).get_data(as_text=True)
+        self.assertIn('1 Upcoming', body)
+        self.assertEqual(body.count('Show Venue Image'), 1)
+
+    def test_404_show_artist_not_found(self):
+        res = self.client().get('/artists/90000000')
+        self.assertEqual(res.status_code, 404)
+
+    def test_genre_filter_and_facets(self):
+        for name, genres in [('Jazz Club', ['Jazz']), ('Blues Bar', ['Blues', 'Jazz']),
+                             ('Rock Hall', ['Rock n Roll'])]:
+            db.session.add(Artist(name=name, city='Austin', state='TX', genres=genres))
+        db.session.commit()
+
+        res = self.client().get('/artists?genre=Jazz')
+        body = res.get_data(as_text=True)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Jazz Club', body)
+        self.assertIn('Blues Bar', body)
+        self.assertNotIn('Rock Hall', body)
+        self.assertIn('Jazz (2)', body)
+        self.assertIn('Blues (1)', body)
+        self.assertNotIn('Rock n Roll (', body)
+
+        res = self.client().get('/artists?genre=Jazz&genre=Blues')
+        body = res.get_data(as_text=True)
+        self.assertNotIn('Jazz Club', body)
+        self.assertIn('Blues Bar', body)
+
+    def test_genre_facets_cached_until_genres_change(self):
+        for name, genres in [('Jazz Club', ['Jazz']), ('Blues Bar', ['Blues', 'Jazz'])]:
+            db.session.add(Artist(name=name, city='Austin', state='TX', genres=genres))
+        db.session.commit()
+        db.session.remove()
+
+        def facet_scans(url):
+            res, statements = self.capture_statements(url)
+            return (res.get_data(as_text=True),
+                    len([statement for statement in statements if 'unnest' in statement]))
+
+        self.assertEqual(facet_scans('/artists')[1], 1)
+        body, scans = facet_scans('/artists')
+        self.assertEqual(scans, 0)
+        self.assertIn('Jazz (2)', body)
+
+        # Renaming does not touch the counts; changing genres does
+        artist = Artist.query.filter_by(name='Jazz Club').one()
+        artist.name = 'Jazz Cellar'
+        db.session.commit()
+        self.assertEqual(facet_scans('/artists')[1], 0)
+        artist = Artist.query.filter_by(name='Jazz Cellar').one()
+        artist.genres = ['Blues']
+        db.session.commit()
+        db.session.remove()
+        body, scans = facet_scans('/artists')
+        self.assertEqual(scans, 1)
+        self.assertIn('Jazz (1)', body)
+        self.assertIn('Blues (2)', body)
+
+    def test_unknown_facet_selections_are_not_cached(self):
+        db.session.add(Venue(name='Jazz Club', city='Austin', state='TX', genres=['Jazz']))
+        db.session.commit()
+        db.session.remove()
+        self.client().get('/venues')
+        self.client().get('/venues?state=TX')
+        entries = len(facet_cache.entries)
+
+        for query in ('genre=Polka', 'genre=Jazz&genre=x{}', 'state=ZZ', 'state=TX&genre=nope'):
+            res = self.client().get('/venues?' + query)
+            self.assertEqual(res.status_code, 200)
+            self.assertNotIn('Jazz (', res.get_data(as_text=True))
+        self.assertEqual(len(facet_cache.entries), entries)
+
+        # A repeated genre shares the entry of the plain selection
+        self.client().get('/venues?genre=Jazz&genre=Jazz')
+        self.client().get('/venues?genre=Jazz')
+        self.assertEqual(len(facet_cache.entries), entries + 1)
+
+    def test_show_counters_follow_writes_and_rollover(self):
+        self.seed_venues(1, shows_per_venue=2)
+        venue = Venue.query.first()
+        artist = Artist.query.first()
+        self.assertEqual((venue.upcoming_show_count, venue.past_show_count), (2, 0))
+        self.assertEqual((artist.upcoming_show_count, artist.past_show_count), (2, 0))
+
+        soon = Show.query.order_by(Show.start_time).first()
+        soon.start_time = datetime.now() - timedelta(hours=1)
+        db.session.commit()
+        self.assertEqual((venue.upcoming_show_count, venue.past_show_count), (1, 1))
+
+        db.session.delete(soon)
+        db.session.commit()
+        self.assertEqual((artist.upcoming_show_count, artist.past_show_count), (1, 0))
+
+        roll_over_show_counts(datetime.now() + timedelta(days=30))
+        self.assertEqual((venue.upcoming_show_count, venue.past_show_count), (0, 1))
+        self.assertEqual(show_count_drift(), [])
+
+    def test_show_counters_follow_edits_of_committed_shows(self):
+        # After a commit the attributes are expired, so the old values have to
+        # be loaded when they are set (active_history)
+        self.seed_venues(2, shows_per_venue=1)
+        show = Show.query.order_by(Show.id).first()
+        other_venue = Venue.query.order_by(Venue.id.desc()).first()
+        db.session.commit()
+
+        show.start_time = datetime.now() - timedelta(days=1)
+        db.session.commit()
+        self.assertEqual(show_count_drift(), [])
+
+        show.venue_id = other_venue.id
+        db.session.commit()
+        self.assertEqual(show_count_drift(), [])
+        self.assertEqual((other_venue.upcoming_show_count, other_venue.past_show_count), (1, 1))
+
+    def test_check_show_counts_reports_and_fixes_drift(self):
+        self.seed_venues(2, shows_per_venue=1)
+        db.session.execute(Venue.__table__.update().values(upcoming_show_count=7))
+        db.session.commit()
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['check-show-counts'])
+        self.assertIn('2 rows drifted', result.output)
+        self.assertIn('upcoming 7 (actual 1)', result.output)
+
+        result = runner.invoke(args=['check-show-counts', '--fix'])
+        self.assertIn('Recounted', result.output)
+        self.assertEqual(show_count_drift(), [])
+
+    def assertAreasCurrent(self):
+        stored = sorted(tuple(area) for area in db.session.query(
+            Area.state, Area.city, Area.venue_count, Area.upcoming_show_count))
+        self.assertEqual(stored, sorted(tuple(area) for area in actual_areas()))
+
+    def test_area_catalog_follows_venue_and_show_writes(self):
+        self.seed_venues(3, shows_per_venue=2)
+        self.assertEqual(Area.query.filter_by(city='City 0').one().upcoming_show_count, 2)
+
+        venue = Venue.query.filter_by(name='Venue 1').one()
+        venue.city, venue.state = 'Austin', 'TX'
+        db.session.commit()
+        self.assertAreasCurrent()
+        self.assertIsNone(Area.query.filter_by(city='City 1').first())
+
+        db.session.delete(Show.query.filter_by(venue_id=venue.id).first())
+        db.session.commit()
+        self.assertEqual(Area.query.filter_by(city='Austin').one().upcoming_show_count, 1)
+
+        roll_over_show_counts(datetime.now() + timedelta(days=30))
+        self.assertAreasCurrent()
+
+        self.client().delete('/venues/{}'.format(venue.id))
+        self.assertIsNone(Area.query.filter_by(city='Austin').first())
+        self.assertAreasCurrent()
+
+        db.session.execute(Area.__table__.delete())
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=['rebuild-areas'])
+        self.assertIn('Rebuilt 2 areas', result.output)
+        self.assertAreasCurrent()
+
+    def test_area_catalog_follows_edits_of_committed_venues(self):
+        self.seed_venues(2, shows_per_venue=2)
+        venue = Venue.query.filter_by(name='Venue 1').one()
+        db.session.commit()
+
+        venue.city, venue.state = 'Austin', 'TX'
+        db.session.commit()
+        self.assertAreasCurrent()
+        self.assertIsNone(Area.query.filter_by(city='City 1').first())
+
+        venue.city = 'Dallas'
+        db.session.commit()
+        self.assertAreasCurrent()
+
+        venue.deleted_at = datetime.now()
+        db.session.commit()
+        self.assertAreasCurrent()
+        self.assertIsNone(Area.query.filter_by(city='Dallas').first())
+
+    def test_venues_state_drill_down(self):
+        self.seed_venues(2)
+        db.session.add(Venue(name='Lone Star Hall', city='Austin', state='TX', genres=['Jazz']))
+        db.session.commit()
+
+        body = self.client().get('/venues').get_data(as_text=True)
+        self.assertIn('href="/venues?state=TX"', body)
+        self.assertIn('CA <small>(2 venues, 2 upcoming shows)</small>', body)
+
+        body = self.client().get('/venues?state=TX').get_data(as_text=True)
+        self.assertIn('Lone Star Hall', body)
+        self.assertNotIn('Venue 0', body)
+        self.assertIn('Austin <small>(1 venues, 0 upcoming shows)</small>', body)
+
+    #@api.route('/venues/<int:venue_id>')
+    def test_api_venue_conditional_get(self):
+        self.seed_venues(1, shows_per_venue=2)
+        venue = Venue.query.first()
+        venue_id, artist_id = venue.id, venue.shows[0].artist_id
+        db.session.remove()
+
+        res = self.client().get('/api/v1/venues/{}'.format(venue_id))
+        data = res.get_json()
+        etag = res.headers['ETag']
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['upcoming_shows_count'], 2)
+        self.assertEqual(data['upcoming_shows'][0]['artist_name'], 'Test Artist')
+
+        res = self.client().get('/api/v1/venues/{}'.format(venue_id),
+                                headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+        Artist.query.get(artist_id).name = 'Renamed Artist'
+        db.session.commit()
+        res = self.client().get('/api/v1/venues/{}'.format(venue_id),
+                                headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertEqual(res.get_json()['upcoming_shows'][0]['artist_name'], 'Renamed Artist')
+
+    def test_api_shows_list_conditional_get(self):
+        self.seed_venues(2)
+        res = self.client().get('/api/v1/shows')
+        self.assertEqual(len(res.get_json()['shows']), 2)
+
+        res = self.client().get('/api/v1/shows', headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+        show = Show.query.first()
+        show.start_time = show.start_time + timedelta(hours=1)
+        db.session.commit()
+        res = self.client().get('/api/v1/shows', headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 200)
+
+    #@api.route('/shows', methods=['POST'])
+    def test_api_create_shows_batch_is_all_or_nothing(self):
+        self.seed_venues(1, shows_per_venue=1)
+        venue, artist = Venue.query.first(), Artist.query.first()
+        booked = Show.query.first().start_time
+        venue_id, artist_id = venue.id, artist.id
+        db.session.remove()
+
+        def show(start_time, venue_id=venue_id, artist_id=artist_id):
+            return {'artist_id': artist_id, 'venue_id': venue_id,
+                    'start_time': start_time.isoformat()}
+
+        later = booked + timedelta(days=10)
+        res = self.client().post('/api/v1/shows', json={'shows': [
+            show(later), show(booked + timedelta(hours=1)),
+            show(later + timedelta(hours=2)), show(later, venue_id=90000000)]})
+        data = res.get_json()
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['errors'], ['venue 90000000 does not exist'])
+
+        res = self.client().post('/api/v1/shows', json={'shows': [
+            show(later), show(booked + timedelta(hours=1)), show(later + timedelta(hours=2))]})
+        errors = res.get_json()['errors']
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(Show.query.count(), 1)
+
+        res = self.client().post('/api/v1/shows', json={'shows': [
+            show(later), show(later + timedelta(days=1))]})
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.get_json()['created'], 2)
+        self.assertEqual(Show.query.count(), 3)
+        self.assertEqual(Venue.query.get(venue_id).upcoming_show_count, 3)
+
+    def test_api_create_shows_converts_timezones_to_utc(self):
+        self.seed_venues(1, shows_per_venue=0)
+        venue_id, artist_id = Venue.query.first().id, Artist.query.first().id
+        db.session.remove()
+
+        res = self.client().post('/api/v1/shows', json={'shows': [
+            {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': '2035-01-01T20:00:00Z'},
+            {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': '2035-01-02T22:00:00+02:00'}]})
+        self.assertEqual(res.status_code, 201, res.get_data(as_text=True))
+        self.assertEqual([show.start_time for show in Show.query.order_by(Show.start_time)],
+                         [datetime(2035, 1, 1, 20), datetime(2035, 1, 2, 20)])
+        self.assertEqual(Venue.query.get(venue_id).upcoming_show_count, 2)
+
+        # The double booking check compares the converted times too
+        res = self.client().post('/api/v1/shows', json={'shows': [
+            {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': '2035-01-01T15:00:00-05:00'}]})
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(len(res.get_json()['errors']), 1)
+
+    #@app.route('/shows/create', methods=['POST'])
+    def test_create_show_repeats_weekly(self):
+        self.seed_venues(1, shows_per_venue=0)
+        venue_id, artist_id = Venue.query.first().id, Artist.query.first().id
+        start = datetime.now().replace(microsecond=0) + timedelta(days=1)
+        res = self.client().post('/shows/create', data={
+            'artist_id': artist_id, 'venue_id': venue_id,
+            'start_time': start.strftime('%Y-%m-%d %H:%M:%S'), 'repeat_weeks': 4})
+        self.assertIn('successfully listed', res.get_data(as_text=True))
+        self.assertEqual([show.start_time for show in Show.query.order_by(Show.start_time)],
+                         [start + timedelta(weeks=week) for week in range(4)])
+
+    def test_create_show_form_passes_csrf(self):
+        app.config['WTF_CSRF_ENABLED'] = True
+        self.seed_venues(1, shows_per_venue=0)
+        venue_id, artist_id = Venue.query.first().id, Artist.query.first().id
+        with self.client() as client:
+            page = client.get('/shows/create').get_data(as_text=True)
+            token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+            res = client.post('/shows/create', data={
+                'csrf_token': token, 'artist_id': artist_id, 'venue_id': venue_id,
+                'start_time': (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')})
+        self.assertIn('successfully listed', res.get_data(as_text=True))
+        self.assertEqual(Show.query.count(), 1)
+
+    #@app.route('/venues/<venue_id>', methods=['DELETE'])
+    def test_deleted_venue_is_hidden_then_purged(self):
+        self.seed_venues(2, shows_per_venue=3)
+        venue = Venue.query.order_by(Venue.id).first()
+        venue_id, artist_id = venue.id, venue.shows[0].artist_id
+        db.session.remove()
+
+        res = self.client().delete('/venues/{}'.format(venue_id))
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(Show.query.count(), 6)
+        self.assertNotIn('Venue 0', self.client().get('/venues').get_data(as_text=True))
+        self.assertNotIn('Venue 0', self.client().get('/shows').get_data(as_text=True))
+        res = self.client().post('/venues/search', data={'search_term': 'Venue'})
+        self.assertIn('Number of search results for "Venue": 1', res.get_data(as_text=True))
+        self.assertEqual(self.client().get('/venues/{}'.format(venue_id)).status_code, 404)
+        self.assertEqual(self.client().get('/api/v1/venues/{}'.format(venue_id)).status_code, 404)
+
+        self.assertEqual(purge_deleted(batch_size=2), (3, 1))
+        self.assertIsNone(Venue.query.get(venue_id))
+        self.assertEqual(Show.query.count(), 3)
+        self.assertEqual(Artist.query.get(artist_id).upcoming_show_count, 3)
+        self.assertEqual(show_count_drift(), [])
+
+    #@app.route('/artists/<artist_id>', methods=['DELETE'])
+    def test_purge_deleted_command_removes_artist(self):
+        self.seed_venues(2, shows_per_venue=1)
+        artist_id = Artist.query.first().id
+        db.session.remove()
+        self.client().delete('/artists/{}'.format(artist_id))
+        self.assertEqual(self.client().get('/artists/{}'.format(artist_id)).status_code, 404)
+        self.assertEqual(Venue.query.first().upcoming_show_count, 1)
+
+        result = app.test_cli_runner().invoke(args=['purge-deleted'])
+        self.assertIn('Purged 1 venues and artists, 2 shows', result.output)
+        self.assertEqual(Show.query.count(), 0)
+        self.assertEqual([venue.upcoming_show_count for venue in Venue.query], [0, 0])
+        self.assertAreasCurrent()
+
+    def test_artist_rows_cached_until_edited(self):
+        for name in ('First Artist', 'Second Artist'):
+            db.session.add(Artist(name=name, city='Austin', state='TX', genres=['Jazz']))
+        db.session.commit()
+        artist_id = Artist.query.filter_by(name='Second Artist').first().id
+        db.session.remove()
+
+        self.client().get('/artists')
+        misses = fragment_cache.misses
+        self.client().get('/artists')
+        self.assertEqual(fragment_cache.misses, misses)
+
+        self.client().post('/artists/{}/edit'.format(artist_id), data={
+            'name': 'Renamed Artist', 'city': 'Austin', 'state': 'TX',
+            'phone': '512-555-0100', 'genres': ['Jazz'], 'facebook_link': ''})
+        res = self.client().get('/artists')
+        body = res.get_data(as_text=True)
+        self.assertIn('Renamed Artist', body)
+        self.assertNotIn('Second Artist', body)
+        self.assertEqual(fragment_cache.misses, misses + 1)
+
+        res = self.client().get('/metrics')
+        self.assertIn('fyyur_fragment_cache_hits_total {}'.format(fragment_cache.hits),
+                      res.get_data(as_text=True))
+
+    def test_fragment_cache_redis_store(self):
+        client = StandInRedis()
+        other_app = Flask(__name__)
+        cache = FragmentCache(other_app, store=RedisStore(client))
+        template = "{% cache ('row', id), 30 %}<b>{{ name }}</b>{% endcache %}"
+        with other_app.app_context():
+            self.assertEqual(render_template_string(template, id=1, name='A & B'),
+                             '<b>A &amp; B</b>')
+            self.assertEqual(render_template_string(template, id=1, name='changed'),
+                             '<b>A &amp; B</b>')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(list(client.data), ['fyyur:fragment:row:1'])
+        cache.clear()
+        self.assertEqual(client.data, {})
+
+    def test_404_api_artist_not_found(self):
+        res = self.client().get('/api/v1/artists/90000000')
+        data = res.get_json()
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Resource not found')
+
+    #@app.route('/artists')
+    def test_artists_keyset_pagination(self):
+        for i in range(5):
+            db.session.add(Artist(name='Artist {}'.format(i), city='Austin',
+                                  state='TX', genres=['Jazz']))
+        db.session.commit()
+        ids = [artist.id for artist in Artist.query.order_by(Artist.name, Artist.id)]
+        db.session.remove()
+
+        res = self.client().get('/artists?limit=2')
+        body = res.get_data(as_text=True)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Artist 1', body)
+        self.assertNotIn('Artist 2', body)
+        self.assertIn('after={}'.format(ids[1]), body)
+
+        res = self.client().get('/artists?limit=2&after={}'.format(ids[3]))
+        body = res.get_data(as_text=True)
+        self.assertIn('Artist 4', body)
+        self.assertNotIn('Artist 3', body)
+        self.assertIn('before={}'.format(ids[4]), body)
+
+        res = self.client().get('/artists?limit=2&before={}'.format(ids[4]))
+        body = res.get_data(as_text=True)
+        self.assertIn('Artist 2', body)
+        self.assertIn('Artist 3', body)
+        self.assertNotIn('Artist 4', body)
+
+    #@app.route('/venues/search', methods=['POST'])
+    def test_search_venues_partial_case_insensitive(self):
+        for name in ['The Musical Hop', 'Park Square Live Music & Coffee',
+                     'The Dueling Pianos Bar']:
+            db.session.add(Venue(name=name, city='San Francisco', state='CA',
+                                 genres=['Jazz']))
+        db.session.commit()
+
+        res = self.client().post('/venues/search', data={'search_term': 'Music'})
+        body = res.get_data(as_text=True)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('The Musical Hop', body)
+        self.assertIn('Park Square Live Music &amp; Coffee', body)
+        self.assertNotIn('The Dueling Pianos Bar', body)
+
+        res = self.client().post('/venues/search', data={'search_term': 'hop'})
+        self.assertIn('The Musical Hop', res.get_data(as_text=True))
+
+    def test_search_index_follows_artist_edits(self):
+        artist = Artist(name='Guns N Petals', city='San Francisco', state='CA',
+                        genres=['Rock n Roll'])
+        db.session.add(artist)
+        db.session.commit()
+        artist_id = artist.id
+
+        res = self.client().post('/artists/search', data={'search_term': 'petals'})
+        self.assertIn('Guns N Petals', res.get_data(as_text=True))
+
+        artist = Artist.query.get(artist_id)
+        artist.name = 'Matt Quevedo'
+        db.session.commit()
+
+        res = self.client().post('/artists/search', data={'search_term': 'petals'})
+        self.assertNotIn('Guns N Petals', res.get_data(as_text=True))
+        res = self.client().post('/artists/search', data={'search_term': 'a'})
+        self.assertIn('Matt Quevedo', res.get_data(as_text=True))
+
+    def test_search_index_ignores_rolled_back_edits(self):
+        artist = Artist(name='Guns N Petals', city='San Francisco', state='CA',
+                        genres=['Rock n Roll'])
+        db.session.add(artist)
+        db.session.commit()
+        artist_id = artist.id
+        with app.test_request_context():
+            artist_search.load_index()
+
+            artist = Artist.query.get(artist_id)
+            artist.name = 'Matt Quevedo'
+            db.session.flush()
+            db.session.rollback()
+
+            artists, total = artist_search.search('petals', 10)
+            self.assertEqual([artist.id for artist in artists], [artist_id])
+            self.assertEqual(artist_search.search('quevedo', 10), ([], 0))
+
+    def test_search_trigram_backend_on_postgres(self):
+        with app.app_context():
+            try:
+                db.session.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.skipTest('pg_trgm is not available')
+        app.config['SEARCH_BACKEND'] = 'trigram'
+        for name in ['The Musical Hop', 'Musical', 'The Dueling Pianos Bar']:
+            db.session.add(Venue(name=name, city='San Francisco', state='CA',
+                                 genres=['Jazz']))
+        db.session.commit()
+        with app.test_request_context():
+            venues, total = venue_search.search('music', 1)
+            self.assertEqual(total, 2)
+            self.assertEqual([venue.name for venue in venues], ['Musical'])
+
+    def test_search_without_pg_trgm_uses_memory_index(self):
+        with app.app_context():
+            db.session.execute('DROP EXTENSION IF EXISTS pg_trgm')
+            db.session.commit()
+        db.session.add(Venue(name='The Musical Hop', city='San Francisco', state='CA',
+                             genres=['Jazz']))
+        db.session.commit()
+        app.config['SEARCH_BACKEND'] = None
+        with app.test_request_context():
+            self.assertEqual(venue_search.backend, 'memory')
+            venues, total = venue_search.search('music', 10)
+            self.assertEqual([venue.name for venue in venues], ['The Musical Hop'])
+
+            app.config['SEARCH_BACKEND'] = 'trigram'
+            with self.assertRaises(RuntimeError) as raised:
+                venue_search.search('music', 10)
+            self.assertIn('pg_trgm', str(raised.exception))
+
+    def test_ngram_index_ranks_closer_names_first(self):
+        index = NgramIndex()
+        index.add(1, 'The Wild Sax Band')
+        index.add(2, 'Band')
+        index.add(3, 'Guns N Petals')
+
+        ids, total = index.search('band')
+        self.assertEqual(ids, [2, 1])
+        self.assertEqual(total, 2)
+
+        index.remove(2)
+        self.assertEqual(index.search('band', limit=1), ([1], 1))
+
+    def test_format_datetime_matches_babel(self):
+        start_time = datetime(2035, 4, 1, 20, 0, 0)
+        self.assertEqual(format_datetime(start_time, 'full'),
+                         babel.dates.format_datetime(start_time, "EEEE MMMM, d, y 'at' h:mma"))
+        self.assertEqual(format_datetime('2035-04-01 20:00:00'),
+                         format_datetime(start_time, 'medium'))
+        self.assertEqual(format_datetime(start_time, 'short'),
+                         babel.dates.format_datetime(start_time, 'short'))
+
+        datetime_pattern.cache_clear()
+        start_times = [start_time + timedelta(hours=i) for i in range(10)]
+        self.assertEqual(format_datetimes(start_times, 'full'),
+                         [format_datetime(value, 'full') for value in start_times])
+        self.assertEqual(datetime_pattern.cache_info().misses, 1)
+        self.assertEqual(format_datetimes(['2035-04-01 20:00:00'], 'short'),
+                         [format_datetime(start_time, 'short')])
+
+    def test_import_command_validates_and_checkpoints(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        venues_path = os.path.join(tmp_dir, 'venues.csv')
+        with open(venues_path, 'w') as venues_file:
+            venues_file.write('name,city,state,address,genres,facebook_link\n')
+            for i in range(5):
+                venues_file.write('Venue {0},Austin,TX,{0} Main St,"Jazz,Blues",'
+                                  'https://www.facebook.com/venue{0}\n'.format(i))
+            venues_file.write('Bad Venue,Austin,ZZ,1 Main St,Jazz,https://www.facebook.com/bad\n')
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['import', venues_path, '--chunk-size', '2'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Imported 5 venues, skipped 1 invalid rows', result.output)
+        self.assertEqual(Venue.query.filter(Venue.genres.contains(['Blues'])).count(), 5)
+        self.assertFalse(os.path.exists(venues_path + '.checkpoint'))
+
+        venue_id = Venue.query.first().id
+        artist = Artist(name='Importer', city='Austin', state='TX', genres=['Jazz'])
+        db.session.add(artist)
+        db.session.commit()
+        shows_path = os.path.join(tmp_dir, 'shows.jsonl')
+        with open(shows_path, 'w') as shows_file:
+            shows_file.write('{{"artist_id": {}, "venue_id": {}, "start_time": "2035-01-01 20:00:00"}}\n'.format(artist.id, venue_id))
+            shows_file.write('{{"artist_id": {}, "venue_id": 90000000, "start_time": "2035-01-01 20:00:00"}}\n'.format(artist.id))
+            shows_file.write('{{"artist_id": {}, "venue_id": {}, "start_time": "2035-01-02 20:00:00"}}\n'.format(artist.id, venue_id))
+        with open(shows_path + '.checkpoint', 'w') as checkpoint:
+            checkpoint.write('{"rows": 2}')
+        db.session.remove()
+
+        result = runner.invoke(args=['import', shows_path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Resuming', result.output)
+        self.assertIn('Imported 1 shows', result.output)
+        self.assertEqual(Show.query.count(), 1)
+
+        result = runner.invoke(args=['import', shows_path, '--restart'])
+        self.assertIn('Imported 2 shows, skipped 1 invalid rows', result.output)
+        self.assertIn('venue 90000000 does not exist', result.output)
+
+        # repeat_weeks books one show per week; a bad reference skips the whole row
+        residency_path = os.path.join(tmp_dir, 'shows.csv')
+        with open(residency_path, 'w') as residency_file:
+            residency_file.write('artist_id,venue_id,start_time,repeat_weeks\n')
+            residency_file.write('{},{},2035-03-01 20:00:00,4\n'.format(artist.id, venue_id))
+            residency_file.write('{},90000000,2035-03-02 20:00:00,3\n'.format(artist.id))
+            residency_file.write('{},{},2035-03-03 20:00:00,60\n'.format(artist.id, venue_id))
+        result = runner.invoke(args=['import', residency_path])
+        self.assertIn('Imported 4 shows, skipped 2 invalid rows', result.output)
+        self.assertEqual(result.output.count('venue 90000000 does not exist'), 1)
+        self.assertEqual(Show.query.filter(Show.start_time >= datetime(2035, 3, 1)).count(), 4)
+        self.assertEqual(show_count_drift(), [])
+
+    def test_import_keeps_extra_columns_and_reports_bad_lines(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        artists_path = os.path.join(tmp_dir, 'artists.jsonl')
+        artist = {'name': 'Seeker', 'city': 'Austin', 'state': 'TX', 'genres': ['Jazz'],
+                  'facebook_link': 'https://www.facebook.com/seeker',
+                  'website': 'https://seeker.example.com', 'seeking_venue': True,
+                  'seeking_description': 'Looking for a residency'}
+        with open(artists_path, 'w') as artists_file:
+            artists_file.write(json.dumps(artist) + '\n')
+            artists_file.write('{"name": "Broken", \n')
+            artists_file.write(json.dumps(dict(artist, name='Nick', nickname='N')) + '\n')
+            artists_file.write(json.dumps(dict(artist, name='Maybe', seeking_venue='perhaps')) + '\n')
+
+        result = app.test_cli_runner().invoke(args=['import', artists_path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Imported 1 artists, skipped 3 invalid rows', result.output)
+        self.assertIn('Line 2: {\'line\': [\'invalid JSON', result.output)
+        self.assertIn("'nickname': ['unknown column']", result.output)
+        self.assertIn("not a boolean: 'perhaps'", result.output)
+        imported = Artist.query.one()
+        self.assertEqual((imported.website, imported.seeking_venue, imported.seeking_description),
+                         ('https://seeker.example.com', True, 'Looking for a residency'))
+
+    def test_read_only_views_use_replica(self):
+        replica = self.use_replica()
+        replica.execute(Artist.__table__.insert(), name='Replica Artist',
+                        city='Austin', state='TX', genres=['Jazz'])
+
+        res = self.client().get('/artists')
+        self.assertIn('Replica Artist', res.get_data(as_text=True))
+
+        res = self.client().post('/artists/create', data={
+            'name': 'Primary Artist', 'city': 'Austin', 'state': 'TX',
+            'genres': 'Jazz', 'facebook_link': 'https://www.facebook.com/primary'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(Artist.query.filter_by(name='Primary Artist').count(), 1)
+        self.assertEqual(replica.execute(Artist.__table__.count()).scalar(), 1)
+
+    def test_venue_cache_follows_replica_catching_up(self):
+        replica = self.use_replica()
+        venue = Venue(name='Old Venue', city='Austin', state='TX', genres=['Jazz'])
+        db.session.add(venue)
+        db.session.commit()
+        venue_id = venue.id
+        db.session.remove()
+        # The replica has not caught up with the rename yet
+        replica.execute(Venue.__table__.insert(), id=venue_id, name='Old Venue',
+                        city='Austin', state='TX', genres=['Jazz'])
+        self.assertIn('Old Venue', self.client().get(
+            '/venues/{}'.format(venue_id)).get_data(as_text=True))
+
+        replica.execute(Venue.__table__.update().values(name='Renamed Venue', version=2))
+        self.assertIn('Renamed Venue', self.client().get(
+            '/venues/{}'.format(venue_id)).get_data(as_text=True))
+
+    def test_venue_cache_sees_writes_from_other_processes(self):
+        self.seed_venues(1, shows_per_venue=2)
+        venue_id = Venue.query.first().id
+        db.session.remove()
+        self.assertIn('Venue 0', self.client().get(
+            '/venues/{}'.format(venue_id)).get_data(as_text=True))
+
+        # Another worker's commit never reaches this process' invalidation
+        with db.engine.begin() as connection:
+            connection.execute(Venue.__table__.update().values(
+                name='Renamed Elsewhere', version=Venue.__table__.c.version + 1))
+        body = self.client().get('/venues/{}'.format(venue_id)).get_data(as_text=True)
+        self.assertIn('Renamed Elsewhere', body)
+
+    def test_venue_show_counts_leave_out_deleted_artists(self):
+        self.seed_venues(1)
+        venue = Venue.query.first()
+        venue_id = venue.id
+        gone = Artist(name='Gone Artist', city='Austin', state='TX', genres=['Jazz'])
+        db.session.add(Show(venues=venue, artists=gone,
+                            start_time=datetime.utcnow() + timedelta(days=2)))
+        db.session.commit()
+        gone.deleted_at = datetime.now()
+        db.session.commit()
+        db.session.remove()
+
+        data = self.client().get('/api/v1/venues/{}'.format(venue_id)).get_json()
+        self.assertEqual(len(data['upcoming_shows']), 1)
+        self.assertEqual(data['upcoming_shows_count'], 1)
+        self.assertEqual(data['past_shows_count'], len(data['past_shows']))
+
+    def test_metrics_endpoint_reports_route_histograms(self):
+        self.seed_venues(2)
+        self.client().get('/venues')
+        self.client().get('/venues')
+
+        res = self.client().get('/metrics')
+        body = res.get_data(as_text=True)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('fyyur_request_duration_seconds_count{endpoint="venues"}', body)
+        self.assertIn('fyyur_request_sql_statements_bucket{endpoint="venues",le="+Inf"}', body)
+        self.assertIn('fyyur_request_sql_duration_seconds_sum{endpoint="venues"}', body)
+
+    def test_metrics_overhead_compares_enabled_and_disabled(self):
+        self.seed_venues(2)
+
+        def venues_count():
+            body = self.client().get('/metrics').get_data(as_text=True)
+            line = [line for line in body.splitlines()
+                    if line.startswith('fyyur_request_duration_seconds_count{endpoint="venues"}')]
+            return int(line[0].split()[-1]) if line else 0
+
+        before = venues_count()
+        report = metrics_overhead(app, metrics, '/venues', requests=5)
+        self.assertTrue(metrics.enabled)
+        self.assertEqual(set(report), {'commit', 'path', 'requests', 'off_p50_ms',
+                                       'on_p50_ms', 'overhead_percent'})
+        # Warm-up and enabled requests, timed or not, are recorded; disabled
+        # ones are not
+        self.assertEqual(venues_count() - before, 5 + 2 * 5)
+
+    def test_disabled_metrics_remove_hooks_and_listeners(self):
+        metrics.enabled = False
+        self.addCleanup(setattr, metrics, 'enabled', True)
+        self.assertFalse(event.contains(Engine, 'before_cursor_execute', metrics.before_cursor_execute))
+        self.assertNotIn(metrics.start_request, app.before_request_funcs[None])
+        self.assertEqual(self.client().get('/artists').status_code, 200)
+
+        metrics.enabled = True
+        self.assertTrue(event.contains(Engine, 'after_cursor_execute', metrics.after_cursor_execute))
+        self.assertEqual(app.before_request_funcs[None].count(metrics.start_request), 1)
+
+    def test_failed_statement_leaves_no_query_timer(self):
+        with app.app_context():
+            with db.engine.connect() as connection:
+                with self.assertRaises(Exception):
+                    connection.execute('SELECT * FROM "NoSuchTable"')
+                self.assertEqual(connection.info.get('query_start'), [])
+
+    def test_slow_request_log_includes_statements(self):
+        app.config['METRICS_SLOW_REQUEST_SECONDS'] = 0.000001
+        self.addCleanup(app.config.__setitem__, 'METRICS_SLOW_REQUEST_SECONDS', None)
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            self.client().get('/artists')
+        self.assertIn('Slow request GET /artists', logs.output[0])
+        self.assertIn('FROM "Artist"', logs.output[0])
+
+    def test_shows_filtered_by_time_window_and_place(self):
+        austin = Venue(name='Austin Hall', city='Austin', state='TX', genres=['Jazz'])
+        dallas = Venue(name='Dallas Hall', city='Dallas', state='TX', genres=['Jazz'])
+        artist = Artist(name='Touring Artist', city='Austin', state='TX', genres=['Jazz'])
+        db.session.add_all([austin, dallas, artist])
+        for day in range(1, 11):
+            for venue in (austin, dallas):
+                db.session.add(Show(venues=venue, artists=artist,
+                                    start_time=datetime(2030, 5, day, 20)))
+        db.session.commit()
+
+        res = self.client().get('/api/v1/shows?from=2030-05-03&to=2030-05-06&city=Austin&state=TX&limit=2')
+        data = res.get_json()
+        self.assertEqual([show['start_time'] for show in data['shows']],
+                         ['2030-05-03T20:00:00', '2030-05-04T20:00:00'])
+        self.assertEqual({show['venue_name'] for show in data['shows']}, {'Austin Hall'})
+
+        res = self.client().get('/shows?from=2030-05-03&to=2030-05-06&city=Austin&state=TX&limit=2')
+        body = res.get_data(as_text=True)
+        self.assertEqual(body.count('Austin Hall'), 2)
+        self.assertIn('after={}'.format(data['next']), body)
+        self.assertIn('city=Austin', body)
+        self.assertNotIn('Dallas Hall', body)
+
+        res = self.client().get('/api/v1/shows?from=2030-05-03&to=2030-05-06&city=Austin&state=TX&after={}'.format(data['next']))
+        self.assertEqual([show['start_time'] for show in res.get_json()['shows']],
+                         ['2030-05-05T20:00:00'])
+
+    def test_400_shows_bad_time_window(self):
+        res = self.client().get('/shows?from=not-a-date')
+        self.assertEqual(res.status_code, 400)
+
+    def test_seed_command_is_deterministic(self):
+        data = SyntheticData(seed=7)
+        self.assertEqual(list(data.venues(5)), list(SyntheticData(seed=7).venues(5)))
+        self.assertNotEqual(list(data.venues(5)), list(SyntheticData(seed=8).venues(5)))
+
+        result = app.test_cli_runner().invoke(args=[
+            'seed', '--venues', '6', '--artists', '4', '--shows', '40', '--chunk-size', '15'])
+        self.assertIn('Seeded 6 venues, 4 artists and 40 shows', result.output)
+        self.assertEqual((Venue.query.count(), Artist.query.count(), Show.query.count()),
+                         (6, 4, 40))
+        self.assertEqual(show_count_drift(), [])
+
+    def test_load_test_summary_percentiles(self):
+        samples = {'GET /venues': [(ms / 1000.0, 200) for ms in range(1, 101)] + [(0.5, 500)]}
+        report = summarize(samples, elapsed=10.0)['GET /venues']
+        self.assertEqual(report['requests'], 101)
+        self.assertEqual(report['errors'], 1)
+        self.assertEqual(report['throughput'], 10.1)
+        self.assertEqual((report['p50_ms'], report['p95_ms'], report['p99_ms']),
+                         (51.0, 96.0, 100.0))
+
+    def test_load_test_writes_are_accepted(self):
+        self.seed_venues(1)
+        venue_id, artist_id = Venue.query.first().id, Artist.query.first().id
+        db.session.remove()
+        rng = random.Random(0)
+        for label, make in build_write_routes([venue_id], [artist_id]):
+            method, path, body, headers = make(rng)
+            res = self.client().open(path, method=method, data=body, headers=headers)
+            self.assertIn(res.status_code, (200, 201), label)
+        self.assertEqual(Venue.query.filter(Venue.name.like('Load Test Venue %')).count(), 1)
+        self.assertEqual(Artist.query.filter(Artist.name.like('Load Test Artist %')).count(), 1)
+        self.assertEqual(Show.query.count(), 2)
+
+    def test_benchmark_pagination_reaches_deep_page(self):
+        self.seed_venues(120)
+        results = benchmark.pagination(app, repeat=1, depth=3)
+        venues = results['/venues']
+        self.assertEqual((venues['rows'], venues['deep_page_number']), (120, 3))
+        self.assertIn('p95_ms', venues['deep_page'])
+        self.assertIn('p50_ms', venues['deep_page_offset_query_baseline'])
+        self.assertIsNotNone(venues['full_load_baseline_ms'])
+
+    def test_benchmark_artist_detail_removes_its_shows(self):
+        self.seed_venues(2)
+        shows = Show.query.count()
+        results = benchmark.artist_detail(app, repeat=1, shows=45, baseline_repeat=1)
+        self.assertIn('p95_ms', results['last_past_page_request'])
+        self.assertIn('p50_ms', results['old_view_baseline'])
+        self.assertEqual(Show.query.count(), shows)
+        self.assertIsNone(Artist.query.filter_by(name='Benchmark Artist').first())
+
+    def test_benchmark_datetime_formats_show_times(self):
+        self.seed_venues(3)
+        results = benchmark.datetime_filter(app, repeat=1, passes=1)
+        self.assertEqual(results['rows'], 3)
+        self.assertIn('p95_ms', results['batch'])
+        self.assertIn('p50_ms', results['old_filter_baseline'])
+        self.assertEqual(benchmark.old_format_datetime('2035-04-01 20:00:00', 'full'),
+                         format_datetime(datetime(2035, 4, 1, 20), 'full'))
+
+    def test_benchmark_etag_answers_304(self):
+        self.seed_venues(3)
+        results = benchmark.etag(app, repeat=1)
+        self.assertEqual(len(results), 4)
+        for result in results.values():
+            self.assertGreater(result['bytes_200'], 0)
+            self.assertEqual(result['bytes_304'], 0)
+            self.assertIn('p95_ms', result['request_304'])
+
+    def test_benchmark_search_times_each_term(self):
+        self.seed_venues(3)
+        results = benchmark.search(app, repeat=1, baseline_repeat=1)
+        self.assertEqual(results['Venue']['rows'], 3)
+        blue = results['Venue']['terms']['blue']
+        self.assertEqual(blue['matches'], 0)
+        self.assertIn('p95_ms', blue['search'])
+        self.assertIn('p50_ms', blue['ilike_baseline'])
+
+    def test_benchmark_show_search_counts_matches(self):
+        self.seed_venues(3)
+        results = benchmark.show_search(app, repeat=1)
+        self.assertEqual(results['shows'], 3)
+        for name in ('window', 'busiest_place', 'quietest_place'):
+            self.assertIn('p95_ms', results[name]['page_1'])
+            self.assertLessEqual(results[name]['matches'], 3)
+
+    def test_request_id_echoed(self):
+        res = self.client().get('/', headers={'X-Request-ID': 'abc123'})
+        self.assertEqual(res.headers['X-Request-ID'], 'abc123')
+        self.assertTrue(self.client().get('/').headers['X-Request-ID'])
+
+    def test_queued_json_log_rotates_by_size(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        log_app = Flask('log_test')
+        log_app.config.update(LOG_FILE=os.path.join(directory, 'error.log'),
+                              LOG_MAX_BYTES=600, LOG_BACKUP_COUNT=0)
+        request_logging = RequestLogging(log_app)
+        self.addCleanup(log_app.logger.removeHandler, request_logging.handler)
+
+        @log_app.route('/fail')
+        def fail():
+            try:
+                1 / 0
+            except ZeroDivisionError:
+                log_app.logger.exception('Could not divide %s', 'things')
+            return ''
+
+        for i in range(4):
+            log_app.test_client().get('/fail', headers={'X-Request-ID': 'req-{}'.format(i)})
+        request_logging.stop()
+
+        files = sorted(os.listdir(directory))
+        self.assertGreater(len(files), 1)
+        records = []
+        for name in files:
+            with open(os.path.join(directory, name)) as log_file:
+                records.extend(json.loads(line) for line in log_file)
+        self.assertEqual(sorted(record['request_id'] for record in records),
+                         ['req-0', 'req-1', 'req-2', 'req-3'])
+        self.assertEqual(records[0]['route'], 'fail')
+        self.assertEqual(records[0]['message'], 'Could not divide things')
+        self.assertIn('ZeroDivisionError', records[0]['exception'])
+
+    def test_404_pagination_cursor_not_found(self):
+        res = self.client().get('/shows?after=90000000')
+        self.assertEqual(res.status_code, 404)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,249 @@
+'''
+Benchmarks
+    time the trivia API in process against a scratch database and print
+    JSON tagged with the current git commit. Each scenario also runs the
+    code path it replaced, so one run reports before and after. Restore
+    trivia.psql into the scratch database, grow it with seed, then run a
+    scenario:
+
+    $ python benchmark.py seed --questions 1000000
+    $ python benchmark.py pagination
+'''
+import argparse
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+
+from flaskr import create_app, count_questions, paginate_questions, QUESTIONS_PER_PAGE
+from models import setup_db, db, Question, Category
+
+SEED_CHUNK = 10000
+
+
+def database_path(name):
+    return "postgres://{}:{}@{}/{}".format(os.environ.get("PSQL_USER"),
+                                           os.environ.get("PSQL_PWD"), 'localhost:5432', name)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values, fraction):
+    #Nearest-rank percentile of an already sorted list
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+def summarize(seconds):
+    seconds = sorted(seconds)
+    return {
+        'p50_ms': milliseconds(percentile(seconds, 0.50)),
+        'p95_ms': milliseconds(percentile(seconds, 0.95)),
+    }
+
+
+def measure(call, repeat):
+    #Wall time of call(), p50/p95 over repeat runs after a warm-up
+    call()
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def peak_memory(call):
+    #Most Python memory held at once while call() runs, in KiB
+    tracemalloc.start()
+    try:
+        call()
+        return round(tracemalloc.get_traced_memory()[1] / 1024.0, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def post(client, path, body=None):
+    #A POST that must succeed; returns the JSON body
+    response = client.post(path, json=body)
+    if response.status_code not in (200, 201):
+        raise SystemExit('{} answered {}'.format(path, response.status_code))
+    return response.get_json()
+
+
+def get(client, path):
+    #A GET that must succeed; returns the response
+    response = client.get(path)
+    if response.status_code != 200:
+        raise SystemExit('{} answered {}'.format(path, response.status_code))
+    return response
+
+
+def seed(app, repeat, questions=1000000):
+    #Adds synthetic questions, spread over the categories, until there are
+    #`questions` in all
+    with app.app_context():
+        categories = [category.id for category in Category.query.order_by(Category.id)]
+        if not categories:
+            raise SystemExit('Restore trivia.psql into the database first')
+        count = Question.query.count()
+        start = time.perf_counter()
+        for first in range(count, questions, SEED_CHUNK):
+            db.session.execute(Question.__table__.insert(), [{
+                'question': 'Synthetic question {}?'.format(number),
+                'answer': 'Answer {}'.format(number),
+                'category': str(categories[number % len(categories)]),
+                'difficulty': number % 5 + 1,
+            } for number in range(first, min(first + SEED_CHUNK, questions))])
+            db.session.commit()
+        db.session.execute('ANALYZE questions')
+        db.session.commit()
+        return {'questions': max(count, questions), 'added': max(0, questions - count),
+                'seconds': round(time.perf_counter() - start, 1)}
+
+
+def old_paginate_questions(request, selection):
+    #The pagination before LIMIT/OFFSET: every row loaded and formatted,
+    #then the page sliced out
+    page = request.args.get('page', 1, type=int)
+    start = (page - 1) * QUESTIONS_PER_PAGE
+    questions = [question.format() for question in selection.all()]
+    return questions[start:start + QUESTIONS_PER_PAGE]
+
+
+def pagination(app, repeat, baseline_max_rows=1000000):
+    #GET /questions for the first, middle and last page: latency, and the
+    #peak Python memory of one request. The first page's query and the total
+    #count are also timed alone. The old paginate_questions is timed
+    #once per table size, as it does not depend on the page; it is skipped
+    #above baseline_max_rows.
+    client = app.test_client()
+    with app.app_context():
+        rows = Question.query.count()
+    last = max(1, (rows - 1) // QUESTIONS_PER_PAGE + 1)
+    results = {'rows': rows}
+    for name, page in (('first_page', 1), ('middle_page', last // 2 + 1), ('last_page', last)):
+        path = '/questions?page={}'.format(page)
+        results[name] = dict(measure(lambda: get(client, path), repeat), page=page,
+                             peak_kib=peak_memory(lambda: get(client, path)))
+    if rows <= baseline_max_rows:
+        with app.test_request_context('/questions?page=1'):
+            from flask import request
+            selection = Question.query.order_by(Question.id)
+            paginate_questions(request, selection)
+            results['page_query'] = dict(
+                measure(lambda: paginate_questions(request, selection), repeat),
+                peak_kib=peak_memory(lambda: paginate_questions(request, selection)))
+            results['count_query'] = measure(lambda: count_questions(selection), repeat)
+            start = time.perf_counter()
+            old_paginate_questions(request, selection)
+            results['old_paginate_baseline'] = {
+                'ms': milliseconds(time.perf_counter() - start)}
+            db.session.remove()
+            results['old_paginate_baseline']['peak_kib'] = peak_memory(
+                lambda: old_paginate_questions(request, selection))
+            db.session.remove()
+    else:
+        results['old_paginate_baseline'] = None
+    return results
+
+
+def quiz(app, repeat, steps=500, quizzes=3):
+    #`quizzes` quizzes of `steps` questions over all categories, through the
+    #old protocol that sends previous_questions on every step and through a
+    #session. Reports each step's request body size and latency, for the
+    #first and the last 50 steps and all of them.
+    client = app.test_client()
+    with app.app_context():
+        if Question.query.count() < steps:
+            raise SystemExit('quiz needs at least {} questions; run seed'.format(steps))
+    category = {'type': 'ALL', 'id': 0}
+    #Warm-up: the first draw loads the question ids
+    post(client, '/quizzes', {'previous_questions': [], 'quiz_category': category})
+    old = {'body_bytes': [], 'seconds': []}
+    sessions = {'body_bytes': [], 'seconds': []}
+    for _ in range(quizzes):
+        previous = []
+        for step in range(steps):
+            body = {'previous_questions': previous, 'quiz_category': category}
+            start = time.perf_counter()
+            question = post(client, '/quizzes', body)['question']
+            old['seconds'].append((step, time.perf_counter() - start))
+            old['body_bytes'].append(len(json.dumps(body)))
+            previous.append(question['id'])
+
+        session_id = post(client, '/quizzes', {'quiz_category': category})['session_id']
+        path = '/quizzes/{}/next'.format(session_id)
+        for step in range(steps):
+            start = time.perf_counter()
+            post(client, path)
+            sessions['seconds'].append((step, time.perf_counter() - start))
+            sessions['body_bytes'].append(0)
+
+    def report(samples):
+        seconds = samples['seconds']
+        return {
+            'first_step_body_bytes': samples['body_bytes'][0],
+            'last_step_body_bytes': samples['body_bytes'][steps - 1],
+            'quiz_body_bytes': sum(samples['body_bytes'][:steps]),
+            'first_50_steps': summarize([s for step, s in seconds if step < 50]),
+            'last_50_steps': summarize([s for step, s in seconds if step >= steps - 50]),
+            'all_steps': summarize([s for step, s in seconds]),
+        }
+    return {
+        'steps': steps,
+        'quizzes': quizzes,
+        'session': dict(report(sessions), path_bytes=len(path),
+                        start_body_bytes=len(json.dumps({'quiz_category': category}))),
+        'previous_questions_baseline': report(old),
+    }
+
+
+SCENARIOS = {
+    'pagination': pagination,
+    'quiz': quiz,
+    'seed': seed,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the trivia API in process.')
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--database', default='trivia_bench',
+                        help='Scratch database, restored from trivia.psql.')
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='Timed runs per measurement, after one warm-up.')
+    parser.add_argument('--questions', type=int, default=1000000,
+                        help='Number of questions seed grows the database to.')
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    args = parser.parse_args()
+
+    app = create_app()
+    setup_db(app, database_path(args.database))
+    options = {'questions': args.questions} if args.scenario == 'seed' else {}
+    report = {
+        'commit': git_commit(),
+        'scenario': args.scenario,
+        'repeat': args.repeat,
+        'results': SCENARIOS[args.scenario](app, args.repeat, **options),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
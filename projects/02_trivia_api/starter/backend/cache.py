@@ -0,0 +1,92 @@
+import hashlib
+import json
+import threading
+import weakref
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import Category
+
+'''
+CategoryCache
+    keeps the {id: type} category map in process, with an ETag for it.
+    Category writes bump a version once their transaction commits; the next
+    read reloads. With a shared store (anything with Redis' get/set/incr)
+    the version and the map are shared between processes.
+'''
+caches = weakref.WeakSet()
+
+
+class CategoryCache(object):
+
+  def __init__(self, store=None, key='trivia:categories'):
+    self.store = store
+    self.key = key
+    self.version = 0
+    self.loaded = None
+    self.lock = threading.Lock()
+    caches.add(self)
+
+  def current_version(self):
+    if self.store is None:
+      return self.version
+    return int(self.store.get(self.key + ':version') or 0)
+
+  def get(self):
+    # Returns (categories, etag)
+    version = self.current_version()
+    loaded = self.loaded
+    if loaded is not None and loaded['version'] == version:
+      return loaded['categories'], loaded['etag']
+
+    loaded = None
+    if self.store is not None:
+      shared = self.store.get(self.key)
+      if shared is not None:
+        shared = json.loads(shared)
+        if shared['version'] == version:
+          loaded = {
+            'version': version,
+            'categories': {int(id): type for id, type in shared['categories'].items()},
+            'etag': shared['etag']
+          }
+    if loaded is None:
+      categories = {category.id: category.type
+                    for category in Category.query.order_by(Category.id).all()}
+      etag = hashlib.sha1(json.dumps(sorted(categories.items())).encode('utf-8')).hexdigest()
+      loaded = {'version': version, 'categories': categories, 'etag': etag}
+      if self.store is not None:
+        self.store.set(self.key, json.dumps(loaded))
+    with self.lock:
+      self.loaded = loaded
+    return loaded['categories'], loaded['etag']
+
+  def invalidate(self):
+    with self.lock:
+      self.version += 1
+      self.loaded = None
+    if self.store is not None:
+      self.store.incr(self.key + ':version')
+
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def mark_categories_changed(mapper, connection, category):
+  # Only remembered here; the caches drop their copy once the commit lands
+  session = object_session(category)
+  if session is not None:
+    session.info['categories_changed'] = True
+
+
+# On Session itself so writes through any session (scripts, tests) count
+@event.listens_for(Session, 'after_commit')
+def invalidate_categories(session):
+  if session.info.pop('categories_changed', False):
+    for cache in list(caches):
+      cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_category_changes(session):
+  session.info.pop('categories_changed', None)
@@ -4,30 +4,58 @@ from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from sqlalchemy.sql import func
-import random
 
-from models import setup_db, Question, Category
+from models import setup_db, Question
+from cache import CategoryCache
+from quiz import QuestionPool, QuizSessions
+from search import NgramIndex, search_questions
 
 QUESTIONS_PER_PAGE = 10
 
-#Function to paginate questions and return them in JSON format
+#Function to paginate questions and return them in JSON format.
+#selection is an ordered query: only the requested page is fetched (LIMIT/OFFSET)
+#and formatted, so the cost does not grow with the table
 def paginate_questions(request, selection):
-    page = request.args.get('page', 1, type=int)
+    page = max(1, request.args.get('page', 1, type=int))
     start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
 
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
+    current_questions = selection.limit(QUESTIONS_PER_PAGE).offset(start).all()
 
-    return current_questions
+    return [question.format() for question in current_questions]
+
+#Helper function to count the rows of a question query without loading them
+def count_questions(selection):
+    return selection.order_by(None).with_entities(func.count(Question.id)).scalar()
 #Helper function to format categories
 def format_categories(categories):    
     return {category.id:category.type for category in categories}
 
+#Shared store for multi-process deployments: anything with Redis' commands,
+#from test_config (<NAME>_STORE) or a <NAME>_REDIS_URL in config or env
+def shared_store(app, name):
+    if app.config.get(name + '_STORE') is not None:
+        return app.config[name + '_STORE']
+    redis_url = app.config.get(name + '_REDIS_URL') or os.environ.get(name + '_REDIS_URL')
+    if redis_url:
+        import redis
+        return redis.Redis.from_url(redis_url)
+    return None
+
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
     setup_db(app)
+    # Category map, reloaded only after a Category write commits
+    category_cache = CategoryCache(shared_store(app, 'CATEGORY_CACHE'))
+    # Question ids per category, for drawing quiz questions
+    question_pool = QuestionPool(store=shared_store(app, 'QUESTION_POOL'))
+    # Question search index for databases without full text search
+    ngram_index = NgramIndex()
+    # Seen questions of each quiz, kept server side
+    quiz_sessions = QuizSessions(question_pool, shared_store(app, 'QUIZ_SESSION'),
+                                 ttl=app.config.get('QUIZ_SESSION_TTL', 1800))
     # DONE: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
     cors = CORS(app)
 
@@ -51,18 +79,22 @@ def create_app(test_config=None):
     @app.route('/categories', methods=['GET'])
     def show_categories():
 
-        selection = Category.query.order_by(Category.id).all()
         # we need the formatted json
-        categories = format_categories(selection)
+        categories, etag = category_cache.get()
         #If no categories, we return 404
         if len(categories) == 0:
             abort(404)
-
-        return jsonify({
-            'success': True,
-            'categories': categories,
-            'total_categories': len(categories)
-        })
+        #Clients holding the current ETag get an empty 304
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = jsonify({
+                'success': True,
+                'categories': categories,
+                'total_categories': len(categories)
+            })
+        response.set_etag(etag)
+        return response
 
     '''
     DONE: Create an endpoint to handle GET requests for questions, 
@@ -77,16 +109,16 @@ def create_app(test_config=None):
     '''
     @app.route('/questions', methods=['GET'])
     def get_questions():
-        selection = Question.query.order_by(Question.id).all()
+        selection = Question.query.order_by(Question.id)
         paginated_questions = paginate_questions(request, selection)
         # current_category=request.args['category']
-        categories = format_categories(Category.query.order_by(Category.id).all())
+        categories, etag = category_cache.get()
         if len(paginated_questions) == 0 or len(categories) == 0:
             abort(404)
         else:
              return jsonify({
                 'questions': paginated_questions,
-                'total_questions': len(selection),
+                'total_questions': count_questions(selection),
                 'categories': categories,
                 'current_category': 'ALL',
                 'success': True
@@ -109,20 +141,42 @@ def create_app(test_config=None):
 
             question.delete()
 
-            selection = Question.query.order_by(Question.id).all()
+            selection = Question.query.order_by(Question.id)
             current_questions = paginate_questions(request, selection)
 
             return jsonify({
                 'success': True,
                 'deleted': question_id,
                 'questions': current_questions,
-                'total_questions': len(selection)
+                'total_questions': count_questions(selection)
             })
 
         except:
             print(sys.exc_info())
             abort(422)
 
+    #Ranked search over question and answer text: the page and the total
+    #come from a single query
+    def find_questions(search):
+        page = max(1, request.args.get('page', 1, type=int))
+        questions, total = search_questions(search, QUESTIONS_PER_PAGE,
+                                            (page - 1) * QUESTIONS_PER_PAGE, ngram_index)
+        return jsonify({
+            'success': True,
+            'questions': [question.format() for question in questions],
+            'total_questions': total
+        })
+
+    @app.route('/questions/search', methods=['GET', 'POST'])
+    def search_question():
+        if request.method == 'POST':
+            search = (request.get_json(silent=True) or {}).get('searchTerm')
+        else:
+            search = request.args.get('searchTerm')
+        if not search:
+            abort(400)
+        return find_questions(search)
+
     '''
     DONE: Create an endpoint to POST a new question, 
     which will require the question and answer text, 
@@ -142,19 +196,11 @@ def create_app(test_config=None):
         search = body.get('searchTerm')
 
         if search:
-            selection = Question.query.order_by(Question.id).filter(
-                Question.question.ilike('%{}%'.format(search)))
-            current_questions = paginate_questions(request, selection)
-
-            return jsonify({
-                'success': True,
-                'questions': current_questions,
-                'total_questions': len(selection.all())
-            })
+            return find_questions(search)
         else:
             question = Question(question=question_text, answer=answer,
                                 difficulty=difficulty, category=category)
-            selection = Question.query.order_by(Question.id).all()
+            selection = Question.query.order_by(Question.id)
             paginated_questions = paginate_questions(request, selection)
             try:
                 question.insert()
@@ -166,7 +212,7 @@ def create_app(test_config=None):
                 'success': True,
                 'created': question.format(),
                 'questions': paginated_questions,
-                'total_questions': len(selection)
+                'total_questions': count_questions(selection)
 
             })
 
@@ -190,24 +236,22 @@ def create_app(test_config=None):
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
     def get_questions_by_category(category_id):
         
-        category = Category.query.filter(Category.id==category_id).one_or_none()
-        if category == None:
+        categories, etag = category_cache.get()
+        if category_id not in categories:
               abort(404)
         
-        selection = Question.query.filter(Question.category==category_id).order_by(Question.id).all()
+        selection = Question.query.filter(Question.category==category_id).order_by(Question.id)
         paginated_questions = paginate_questions(request, selection)
                      
         if len(paginated_questions) == 0:
             abort(404)  
         
-        categories =format_categories(Category.query.order_by(Category.id).all())
-        
         return jsonify({
             'success': True,
             'questions': paginated_questions,
-            'total_questions': len(paginated_questions),
+            'total_questions': count_questions(selection),
             'categories': categories,
-            'current_category': category.type
+            'current_category': categories[category_id]
         })
     
     
@@ -227,11 +271,23 @@ def create_app(test_config=None):
         body = request.get_json()
         previous_questions = body.get('previous_questions')
         quiz_category = body.get('quiz_category')
-        #If the category is ALL, we need other query
-        if quiz_category['id'] == 0:
-            question = Question.query.filter(Question.id.notin_(previous_questions)).order_by(func.random()).first()
-        else:
-            question = Question.query.filter(Question.id.notin_(previous_questions), Question.category == quiz_category['id']).order_by(func.random()).first()
+        try:
+            category = int(quiz_category['id'])
+            previous_questions = [int(question_id) for question_id in previous_questions or []]
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+
+        #Without previous_questions a quiz session is started instead
+        if 'previous_questions' not in body:
+            if category != 0 and category not in category_cache.get()[0]:
+                abort(404)
+            return jsonify({
+                'success': True,
+                'session_id': quiz_sessions.start(category),
+            }), 201
+
+        #Category 0 is ALL; the pool draws the question id, then only that row is loaded
+        question = question_pool.next_question(category, previous_questions)
 
         if question == None:
           abort(404)
@@ -240,6 +296,22 @@ def create_app(test_config=None):
             'success': True,
             'question': question.format(),
         })     
+
+    @app.route('/quizzes/<session_id>/next', methods=['POST'])
+    def get_next_question(session_id):
+
+        result = quiz_sessions.next_question(session_id)
+        #Unknown or expired session
+        if result is None:
+            abort(404)
+        question, asked = result
+
+        #question is None once the category has no questions left
+        return jsonify({
+            'success': True,
+            'question': question.format() if question is not None else None,
+            'total_asked': asked,
+        })
     
     
     '''DONE: Create error handlers for all expected errors 
@@ -10,6 +10,12 @@ database_path = "postgres://{}:{}@{}/{}".format(database_user, database_password
 
 db = SQLAlchemy()
 
+question_search_index = '''
+CREATE INDEX IF NOT EXISTS ix_questions_search ON questions USING gin ((
+  setweight(to_tsvector('simple', coalesce(question, '')), 'A') ||
+  setweight(to_tsvector('simple', coalesce(answer, '')), 'B')))
+'''
+
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
@@ -20,6 +26,9 @@ def setup_db(app, database_path=database_path):
     db.app = app
     db.init_app(app)
     db.create_all()
+    # Full text index for question search, see search.search_vector()
+    if db.engine.dialect.name == 'postgresql':
+        db.engine.execute(question_search_index)
 
 '''
 Question
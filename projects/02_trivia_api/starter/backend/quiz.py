@@ -0,0 +1,280 @@
+import json
+import random
+import secrets
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Question
+
+'''
+QuestionPool
+    keeps the question ids of every category in arrays, so a quiz step
+    draws its next question without scanning or sorting the table. The
+    arrays are loaded on the first draw and kept current by Question inserts
+    and deletes once their transaction commits. Other processes' writes
+    never reach these events: with a shared store (anything with Redis'
+    get/incr) every commit bumps a version there, and a pool that loaded an
+    older version reloads on its next draw. Rows deleted behind a pool's
+    back are also skipped when they are drawn.
+'''
+ALL_CATEGORIES = '0'
+pools = weakref.WeakSet()
+
+
+class QuestionPool(object):
+
+  def __init__(self, rng=None, store=None, key='trivia:questions'):
+    self.rng = rng or random.SystemRandom()
+    self.store = store
+    self.key = key
+    # category -> [question id], and question id -> slot in that list
+    self.ids = None
+    self.slots = None
+    # Shared version the arrays were loaded at
+    self.version = None
+    self.lock = threading.Lock()
+    pools.add(self)
+
+  def current_version(self):
+    if self.store is None:
+      return None
+    return int(self.store.get(self.key + ':version') or 0)
+
+  def load(self):
+    # The version is read first: a write committing during the load bumps
+    # it again, and the next draw reloads
+    version = self.current_version()
+    ids = {ALL_CATEGORIES: []}
+    for question_id, category in db.session.query(Question.id, Question.category).order_by(Question.id):
+      ids[ALL_CATEGORIES].append(question_id)
+      ids.setdefault(str(category), []).append(question_id)
+    slots = {category: {question_id: slot for slot, question_id in enumerate(category_ids)}
+             for category, category_ids in ids.items()}
+    with self.lock:
+      self.ids = ids
+      self.slots = slots
+      self.version = version
+
+  def changed(self):
+    # Called once this process has applied its own committed changes: bumps
+    # the shared version, and keeps the arrays when no other process wrote
+    # in between
+    if self.store is None:
+      return
+    version = int(self.store.incr(self.key + ':version'))
+    with self.lock:
+      if self.version == version - 1:
+        self.version = version
+
+  def reset(self):
+    # Reloaded on the next draw
+    with self.lock:
+      self.ids = None
+      self.slots = None
+
+  def add(self, question_id, category):
+    with self.lock:
+      if self.ids is None:
+        return
+      for key in (ALL_CATEGORIES, str(category)):
+        category_ids = self.ids.setdefault(key, [])
+        category_slots = self.slots.setdefault(key, {})
+        if question_id not in category_slots:
+          category_slots[question_id] = len(category_ids)
+          category_ids.append(question_id)
+
+  def remove(self, question_id, category=None):
+    with self.lock:
+      if self.ids is None:
+        return
+      keys = [ALL_CATEGORIES, str(category)] if category is not None else list(self.ids)
+      for key in keys:
+        category_ids = self.ids.get(key, [])
+        category_slots = self.slots.get(key, {})
+        slot = category_slots.pop(question_id, None)
+        if slot is None:
+          continue
+        # Swap the last id into the hole, so removal stays O(1)
+        last = category_ids.pop()
+        if last != question_id:
+          category_ids[slot] = last
+          category_slots[last] = slot
+
+  def draw(self, category, exclude=()):
+    '''
+    Returns a uniformly random question id of the category that is not in
+    exclude, or None when every question has been seen. Works like a
+    Fisher-Yates shuffle that has already dealt the excluded ids: they are
+    swapped to the tail of a virtual copy of the array, and the pick comes
+    from the remaining head. Costs O(len(exclude)), whatever the pool size.
+    '''
+    if self.ids is None or self.current_version() != self.version:
+      self.load()
+    category = str(category)
+    with self.lock:
+      category_ids = self.ids.get(category, [])
+      category_slots = self.slots.get(category, {})
+      swapped = {}
+      moved = {}
+      remaining = len(category_ids)
+      for question_id in set(exclude):
+        slot = moved.get(question_id, category_slots.get(question_id))
+        if slot is None or slot >= remaining:
+          continue
+        remaining -= 1
+        tail = swapped.get(remaining, category_ids[remaining])
+        swapped[slot] = tail
+        moved[tail] = slot
+      if remaining == 0:
+        return None
+      slot = self.rng.randrange(remaining)
+      return swapped.get(slot, category_ids[slot])
+
+  def next_question(self, category, exclude=()):
+    # Fetches the drawn row by primary key. A row deleted behind the pool's
+    # back (e.g. a bulk delete) is dropped and another one is drawn.
+    exclude = set(exclude)
+    while True:
+      question_id = self.draw(category, exclude)
+      if question_id is None:
+        return None
+      question = Question.query.get(question_id)
+      if question is not None:
+        return question
+      self.remove(question_id)
+      exclude.add(question_id)
+
+
+def record_question_change(question, change):
+  session = object_session(question)
+  if session is not None:
+    session.info.setdefault('question_changes', []).append(change)
+
+
+@event.listens_for(Question, 'after_insert')
+def question_inserted(mapper, connection, question):
+  record_question_change(question, ('add', question.id, question.category))
+
+
+@event.listens_for(Question, 'after_delete')
+def question_deleted(mapper, connection, question):
+  record_question_change(question, ('remove', question.id, question.category))
+
+
+@event.listens_for(Question, 'after_update')
+def question_updated(mapper, connection, question):
+  history = inspect(question).attrs.category.history
+  if history.has_changes():
+    for category in history.deleted:
+      record_question_change(question, ('remove', question.id, category))
+    record_question_change(question, ('add', question.id, question.category))
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_question_changes(session):
+  changes = session.info.pop('question_changes', [])
+  if not changes:
+    return
+  for pool in list(pools):
+    for change, question_id, category in changes:
+      getattr(pool, change)(question_id, category)
+    pool.changed()
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_question_changes(session):
+  session.info.pop('question_changes', None)
+
+
+'''
+Quiz sessions
+    remember which questions a quiz has asked, so the client only sends the
+    session id. Seen questions are stored as the list of their ids, so a
+    session's size and each step's cost follow the number of questions
+    asked, not how large the ids are. Sessions expire after ttl seconds
+    without a question being asked. The store is in process unless a shared
+    one (anything with Redis' get/set with ex=) is given.
+'''
+def seen_ids(bits):
+  # Ids of the bits that are set, lowest first. Sessions saved before the
+  # id list stored a hex bitset (bit n is question n); they still load.
+  while bits:
+    low = bits & -bits
+    yield low.bit_length() - 1
+    bits ^= low
+
+
+class MemorySessionStore(object):
+
+  def __init__(self):
+    # Oldest first: every set moves the session to the end with the same ttl
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+
+  def evict(self, now):
+    while self.entries:
+      key, (value, expires_at) = next(iter(self.entries.items()))
+      if expires_at > now:
+        break
+      del self.entries[key]
+
+  def get(self, key):
+    with self.lock:
+      self.evict(time.time())
+      entry = self.entries.get(key)
+      return entry[0] if entry is not None else None
+
+  def set(self, key, value, ex=None):
+    with self.lock:
+      now = time.time()
+      self.entries[key] = (value, now + ex if ex else float('inf'))
+      self.entries.move_to_end(key)
+      self.evict(now)
+
+
+class QuizSessions(object):
+
+  def __init__(self, pool, store=None, ttl=1800, prefix='trivia:quiz:'):
+    self.pool = pool
+    self.store = store if store is not None else MemorySessionStore()
+    self.ttl = ttl
+    self.prefix = prefix
+
+  def load(self, session_id):
+    value = self.store.get(self.prefix + session_id)
+    if value is None:
+      return None
+    if isinstance(value, bytes):
+      value = value.decode('utf-8')
+    session = json.loads(value)
+    if isinstance(session['seen'], str):
+      session['seen'] = list(seen_ids(int(session['seen'], 16)))
+    return session
+
+  def save(self, session_id, session):
+    value = json.dumps({'category': session['category'], 'seen': session['seen']},
+                       separators=(',', ':'))
+    self.store.set(self.prefix + session_id, value, ex=self.ttl)
+
+  def start(self, category):
+    session_id = secrets.token_urlsafe(16)
+    self.save(session_id, {'category': category, 'seen': []})
+    return session_id
+
+  def next_question(self, session_id):
+    '''
+    Returns (question, asked); question is None once every question of the
+    category has been asked. Returns None for an unknown or expired session.
+    '''
+    session = self.load(session_id)
+    if session is None:
+      return None
+    question = self.pool.next_question(session['category'], session['seen'])
+    if question is not None:
+      session['seen'].append(question.id)
+    self.save(session_id, session)
+    return question, len(session['seen'])
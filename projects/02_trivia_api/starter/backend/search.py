@@ -0,0 +1,175 @@
+import re
+import threading
+import weakref
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.sql import func
+
+from models import db, Question
+
+'''
+Question search
+    matches every word of the search term, as a prefix, against the question
+    and the answer text. Question matches rank above answer matches. On
+    Postgres this is a weighted tsvector with a GIN index, and the page and
+    the total come back in one query. Other databases (e.g. SQLite test runs)
+    use an in-process trigram index instead.
+'''
+# No stemming: the words are matched as prefixes, which stems would break
+SEARCH_CONFIG = 'simple'
+indexes = weakref.WeakSet()
+
+
+def search_words(term):
+  return re.findall(r'\w+', (term or '').lower())
+
+
+def search_vector():
+  # Same expression as the ix_questions_search index created by setup_db
+  return func.setweight(func.to_tsvector(SEARCH_CONFIG, func.coalesce(Question.question, '')), 'A').op('||')(
+    func.setweight(func.to_tsvector(SEARCH_CONFIG, func.coalesce(Question.answer, '')), 'B'))
+
+
+def search_postgres(words, limit, offset):
+  vector = search_vector()
+  query = func.to_tsquery(SEARCH_CONFIG, ' & '.join(word + ':*' for word in words))
+  rows = db.session.query(Question, func.count().over()).filter(
+    vector.op('@@')(query)).order_by(
+    func.ts_rank(vector, query).desc(), Question.id).limit(limit).offset(offset).all()
+  if rows:
+    return [question for question, total in rows], rows[0][1]
+  total = 0
+  if offset:
+    # Past the last page: the window count has no row to ride on
+    total = db.session.query(func.count(Question.id)).filter(vector.op('@@')(query)).scalar()
+  return [], total
+
+
+class NgramIndex(object):
+
+  def __init__(self, n=3):
+    self.n = n
+    # n-gram -> ids of the questions containing it, id -> (question words, answer words)
+    self.grams = None
+    self.texts = None
+    self.lock = threading.Lock()
+    indexes.add(self)
+
+  def ngrams(self, text):
+    return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+  def text_ngrams(self, text):
+    # text is (question words, answer words); grams never span two words
+    return {gram for words in text for word in words for gram in self.ngrams(word)}
+
+  def load(self, rows=None):
+    if rows is None:
+      rows = db.session.query(Question.id, Question.question, Question.answer)
+    grams = {}
+    texts = {}
+    for question_id, question, answer in rows:
+      texts[question_id] = (search_words(question), search_words(answer))
+      for gram in self.text_ngrams(texts[question_id]):
+        grams.setdefault(gram, set()).add(question_id)
+    with self.lock:
+      self.grams = grams
+      self.texts = texts
+
+  def add(self, question_id, question, answer):
+    self.remove(question_id)
+    with self.lock:
+      if self.texts is None:
+        return
+      self.texts[question_id] = (search_words(question), search_words(answer))
+      for gram in self.text_ngrams(self.texts[question_id]):
+        self.grams.setdefault(gram, set()).add(question_id)
+
+  def remove(self, question_id, question=None, answer=None):
+    with self.lock:
+      if self.texts is None or question_id not in self.texts:
+        return
+      for gram in self.text_ngrams(self.texts.pop(question_id)):
+        ids = self.grams.get(gram)
+        if ids is not None:
+          ids.discard(question_id)
+          if not ids:
+            del self.grams[gram]
+
+  def search(self, words):
+    # Returns the ids of the questions with a word starting with every search
+    # word, best first; the same prefix match as the Postgres tsquery
+    if self.texts is None:
+      self.load()
+    with self.lock:
+      candidates = None
+      for word in words:
+        for gram in self.ngrams(word):
+          ids = self.grams.get(gram, set())
+          candidates = set(ids) if candidates is None else candidates & ids
+      if candidates is None:
+        # Only words shorter than n: nothing to narrow with
+        candidates = set(self.texts)
+      ranked = []
+      for question_id in candidates:
+        question, answer = self.texts[question_id]
+        score = 0
+        for word in words:
+          if any(text_word.startswith(word) for text_word in question):
+            score += 2
+          elif any(text_word.startswith(word) for text_word in answer):
+            score += 1
+          else:
+            break
+        else:
+          ranked.append((-score, question_id))
+    return [question_id for score, question_id in sorted(ranked)]
+
+
+def search_questions(term, limit, offset, ngram_index):
+  '''
+  Returns (questions, total) for one page of the ranked matches of term.
+  '''
+  words = search_words(term)
+  if not words:
+    return [], 0
+  if db.engine.dialect.name == 'postgresql':
+    return search_postgres(words, limit, offset)
+  ids = ngram_index.search(words)
+  page = ids[offset:offset + limit]
+  questions = {question.id: question for question in Question.query.filter(Question.id.in_(page))} if page else {}
+  return [questions[question_id] for question_id in page if question_id in questions], len(ids)
+
+
+def record_search_change(question, change):
+  session = object_session(question)
+  if session is not None:
+    session.info.setdefault('search_changes', []).append(change)
+
+
+@event.listens_for(Question, 'after_insert')
+def question_inserted(mapper, connection, question):
+  record_search_change(question, ('add', question.id, question.question, question.answer))
+
+
+@event.listens_for(Question, 'after_update')
+def question_updated(mapper, connection, question):
+  state = inspect(question)
+  if state.attrs.question.history.has_changes() or state.attrs.answer.history.has_changes():
+    record_search_change(question, ('add', question.id, question.question, question.answer))
+
+
+@event.listens_for(Question, 'after_delete')
+def question_deleted(mapper, connection, question):
+  record_search_change(question, ('remove', question.id, None, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_search_changes(session):
+  for change, question_id, question, answer in session.info.pop('search_changes', []):
+    for index in list(indexes):
+      getattr(index, change)(question_id, question, answer)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_search_changes(session):
+  session.info.pop('search_changes', None)
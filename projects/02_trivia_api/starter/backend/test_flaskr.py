@@ -1,10 +1,34 @@
 import os
 import unittest
 import json
+import random
+import time
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
 from flaskr import create_app
 from models import setup_db, Question, Category
+from quiz import QuestionPool, QuizSessions, MemorySessionStore, seen_ids
+from quiz import pools as quiz_pools
+from search import NgramIndex, search_words
+import benchmark
+
+
+class StandInRedis(object):
+    """The few Redis commands the shared stores use, kept in a dict"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key) or 0) + 1
+        return self.data[key]
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -75,6 +99,65 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_categories'])
         self.assertTrue(len(data['categories']))
         
+    def capture_statements(self, client, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.app.app_context():
+            engine = self.db.get_engine(self.app)
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = client.get(url)
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        return res, statements
+
+    def count_queries(self, client, url):
+        res, statements = self.capture_statements(client, url)
+        return res, len(statements)
+
+    def test_categories_cached_with_etag(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+        res, queries = self.count_queries(self.client(), '/categories')
+        self.assertEqual(queries, 0)
+
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+        with self.app.app_context():
+            category = Category(type='Music')
+            self.db.session.add(category)
+            self.db.session.commit()
+            category_id = category.id
+        try:
+            res = self.client().get('/categories', headers={'If-None-Match': etag})
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertNotEqual(res.headers['ETag'], etag)
+            self.assertEqual(data['categories'][str(category_id)], 'Music')
+        finally:
+            with self.app.app_context():
+                self.db.session.delete(self.db.session.query(Category).get(category_id))
+                self.db.session.commit()
+
+    def test_categories_shared_through_store(self):
+        store = StandInRedis()
+        first = create_app({'CATEGORY_CACHE_STORE': store})
+        setup_db(first, self.database_path)
+        first.test_client().get('/categories')
+
+        second = create_app({'CATEGORY_CACHE_STORE': store})
+        setup_db(second, self.database_path)
+        res, queries = self.count_queries(second.test_client(), '/categories')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(queries, 0)
+        self.assertEqual(json.loads(res.data)['categories'],
+                         json.loads(self.client().get('/categories').data)['categories'])
+
     def test_get_paginated_questions(self):
         res = self.client().get('/questions')
         data = json.loads(res.data)
@@ -84,6 +167,19 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertTrue(len(data['questions']))
     
+    def test_paginated_questions_limited_in_sql(self):
+        with self.app.app_context():
+            total = Question.query.count()
+        res, statements = self.capture_statements(self.client(), '/questions?page=2')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['total_questions'], total)
+        self.assertEqual(len(data['questions']), min(10, total - 10))
+        self.assertTrue(any('LIMIT' in statement and 'FROM questions' in statement
+                            for statement in statements))
+        self.assertFalse(any('FROM questions' in statement and 'LIMIT' not in statement
+                             and 'count(' not in statement for statement in statements))
+
     def test_404_get_paginated_questions_beyond_limits(self):
         res = self.client().get('/questions/?page=300')
         data = json.loads(res.data)
@@ -176,6 +272,233 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['message'], 'Resource not found')
         
+    def test_quiz_runs_through_category_without_repeats(self):
+        with self.app.app_context():
+            expected = {question.id for question in Question.query.filter(Question.category == '1')}
+        previous = []
+        while True:
+            res = self.client().post('/quizzes', json={
+                'previous_questions': previous,
+                'quiz_category': {'type': 'Science', 'id': '1'}})
+            if res.status_code == 404:
+                break
+            question = json.loads(res.data)['question']
+            self.assertEqual(str(question['category']), '1')
+            self.assertNotIn(question['id'], previous)
+            previous.append(question['id'])
+        self.assertEqual(set(previous), expected)
+
+    def test_quiz_pool_follows_inserts_and_deletes(self):
+        client = self.client()
+        quiz = {'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': 1}}
+        self.assertEqual(client.post('/quizzes', json=quiz).status_code, 200)
+        with self.app.app_context():
+            quiz['previous_questions'] = [
+                question.id for question in Question.query.filter(Question.category == '1')]
+
+        res = client.post('/questions', json=self.new_question)
+        question_id = json.loads(res.data)['created']['id']
+        res = client.post('/quizzes', json=quiz)
+        self.assertEqual(json.loads(res.data)['question']['id'], question_id)
+
+        client.delete('/questions/{}'.format(question_id))
+        res = client.post('/quizzes', json=quiz)
+        self.assertEqual(res.status_code, 404)
+
+    def test_quiz_pool_follows_other_processes_through_store(self):
+        store = StandInRedis()
+        app = create_app({'QUESTION_POOL_STORE': store})
+        setup_db(app, self.database_path)
+        client = app.test_client()
+        quiz = {'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': 1}}
+        self.assertEqual(client.post('/quizzes', json=quiz).status_code, 200)
+
+        # Another process inserts a question: no ORM event fires here, only
+        # the shared version moves
+        with app.app_context():
+            quiz['previous_questions'] = [
+                question.id for question in Question.query.filter(Question.category == '1')]
+            question_id = self.db.session.execute(Question.__table__.insert().values(
+                question='Asked elsewhere?', answer='Yes', category='1',
+                difficulty=1).returning(Question.id)).scalar()
+            self.db.session.commit()
+        store.incr('trivia:questions:version')
+        try:
+            res = client.post('/quizzes', json=quiz)
+            self.assertEqual(json.loads(res.data)['question']['id'], question_id)
+        finally:
+            # A write of this process keeps its pool current without a reload
+            res = client.delete('/questions/{}'.format(question_id))
+            self.assertEqual(res.status_code, 200)
+        pools = [pool for pool in quiz_pools if pool.store is store]
+        self.assertTrue(pools)
+        self.assertEqual(pools[0].version, store.data['trivia:questions:version'])
+
+    def test_400_quiz_with_bad_category(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': 'x'}})
+        self.assertEqual(res.status_code, 400)
+
+    def test_question_pool_draws_uniformly_from_unseen(self):
+        pool = QuestionPool(random.Random(0))
+        pool.ids = {'0': list(range(1, 11))}
+        pool.slots = {'0': {question_id: slot for slot, question_id in enumerate(pool.ids['0'])}}
+        seen = [2, 5, 9, 10, 42]
+        counts = {}
+        for _ in range(6000):
+            question_id = pool.draw(0, seen)
+            counts[question_id] = counts.get(question_id, 0) + 1
+        self.assertEqual(set(counts), {1, 3, 4, 6, 7, 8})
+        self.assertTrue(all(800 < count < 1200 for count in counts.values()))
+        self.assertIsNone(pool.draw(0, range(1, 11)))
+
+        pool.remove(1)
+        self.assertEqual(sorted(pool.ids['0']), list(range(2, 11)))
+        self.assertEqual(pool.draw(0, range(3, 11)), 2)
+
+    def test_quiz_session_asks_each_question_once(self):
+        with self.app.app_context():
+            expected = {question.id for question in Question.query.filter(Question.category == '1')}
+        res = self.client().post('/quizzes', json={'quiz_category': {'type': 'Science', 'id': '1'}})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 201)
+        session_id = data['session_id']
+
+        asked = []
+        while True:
+            res = self.client().post('/quizzes/{}/next'.format(session_id))
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            if data['question'] is None:
+                break
+            self.assertNotIn(data['question']['id'], asked)
+            asked.append(data['question']['id'])
+            self.assertEqual(data['total_asked'], len(asked))
+        self.assertEqual(set(asked), expected)
+
+    def test_404_quiz_session(self):
+        res = self.client().post('/quizzes/unknown/next')
+        self.assertEqual(res.status_code, 404)
+        res = self.client().post('/quizzes', json={'quiz_category': {'type': 'Science', 'id': 9}})
+        self.assertEqual(res.status_code, 404)
+
+    def test_quiz_session_shared_through_store(self):
+        store = MemorySessionStore()
+        first = create_app({'QUIZ_SESSION_STORE': store})
+        setup_db(first, self.database_path)
+        second = create_app({'QUIZ_SESSION_STORE': store})
+        setup_db(second, self.database_path)
+
+        res = first.test_client().post('/quizzes', json={'quiz_category': {'type': 'ALL', 'id': 0}})
+        session_id = json.loads(res.data)['session_id']
+        first_question = json.loads(
+            first.test_client().post('/quizzes/{}/next'.format(session_id)).data)['question']
+        data = json.loads(second.test_client().post('/quizzes/{}/next'.format(session_id)).data)
+        self.assertEqual(data['total_asked'], 2)
+        self.assertNotEqual(data['question']['id'], first_question['id'])
+
+    def test_memory_session_store_expires(self):
+        store = MemorySessionStore()
+        store.set('old', 'a', ex=0.01)
+        store.set('kept', 'b', ex=60)
+        time.sleep(0.02)
+        self.assertIsNone(store.get('old'))
+        self.assertEqual(store.get('kept'), 'b')
+        self.assertEqual(list(store.entries), ['kept'])
+
+    def test_seen_ids_bitset(self):
+        self.assertEqual(list(seen_ids(0)), [])
+        self.assertEqual(list(seen_ids((1 << 3) | (1 << 500) | 1)), [0, 3, 500])
+
+    def test_quiz_session_size_follows_questions_asked(self):
+        store = MemorySessionStore()
+        with self.app.app_context():
+            question = Question(question='Which id is this?', answer='A large one',
+                                category=1, difficulty=1)
+            question.id = 10 ** 6
+            question.insert()
+            sessions = QuizSessions(QuestionPool(), store)
+            session_id = sessions.start(1)
+            sessions.pool.load()
+            sessions.save(session_id, {'category': 1, 'seen': [
+                question_id for question_id in sessions.pool.ids['1'] if question_id != 10 ** 6]})
+            next_question, asked = sessions.next_question(session_id)
+            self.assertEqual(next_question.id, 10 ** 6)
+            question.delete()
+        # A bitset would need 10 ** 6 bits; the id list stays short
+        self.assertLess(len(store.get('trivia:quiz:' + session_id)), 200)
+
+        # Sessions stored as a hex bitset by earlier versions still load
+        store.set('trivia:quiz:old', json.dumps({'category': 0, 'seen': format((1 << 2) | (1 << 5), 'x')}))
+        self.assertEqual(QuizSessions(QuestionPool(), store).load('old')['seen'], [2, 5])
+
+    def test_benchmark_pagination_reads_one_page(self):
+        results = benchmark.pagination(self.app, repeat=1)
+        with self.app.app_context():
+            self.assertEqual(results['rows'], Question.query.count())
+        self.assertEqual(results['first_page']['page'], 1)
+        self.assertIn('p95_ms', results['last_page'])
+        self.assertLess(results['page_query']['peak_kib'], results['old_paginate_baseline']['peak_kib'])
+
+    def test_benchmark_quiz_sends_no_seen_ids(self):
+        results = benchmark.quiz(self.app, repeat=1, steps=5, quizzes=1)
+        self.assertEqual(results['session']['quiz_body_bytes'], 0)
+        baseline = results['previous_questions_baseline']
+        self.assertGreater(baseline['last_step_body_bytes'], baseline['first_step_body_bytes'])
+        self.assertIn('p95_ms', results['session']['last_50_steps'])
+
+    def test_search_ranks_question_matches_first(self):
+        with self.app.app_context():
+            in_answer = Question(question='Which insect is last in the dictionary?',
+                                 answer='Zyzzyva', category=1, difficulty=3)
+            in_question = Question(question='What is a zyzzyva?',
+                                   answer='A weevil', category=1, difficulty=3)
+            in_answer.insert()
+            in_question.insert()
+            ids = [in_question.id, in_answer.id]
+        try:
+            res = self.client().post('/questions/search', json={'searchTerm': 'Zyzzy'})
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual([question['id'] for question in data['questions']], ids)
+            self.assertEqual(data['total_questions'], 2)
+
+            # A substring that does not start a word does not match
+            res = self.client().post('/questions/search', json={'searchTerm': 'zzyva'})
+            self.assertEqual(json.loads(res.data)['total_questions'], 0)
+
+            res = self.client().get('/questions/search?searchTerm=zyzzyva+weevil&page=2')
+            data = json.loads(res.data)
+            self.assertEqual(data['questions'], [])
+            self.assertEqual(data['total_questions'], 1)
+        finally:
+            with self.app.app_context():
+                for question in Question.query.filter(Question.id.in_(ids)):
+                    question.delete()
+
+    def test_400_search_without_term(self):
+        res = self.client().post('/questions/search', json={})
+        self.assertEqual(res.status_code, 400)
+
+    def test_ngram_index_search(self):
+        index = NgramIndex()
+        index.load([
+            (1, 'What is the title of the film?', 'Edward Scissorhands'),
+            (2, 'Whose autobiography is entitled a book?', 'Maya Angelou'),
+            (3, 'Which film won?', 'Apollo 13 has a title'),
+        ])
+        self.assertEqual(index.search(search_words('Title')), [1, 3])
+        self.assertEqual(index.search(search_words('film title')), [1, 3])
+        # Only word prefixes match, as in Postgres: not "entitled" or "Scissorhands"
+        self.assertEqual(index.search(search_words('titled')), [])
+        self.assertEqual(index.search(search_words('hands')), [])
+        self.assertEqual(index.search(search_words('scissor')), [1])
+        self.assertEqual(index.search(search_words('zzz')), [])
+
+        index.remove(1)
+        index.add(4, 'A new title question', 'Yes')
+        self.assertEqual(index.search(search_words('title')), [4, 3])
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -10,7 +10,8 @@ class QuizView extends Component {
     super(props);
     this.state = {
         quizCategory: null,
-        previousQuestions: [], 
+        quizSession: null,
+        questionsAsked: 0,
         showAnswer: false,
         categories: {},
         numCorrect: 0,
@@ -36,7 +37,31 @@ class QuizView extends Component {
   }
 
   selectCategory = ({type, id=0}) => {
-    this.setState({quizCategory: {type, id}}, this.getNextQuestion)
+    this.setState({quizCategory: {type, id}}, this.startQuiz)
+  }
+
+  startQuiz = () => {
+    $.ajax({
+      url: '/quizzes',
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        quiz_category: this.state.quizCategory
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({ quizSession: result.session_id }, this.getNextQuestion)
+        return;
+      },
+      error: (error) => {
+        alert('Unable to start the quiz. Please try your request again')
+        return;
+      }
+    })
   }
 
   handleChange = (event) => {
@@ -44,18 +69,10 @@ class QuizView extends Component {
   }
 
   getNextQuestion = () => {
-    const previousQuestions = [...this.state.previousQuestions]
-    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
-
     $.ajax({
-      url: '/quizzes', //DONE: update request URL
+      url: `/quizzes/${this.state.quizSession}/next`,
       type: "POST",
       dataType: 'json',
-      contentType: 'application/json',
-      data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
-      }),
       xhrFields: {
         withCredentials: true
       },
@@ -63,7 +80,7 @@ class QuizView extends Component {
       success: (result) => {
         this.setState({
           showAnswer: false,
-          previousQuestions: previousQuestions,
+          questionsAsked: result.question ? result.total_asked : this.state.questionsAsked,
           currentQuestion: result.question,
           guess: '',
           forceEnd: result.question ? false : true
@@ -90,7 +107,8 @@ class QuizView extends Component {
   restartGame = () => {
     this.setState({
       quizCategory: null,
-      previousQuestions: [], 
+      quizSession: null,
+      questionsAsked: 0,
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
@@ -150,7 +168,7 @@ class QuizView extends Component {
   }
 
   renderPlay(){
-    return this.state.previousQuestions.length === questionsPerPlay || this.state.forceEnd
+    return this.state.questionsAsked > questionsPerPlay || this.state.forceEnd
       ? this.renderFinalScore()
       : this.state.showAnswer 
         ? this.renderCorrectAnswer()